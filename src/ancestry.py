@@ -0,0 +1,225 @@
+"""
+SpamFisher Process Ancestry
+Parent/child index of every process, updated with births and deaths
+only, that knows which processes descend from a watched remote access
+tool and which of those are shells
+"""
+
+import logging
+import time
+from typing import Dict, List, Mapping, Optional, Set
+import psutil
+from config import SETTINGS, SHELL_PROCESSES
+
+
+# More births than this in one cycle are read with one process_iter() walk instead of per process
+BULK_BIRTHS = 32
+
+SHELLS = frozenset(name.casefold() for name in SHELL_PROCESSES)
+
+
+def bulk_ppids() -> Dict[int, int]:
+    """Parent of every process in one pass"""
+    return {process.pid: process.info['ppid'] or 0 for process in psutil.process_iter(['ppid'])}
+
+
+class ProcessTree:
+    """
+    Built from psutil.pids() and the monitor's name cache once per scan.
+    A cycle without births or deaths does one dict lookup and one name
+    comparison per PID; each birth is placed under its parent, and
+    checked for shell-under-tool lineage, in O(1).
+    """
+    
+    def __init__(self):
+        self.parent: Dict[int, int] = {}  # pid -> ppid
+        self.children: Dict[int, Set[int]] = {}  # pid -> child pids (only pids that have children)
+        self.names: Dict[int, str] = {}  # pid -> case-folded name when the pid was placed
+        self.tool_of: Dict[int, int] = {}  # pid -> watched tool it runs under (a tool maps to itself)
+        self.members: Dict[int, Set[int]] = {}  # tool pid -> pids below it, orphans included
+        self.shells: Dict[int, Set[int]] = {}  # tool pid -> the members that are shells
+        self.changed: Set[int] = set()  # tools whose members changed since take_changed()
+        
+    def update(self, pids: List[int], names: Mapping[int, tuple], watched: Mapping[int, object]):
+        """Apply the births and deaths since the previous cycle"""
+        parent = self.parent
+        known_names = self.names
+        births = []
+        for pid in pids:
+            known = known_names.get(pid)
+            if known is not None:
+                name = names.get(pid)
+                if name is None or name[1] == known:
+                    continue
+                self.remove(pid)  # PID reused by another program
+            births.append(pid)
+            
+        if births:
+            ppids = bulk_ppids() if len(births) > BULK_BIRTHS else None
+            # Place every birth before resolving lineage, so order within a cycle does not matter
+            for pid in births:
+                self.place(pid, names, ppids)
+            for pid in births:
+                self.inherit(pid, watched)
+                
+        if len(parent) > len(pids):
+            alive = set(pids)
+            for pid in [pid for pid in parent if pid not in alive]:
+                self.remove(pid)
+                
+        # Processes that became, or stopped being, watched after they were placed
+        for pid in watched:
+            if self.tool_of.get(pid) != pid and pid in parent:
+                self.adopt(pid)
+        if len(self.members) > len(watched):
+            for tool in [tool for tool in self.members if tool not in watched]:
+                self.disown(tool)
+                
+    def place(self, pid: int, names: Mapping[int, tuple], ppids: Optional[Dict[int, int]]):
+        """Add one process under its parent"""
+        if ppids is not None:
+            ppid = ppids.get(pid, 0)
+        else:
+            try:
+                ppid = psutil.Process(pid).ppid()
+            except psutil.Error:
+                ppid = 0
+        name = names.get(pid)
+        self.parent[pid] = ppid
+        self.names[pid] = name[1] if name is not None else ''
+        siblings = self.children.get(ppid)
+        if siblings is None:
+            self.children[ppid] = {pid}
+        else:
+            siblings.add(pid)
+            
+    def inherit(self, pid: int, watched: Mapping[int, object]):
+        """A new process joins the tool its parent runs under"""
+        if pid in watched:
+            self.adopt(pid)
+            return
+        tool = self.tool_of.get(self.parent[pid])
+        if tool is not None:
+            self.join(pid, tool)
+            
+    def join(self, pid: int, tool: int):
+        previous = self.tool_of.get(pid)
+        if previous is not None:
+            self.leave(pid, previous)
+        self.tool_of[pid] = tool
+        self.members[tool].add(pid)
+        self.changed.add(tool)
+        if self.names[pid] in SHELLS:
+            self.shells[tool].add(pid)
+            message = (f"Shell {self.names[pid]} (PID {pid}) running under "
+                       f"{self.names.get(tool)} (PID {tool})")
+            print(f"[LINEAGE] {message}")
+            if SETTINGS['log_events']:
+                logging.warning(message)
+                
+    def leave(self, pid: int, tool: int):
+        del self.tool_of[pid]
+        self.members[tool].discard(pid)
+        self.shells[tool].discard(pid)
+        self.changed.add(tool)
+        
+    def adopt(self, tool: int):
+        """Mark a newly watched process and everything below it"""
+        previous = self.tool_of.get(tool)
+        if previous is not None:
+            self.leave(tool, previous)  # A tool started by another tool is tracked on its own
+        self.tool_of[tool] = tool
+        self.members[tool] = set()
+        self.shells[tool] = set()
+        self.changed.add(tool)
+        for pid in self.descendants(tool):
+            self.join(pid, tool)
+            
+    def disown(self, tool: int):
+        """Forget a process that is no longer watched"""
+        for pid in self.members.pop(tool, ()):
+            del self.tool_of[pid]
+        self.shells.pop(tool, None)
+        self.tool_of.pop(tool, None)
+        self.changed.discard(tool)
+        
+    def remove(self, pid: int):
+        """A process is gone; its children stay, as orphans"""
+        tool = self.tool_of.get(pid)
+        if tool == pid:
+            self.disown(pid)
+        elif tool is not None:
+            self.leave(pid, tool)
+        ppid = self.parent.pop(pid, None)
+        siblings = self.children.get(ppid)
+        if siblings is not None:
+            siblings.discard(pid)
+            if not siblings:
+                del self.children[ppid]
+        self.children.pop(pid, None)
+        self.names.pop(pid, None)
+        
+    def descendants(self, pid: int) -> List[int]:
+        """Every live process below pid, from the index"""
+        result = []
+        seen = {pid}  # Guards against ppid cycles from reused PIDs
+        stack = [pid]
+        while stack:
+            for child in self.children.get(stack.pop(), ()):
+                if child not in seen:
+                    seen.add(child)
+                    result.append(child)
+                    stack.append(child)
+        return result
+        
+    def members_of(self, tool: int) -> Set[int]:
+        """Processes running under a watched tool, including orphaned descendants"""
+        return self.members.get(tool, set())
+        
+    def shells_under(self, tool: int) -> int:
+        """Number of shells running under a watched process"""
+        shells = self.shells.get(tool)
+        return len(shells) if shells else 0
+        
+    def take_changed(self) -> Set[int]:
+        """Tools whose members changed since the previous call"""
+        changed = self.changed
+        if changed:
+            self.changed = set()
+        return changed
+
+
+def benchmark(cycles: int = 50):
+    """Time building the index and keeping it up to date against walking the process table"""
+    names = {}
+    for process in psutil.process_iter(['name']):
+        name = process.info['name'] or ''
+        names[process.pid] = (name, name.casefold())
+    pids = psutil.pids()
+    
+    print(f"SpamFisher ancestry benchmark ({len(pids)} processes, {cycles} cycles)")
+    tree = ProcessTree()
+    started = time.perf_counter()
+    tree.update(pids, names, {})
+    print(f"  initial build                          {(time.perf_counter() - started) * 1000:8.2f} ms")
+    
+    started = time.perf_counter()
+    for _ in range(cycles):
+        tree.update(pids, names, {})
+    print(f"  unchanged cycle                        {(time.perf_counter() - started) / cycles * 1000:8.3f} ms")
+    
+    root = psutil.Process(1 if 1 in names else pids[0])
+    started = time.perf_counter()
+    for _ in range(cycles):
+        root.children(recursive=True)
+    walk = (time.perf_counter() - started) / cycles
+    started = time.perf_counter()
+    for _ in range(cycles):
+        tree.descendants(root.pid)
+    index = (time.perf_counter() - started) / cycles
+    print(f"  descendants via children(recursive)    {walk * 1000:8.3f} ms")
+    print(f"  descendants via index                  {index * 1000:8.3f} ms")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,185 @@
+"""
+SpamFisher Assets
+Tray icon and warning screen layouts rendered once per process, keyed by
+language and screen DPI, and prepared in the background at startup
+"""
+
+import time
+from typing import Dict
+from config import SETTINGS, WARNING_MESSAGES
+
+
+BASE_DPI = 96  # Pixel sizes in the layout are given at this DPI
+COMMON_DPIS = (96, 120, 144, 192)  # 100%, 125%, 150% and 200% scaling
+
+# Rendered assets, keyed by size and by (language, dpi)
+_icons = {}
+_layouts = {}
+
+
+def draw_tray_icon(size: int = 64):
+    """Draw the fisherman icon with PIL"""
+    from PIL import Image, ImageDraw
+    
+    # Coordinates are for 64x64 and scaled to the requested size
+    def s(*values):
+        return [v * size // 64 for v in values]
+        
+    def w(width):
+        return max(1, width * size // 64)
+        
+    image = Image.new('RGB', (size, size), (46, 125, 50))  # Green background
+    draw = ImageDraw.Draw(image)
+    
+    # Draw fisherman silhouette in white
+    # Head (circle)
+    draw.ellipse(s(26, 10, 38, 22), fill='white')
+    
+    # Body (rectangle)
+    draw.rectangle(s(28, 22, 36, 38), fill='white')
+    
+    # Arms - left arm holding fishing rod
+    draw.line(s(28, 26, 18, 24), fill='white', width=w(3))
+    
+    # Fishing rod
+    draw.line(s(18, 24, 12, 8), fill='#8B4513', width=w(2))  # Brown rod
+    
+    # Fishing line
+    draw.line(s(12, 8, 45, 35), fill='white', width=w(1))
+    
+    # Hook at end of line
+    draw.arc(s(43, 33, 47, 40), start=0, end=270, fill='white', width=w(2))
+    
+    # Legs
+    draw.line(s(30, 38, 26, 50), fill='white', width=w(3))
+    draw.line(s(34, 38, 38, 50), fill='white', width=w(3))
+    
+    # Water line at bottom (blue waves)
+    for left in (0, 18, 36, 54):
+        draw.arc(s(left, 48, left + 20, 58), start=0, end=180, fill='#2196F3', width=w(2))
+        
+    return image
+
+
+def tray_icon(size: int = 64):
+    """The tray icon, drawn on first use"""
+    image = _icons.get(size)
+    if image is None:
+        image = _icons[size] = draw_tray_icon(size)
+    return image
+
+
+def build_warning_layout(language: str, dpi: int) -> Dict:
+    """
+    Resolve the warning screen into a flat list of widgets with their
+    texts, font tuples and pixel sizes for one language and DPI. Fonts
+    are passed to Tk as tuples, so no named font objects are created.
+    """
+    messages = WARNING_MESSAGES[language]
+    scale = dpi / BASE_DPI
+    
+    def px(value):
+        return max(1, round(value * scale))
+        
+    def label(role, text, font, fg, pady=0, **extra):
+        options = dict({'text': text, 'font': font, 'bg': '#1a1a1a', 'fg': fg}, **extra)
+        if pady:
+            options['pady'] = px(pady)
+        if 'wraplength' in options:
+            options['wraplength'] = px(options['wraplength'])
+        return {'widget': 'label', 'role': role, 'parent': 'container', 'options': options, 'pack': {}}
+        
+    def separator(role):
+        return {'widget': 'frame', 'role': role, 'parent': 'container',
+                'options': {'bg': '#444444', 'height': px(2)},
+                'pack': {'fill': 'x', 'padx': px(50), 'pady': px(20)}}
+                
+    steps = '\n\n'.join(messages[f'step{i}'] for i in range(1, 5))
+    widgets = [
+        label('title', messages['title'], ('Arial', 32, 'bold'), '#ff4444', 20),
+        label('connection', messages['connection_from'], ('Arial', 18, 'bold'), '#ffaa00', 10),
+        separator('separator'),
+        label('how_scam_works', messages['how_scam_works'], ('Arial', 16, 'bold'), '#ffffff', 10),
+        label('steps', steps, ('Arial', 14), '#cccccc', 10, justify='left'),
+        label('warning1', messages['warning1'], ('Arial', 15, 'bold'), '#ff6666', 10, wraplength=800),
+        label('warning2', messages['warning2'], ('Arial', 15, 'bold'), '#ff6666', 5, wraplength=800),
+        separator('separator2'),
+        {'widget': 'frame', 'role': 'buttons', 'parent': 'container',
+         'options': {'bg': '#1a1a1a'}, 'pack': {'pady': px(20)}},
+        {'widget': 'button', 'role': 'block', 'parent': 'buttons',
+         'options': {'text': messages['block_button'], 'font': ('Arial', 20, 'bold'),
+                     'bg': '#ff4444', 'fg': '#ffffff',
+                     'activebackground': '#cc0000', 'activeforeground': '#ffffff',
+                     'padx': px(40), 'pady': px(20), 'cursor': 'hand2', 'relief': 'raised', 'bd': px(5)},
+         'pack': {'pady': px(10)}},
+        {'widget': 'button', 'role': 'allow', 'parent': 'buttons',
+         'options': {'text': messages['allow_button'], 'font': ('Arial', 14),
+                     'bg': '#333333', 'fg': '#999999',
+                     'activebackground': '#444444', 'activeforeground': '#ffffff',
+                     'padx': px(20), 'pady': px(10), 'cursor': 'hand2', 'relief': 'flat'},
+         'pack': {'pady': px(10)}},
+        label('advice', messages['advice'], ('Arial', 13), '#888888', 20, wraplength=800),
+        label('session', '', ('Arial', 12), '#666666'),
+    ]
+    return {'language': language, 'dpi': dpi, 'widgets': widgets}
+
+
+def warning_layout(language: str, dpi: int) -> Dict:
+    """Warning layout for a language and DPI, built on first use"""
+    layout = _layouts.get((language, dpi))
+    if layout is None:
+        layout = _layouts[(language, dpi)] = build_warning_layout(language, dpi)
+    return layout
+
+
+def prewarm(language: str = None):
+    """Render the tray icon and the warning layouts for the common DPIs ahead of time"""
+    language = language or SETTINGS['default_language']
+    try:
+        tray_icon()
+    except ImportError:
+        pass  # PIL not installed: no tray icon either
+    for dpi in COMMON_DPIS:
+        warning_layout(language, dpi)
+
+
+def benchmark(iterations: int = 200):
+    """Compare rendering the assets with reusing them, and time the warning to visible"""
+    print(f"SpamFisher asset benchmark ({iterations} runs)")
+    prewarm()
+    language = SETTINGS['default_language']
+    
+    def measure(label, fn):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        print(f"  {label:<40} {(time.perf_counter() - start) / iterations * 1000:8.3f} ms")
+        
+    measure('tray icon: draw with PIL', draw_tray_icon)
+    measure('tray icon: already rendered', tray_icon)
+    measure('warning layout: build', lambda: build_warning_layout(language, BASE_DPI))
+    measure('warning layout: already built', lambda: warning_layout(language, BASE_DPI))
+    
+    # Time-to-visible needs a display
+    try:
+        from ui import WarningScreen
+        from records import Threat, pack_ip
+        
+        visible = []
+        
+        def on_visible(seconds, screen):
+            visible.append(seconds)
+            screen.root.after(0, screen.root.destroy)
+            
+        for _ in range(3):
+            threat = Threat('AnyDesk', 'AnyDesk.exe', 0, pack_ip('192.0.2.1'), 7070, 'Unknown', 1.0, time.time())
+            screen = WarningScreen(threat, lambda info: None, lambda info: None)
+            screen.on_visible = lambda seconds, screen=screen: on_visible(seconds, screen)
+            screen.show()
+        print(f"  {'warning: show() to visible':<40} " + ', '.join(f"{s * 1000:.1f}" for s in visible) + " ms")
+    except Exception as e:
+        print(f"  warning time-to-visible skipped ({type(e).__name__}: {e})")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,237 @@
+"""
+SpamFisher Session Checkpoint
+Runtime state that would otherwise be lost on restart - session allows,
+alerted connections and the geolocation cache - in a small binary
+snapshot, replaced atomically, so a restarted agent resumes where the
+previous one stopped without warning twice about the same session
+"""
+
+import os
+import struct
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+import psutil
+
+
+MAGIC = b'SFCKPT\0\0'
+VERSION = 1
+
+# magic, format version, crc32 of the compressed body, compressed size
+HEADER = struct.Struct('<8sIII')
+
+# Body: saved_at, then three sections, each a count followed by its records
+SAVED_AT = struct.Struct('<d')
+COUNT = struct.Struct('<I')
+ALLOWED = struct.Struct('<Idd')  # pid, process create time, expires at (0 = no expiry)
+ALERTED = struct.Struct('<Id16s')  # pid, process create time, remote ip (records.pack_ip)
+GEO = struct.Struct('<16sqBB')  # ip, expires at (wall clock, whole seconds), then country and code lengths
+
+
+class CheckpointError(Exception):
+    """The snapshot is missing, damaged or from another format version"""
+
+
+class SessionState:
+    """What a checkpoint holds, with PIDs already checked against the running processes"""
+    
+    def __init__(self, saved_at: float = 0.0):
+        self.saved_at = saved_at
+        self.allowed: List[Tuple[int, float]] = []  # (pid, expires at or 0)
+        self.alerted: List[Tuple[int, int]] = []  # records.Threat.connection_key
+        self.geo: List[Tuple[int, str, str, float]] = []  # (ip, country, code, expires at)
+
+
+def create_time(pid: int, identities: Dict[int, float]) -> Optional[float]:
+    """Process start time, remembered per PID so a checkpoint does not ask twice"""
+    started = identities.get(pid)
+    if started is None:
+        try:
+            started = identities[pid] = psutil.Process(pid).create_time()
+        except psutil.Error:
+            return None
+    return started
+
+
+def encode(allowed: Iterable[Tuple[int, float]], alerted: Iterable[Tuple[int, int]],
+           geo: Iterable[Tuple[int, str, str, float]], identities: Dict[int, float]) -> bytes:
+    """Uncompressed body. Entries of processes that have exited are left out."""
+    parts = []
+    records = []
+    for pid, expires_at in allowed:
+        started = create_time(pid, identities)
+        if started is not None:
+            records.append(ALLOWED.pack(pid, started, expires_at or 0.0))
+    parts.append(COUNT.pack(len(records)))
+    parts.extend(records)
+    
+    records = []
+    for pid, remote_ip in alerted:
+        started = create_time(pid, identities)
+        if started is not None:
+            records.append(ALERTED.pack(pid, started, remote_ip.to_bytes(16, 'big')))
+    parts.append(COUNT.pack(len(records)))
+    parts.extend(records)
+    
+    records = []
+    for ip, country, code, expires_at in geo:
+        country = (country or '').encode('utf-8')[:255]
+        code = (code or '').encode('utf-8')[:255]
+        records.append(GEO.pack(ip.to_bytes(16, 'big'), int(expires_at), len(country), len(code)) + country + code)
+    parts.append(COUNT.pack(len(records)))
+    parts.extend(records)
+    return b''.join(parts)
+
+
+def decode(body: bytes, now: float = None) -> SessionState:
+    """Parse a body, dropping entries whose process is gone or was replaced, and expired ones"""
+    now = time.time() if now is None else now
+    state = SessionState(SAVED_AT.unpack_from(body, 0)[0])
+    offset = SAVED_AT.size
+    
+    running = {}  # pid -> current create time (None if gone), one lookup per PID
+    
+    def alive(pid, started):
+        if pid not in running:
+            try:
+                running[pid] = psutil.Process(pid).create_time()
+            except psutil.Error:
+                running[pid] = None
+        current = running[pid]
+        return current is not None and abs(current - started) < 0.01  # Same process, not a reused PID
+        
+    count = COUNT.unpack_from(body, offset)[0]
+    offset += COUNT.size
+    for _ in range(count):
+        pid, started, expires_at = ALLOWED.unpack_from(body, offset)
+        offset += ALLOWED.size
+        if (not expires_at or expires_at > now) and alive(pid, started):
+            state.allowed.append((pid, expires_at))
+            
+    count = COUNT.unpack_from(body, offset)[0]
+    offset += COUNT.size
+    for _ in range(count):
+        pid, started, remote_ip = ALERTED.unpack_from(body, offset)
+        offset += ALERTED.size
+        if alive(pid, started):
+            state.alerted.append((pid, int.from_bytes(remote_ip, 'big')))
+            
+    count = COUNT.unpack_from(body, offset)[0]
+    offset += COUNT.size
+    for _ in range(count):
+        ip, expires_at, country_size, code_size = GEO.unpack_from(body, offset)
+        offset += GEO.size
+        country = body[offset:offset + country_size].decode('utf-8', 'replace')
+        offset += country_size
+        code = body[offset:offset + code_size].decode('utf-8', 'replace')
+        offset += code_size
+        if expires_at > now:
+            state.geo.append((int.from_bytes(ip, 'big'), country, code, expires_at))
+    return state
+
+
+class Checkpoint:
+    """
+    Writes snapshots to a temporary file and renames it over the previous
+    one, so a crash leaves either the old or the new snapshot, never half
+    of one. A snapshot identical to the last one written is skipped.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.last_body = None
+        self.identities: Dict[int, float] = {}  # pid -> create time, for the PIDs in the last snapshot
+        self.stats = {'saved': 0, 'unchanged': 0, 'bytes': 0, 'last_save_ms': None, 'restored': None}
+        
+    def save(self, allowed: List[Tuple[int, float]], alerted: List[Tuple[int, int]],
+             geo: List[Tuple[int, str, str, float]]) -> bool:
+        """Write a snapshot if the state changed; returns True if a file was written"""
+        started = time.perf_counter()
+        body = encode(allowed, alerted, geo, self.identities)
+        if len(self.identities) > len(allowed) + len(alerted):
+            self.forget({pid for pid, _ in allowed} | {pid for pid, _ in alerted})
+        if body == self.last_body:
+            self.stats['unchanged'] += 1
+            return False
+            
+        compressed = zlib.compress(SAVED_AT.pack(time.time()) + body, 6)
+        data = HEADER.pack(MAGIC, VERSION, zlib.crc32(compressed), len(compressed)) + compressed
+        temp = f"{self.path}.tmp"
+        with open(temp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.path)
+        
+        self.last_body = body
+        self.stats['saved'] += 1
+        self.stats['bytes'] = len(data)
+        self.stats['last_save_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return True
+        
+    def forget(self, pids):
+        """Drop cached start times of PIDs no longer in the state"""
+        for pid in [pid for pid in self.identities if pid not in pids]:
+            del self.identities[pid]
+            
+    def load(self) -> SessionState:
+        """Read and verify the snapshot (raises CheckpointError)"""
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            raise CheckpointError("no checkpoint")
+        except OSError as e:
+            raise CheckpointError(str(e))
+            
+        if len(data) < HEADER.size:
+            raise CheckpointError("truncated header")
+        magic, version, crc, size = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise CheckpointError(f"not a version {VERSION} checkpoint")
+        compressed = data[HEADER.size:]
+        if len(compressed) != size or zlib.crc32(compressed) != crc:
+            raise CheckpointError("checksum mismatch")
+        try:
+            state = decode(zlib.decompress(compressed))
+        except (zlib.error, struct.error) as e:
+            raise CheckpointError(f"damaged body: {e}")
+        self.stats['restored'] = {'allowed': len(state.allowed), 'alerted': len(state.alerted),
+                                  'geo': len(state.geo), 'age': round(time.time() - state.saved_at, 1)}
+        return state
+
+
+def benchmark(entries: int = 200, geo_entries: int = 1024, runs: int = 50):
+    """Time saving and loading a snapshot of a busy session"""
+    import tempfile
+    from records import pack_ip
+    
+    pid = os.getpid()
+    allowed = [(pid, time.time() + 3600)] * entries
+    alerted = [(pid, pack_ip(f"198.51.{i // 256}.{i % 256}")) for i in range(entries)]
+    geo = [(pack_ip(f"203.0.{i // 256}.{i % 256}"), 'Germany', 'DE', time.time() + 3600) for i in range(geo_entries)]
+    
+    with tempfile.TemporaryDirectory(prefix='sf-ckpt-') as root:
+        checkpoint = Checkpoint(os.path.join(root, 'session.ckpt'))
+        print(f"SpamFisher checkpoint benchmark ({entries} allows, {entries} alerts, {geo_entries} cached countries)")
+        
+        started = time.perf_counter()
+        for i in range(runs):
+            checkpoint.last_body = None
+            checkpoint.save(allowed, alerted, geo)
+        print(f"  save (changed state)       {(time.perf_counter() - started) / runs * 1000:8.2f} ms, "
+              f"{checkpoint.stats['bytes']} bytes")
+              
+        started = time.perf_counter()
+        for _ in range(runs):
+            checkpoint.save(allowed, alerted, geo)
+        print(f"  save (unchanged, skipped)  {(time.perf_counter() - started) / runs * 1000:8.2f} ms")
+        
+        started = time.perf_counter()
+        for _ in range(runs):
+            checkpoint.load()
+        print(f"  load and verify            {(time.perf_counter() - started) / runs * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -3,7 +3,9 @@ SpamFisher Configuration
 Database of known remote access software and their characteristics
 """
 
-# Known remote access software to monitor
+# Known remote access software to monitor. This is the built-in fallback;
+# signatures.json (SETTINGS['signatures_file']) is loaded over it at startup
+# and reloaded while running when it changes.
 REMOTE_ACCESS_SOFTWARE = {
     'anydesk': {
         'process_names': ['AnyDesk.exe', 'anydesk.exe'],
@@ -42,6 +44,36 @@ REMOTE_ACCESS_SOFTWARE = {
     }
 }
 
+# Shells whose appearance under a remote access tool is suspicious (see ancestry.py)
+SHELL_PROCESSES = [
+    'cmd.exe', 'powershell.exe', 'pwsh.exe', 'powershell_ise.exe', 'wscript.exe', 'cscript.exe',
+    'mshta.exe', 'bash.exe', 'wsl.exe', 'sh', 'bash', 'dash', 'zsh', 'fish', 'pwsh'
+]
+
+# Session scoring defaults. Any entry in REMOTE_ACCESS_SOFTWARE may add a
+# 'scoring' dict with the same keys (and a partial 'weights' dict) to tune it.
+SCORING = {
+    'threshold': 1.0,  # Score at which a session is treated as a threat
+    'window': 5,  # Cycles kept in the sliding feature window
+    'baseline_connections': 2,  # Connections kept open while idle (relays)
+    'stream_bytes_per_sec': 250000,  # Sustained I/O that indicates a live desktop stream
+    'byte_rate_cap': 0.8,  # MB/s counted by byte_rate (process I/O also includes disk, pipes and IPC)
+    'rate_step': 20000,  # I/O rate change (bytes/s) that counts as a changed cycle
+    'weights': {
+        'incoming_known': 1.0,  # Incoming connection on a known remote desktop port
+        'incoming_listening': 1.0,  # Incoming connection on a listening port (non-relay)
+        'remote_known': 0.2,  # Per connection to a known remote desktop port
+        'connections': 0.2,  # Per connection above the baseline
+        'distinct_remotes': 0.1,  # Per distinct remote above the baseline
+        'new_remotes': 0.1,  # Per remote not seen in the window
+        'byte_rate': 0.5,  # Per MB/s of process I/O, up to byte_rate_cap
+        'streaming': 0.5,  # I/O above stream_bytes_per_sec with an external connection
+        # byte_rate and streaming together stay under the threshold: the I/O counters
+        # are not network-only, so they only add weight to connection evidence
+        'shell_child': 0.8  # A shell running under the software with an external connection
+    }
+}
+
 # Warning messages in different languages
 WARNING_MESSAGES = {
     'en': {
@@ -56,7 +88,8 @@ WARNING_MESSAGES = {
         'warning2': 'If someone called YOU about a computer problem, it is 100% a scam.',
         'advice': 'Not sure? Call a family member or friend you trust before allowing.',
         'block_button': 'BLOCK THIS CONNECTION',
-        'allow_button': 'I trust this - Allow'
+        'allow_button': 'I trust this - Allow',
+        'session_open': 'This connection has been open for {elapsed}'
     },
     'ro': {
         'title': '⚠️ ACCES LA DISTANȚĂ DETECTAT',
@@ -70,7 +103,8 @@ WARNING_MESSAGES = {
         'warning2': 'Dacă cineva v-a sunat DESPRE o problemă cu computerul, este 100% înșelătorie.',
         'advice': 'Nu sunteți sigur? Sunați un membru al familiei sau prieten de încredere înainte de a permite.',
         'block_button': 'BLOCHEAZĂ CONEXIUNEA',
-        'allow_button': 'Am încredere - Permite'
+        'allow_button': 'Am încredere - Permite',
+        'session_open': 'Această conexiune este deschisă de {elapsed}'
     }
 }
 
@@ -79,8 +113,59 @@ SETTINGS = {
     'default_language': 'en',  # Can be changed to 'ro' for Romanian
     'check_interval': 2,  # Seconds between checks
     'log_events': True,
-    'log_file': 'spamfisher.log'
+    'log_file': 'spamfisher.log',
+    'history_enabled': False,  # Record external connections for forensics
+    'history_file': 'connection_history.bin',
+    'history_capacity': 200000,  # Events kept before the oldest are overwritten
+    'pipeline_queue_size': 32,  # Bound on each queue between scan stages
+    'enrich_workers': 4,  # Concurrent geolocation lookups
+    'action_workers': 2,  # Threads for kill/firewall actions
+    'enrich_max_age': 10,  # Seconds before a queued enrichment is considered stale
+    'signatures_file': 'signatures.json',  # Relative to the source directory
+    'signature_reload_interval': 5,  # Seconds between checks for signature changes
+    'relays_file': 'relays.json',  # Vendor relay ranges, relative to the source directory (relays.py)
+    'policy_file': 'policy.json',  # Detection policy rules, relative to the source directory (rules.py)
+    'integrity_manifest': 'integrity.json',  # Signed source file hashes, relative to the source directory (integrity.py)
+    'integrity_public_key': 'integrity.pub',  # Ed25519 key the manifest is signed with, relative to the source directory
+    'integrity_required': False,  # Fail the integrity check when there is no manifest (otherwise files must exist)
+    'integrity_interval': 30,  # Seconds between background checks (changed files only)
+    'integrity_full_interval': 3600,  # Seconds between checks that hash every file
+    'control_address': None,  # Daemon socket/pipe (None = platform default)
+    'control_key_file': 'control.key',  # Shared secret for control clients
+    'session_address': None,  # Socket/pipe of session UI clients, open to all local users (None = platform default)
+    'recent_threats': 100,  # Threats kept for the control API
+    'allow_ttl': 3600,  # Seconds an ALLOW decision lasts (0 = until the process exits, as before)
+    'expiry_tick': 1,  # Resolution in seconds of allow expiry (timewheel.py)
+    'checkpoint_file': 'session.ckpt',  # Session state snapshot for warm restarts (checkpoint.py)
+    'checkpoint_interval': 5,  # Seconds between checkpoints (skipped when nothing changed)
+    'cpu_budget': 2.0,  # Percent of one core the agent may use on average (governor.py)
+    'memory_budget_mb': 64,  # Resident memory the agent may use
+    'governor_interval': 10,  # Seconds between resource samples
+    'governor_hysteresis': 3,  # Samples in a row over (or well under) budget before the level changes
+    'session_sharding': 'auto',  # Per-shard scan schedule (sessions.py): True, False or 'auto' (2+ shards)
+    'shard_idle_interval': 10,  # Longest gap in seconds between scans of a shard whose processes are quiet
+    'session_warning_timeout': 120,  # Seconds a warning sent to a session client may stay undecided before the agent warns itself
+    'geo_timeout': 5,  # Seconds before a lookup gives up on all providers
+    'geo_hedge_delay': 0.3,  # Seconds to wait on a provider before asking the next one too
+    'geo_breaker_failures': 3,  # Consecutive failures before a provider is skipped
+    'geo_breaker_cooldown': 60,  # Seconds a failing provider is skipped before a retry
+    'geo_cache_size': 1024,  # IPs kept in the geolocation cache
+    'geo_cache_ttl': 3600,  # Seconds a cached country is trusted
+    'socket_backend': 'auto',  # 'proc' (Linux fast path), 'psutil' or 'auto'
+    'flow_tracking': 'auto',  # UDP flows: 'proc' (/proc/net/udp + conntrack), 'psutil', 'auto' or None (off)
+    'flow_idle_timeout': 30,  # Seconds a UDP flow is remembered after it was last seen
+    'process_refresh_cycles': 30,  # Scan cycles between full re-reads of cached process names
+    'status_segment': 'spamfisher_status'  # Shared memory name of the live status block (status.py)
 }
 
 # Geolocation API (using HTTPS for security)
 GEOLOCATION_API = 'https://ipapi.co/{ip}/json/'  # More reliable HTTPS API
+
+# Providers tried by the geolocation manager ('key' / 'code_key' are the country name and
+# ISO code fields in the JSON answer; 'batch_url' accepts a POSTed list of IPs)
+GEOLOCATION_PROVIDERS = [
+    {'name': 'ipapi.co', 'url': 'https://ipapi.co/{ip}/json/', 'key': 'country_name', 'code_key': 'country_code'},
+    {'name': 'ip-api.com', 'url': 'https://ip-api.com/json/{ip}', 'key': 'country', 'code_key': 'countryCode',
+     'batch_url': 'https://ip-api.com/batch?fields=status,country,countryCode,query', 'batch_size': 100},
+    {'name': 'ipwho.is', 'url': 'https://ipwho.is/{ip}', 'key': 'country', 'code_key': 'country_code'},
+]
@@ -0,0 +1,403 @@
+"""
+SpamFisher Control Channel
+Local Unix socket / named pipe API for daemon mode
+"""
+
+import json
+import os
+import secrets
+import socket
+import struct
+import sys
+import tempfile
+import threading
+from multiprocessing.connection import Client, Listener
+from typing import Dict
+from config import SETTINGS
+
+
+# Seconds a session UI client waits for a warning before asking again
+SESSION_POLL = 30
+
+# Largest request accepted, in bytes
+MAX_REQUEST = 64 * 1024
+
+
+def encode(message: Dict) -> bytes:
+    return json.dumps(message, default=str).encode('utf-8')
+
+
+def decode(data: bytes):
+    """Parsed JSON message (None if it is not JSON; dispatch rejects it)"""
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+def default_address() -> str:
+    """Named pipe on Windows, Unix socket elsewhere"""
+    if SETTINGS['control_address']:
+        return SETTINGS['control_address']
+    if sys.platform == 'win32':
+        return r'\\.\pipe\spamfisher'
+    return os.path.join(os.environ.get('XDG_RUNTIME_DIR', '/tmp'), 'spamfisher.sock')
+
+
+def default_session_address() -> str:
+    """Endpoint of the session UI clients, reachable by every local user"""
+    if SETTINGS['session_address']:
+        return SETTINGS['session_address']
+    if sys.platform == 'win32':
+        return r'\\.\pipe\spamfisher-session'
+    # Only root can create entries in /run, so no other user can bind the path first
+    if os.path.isdir('/run'):
+        return '/run/spamfisher-session.sock'
+    return os.path.join(tempfile.gettempdir(), 'spamfisher-session.sock')
+
+
+def peer_pid(conn) -> int:
+    """PID of the process at the other end of an accepted connection (raises OSError)"""
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+        pid = wintypes.ULONG()
+        if not ctypes.windll.kernel32.GetNamedPipeClientProcessId(wintypes.HANDLE(conn.fileno()), ctypes.byref(pid)):
+            raise ctypes.WinError()
+        return pid.value
+    # SO_PEERCRED: pid, uid, gid as the kernel saw them at connect(), in our PID namespace
+    with socket.fromfd(conn.fileno(), socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        pid, _, _ = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+    if pid <= 0:
+        raise OSError("client process unknown (in another PID namespace?)")
+    return pid
+
+
+# Session pipe access for signed-in users: read, write data and set the pipe mode, but
+# not FILE_CREATE_PIPE_INSTANCE (part of GENERIC_WRITE), so no user can serve the pipe name
+SESSION_PIPE_ACCESS = 0x12018B
+SESSION_PIPE_SDDL = f'D:P(A;;GA;;;SY)(A;;GA;;;BA)(A;;GA;;;OW)(A;;{SESSION_PIPE_ACCESS:#x};;;AU)'
+
+if sys.platform == 'win32':
+    import _winapi
+    from multiprocessing.connection import BUFSIZE, PipeConnection, PipeListener
+    
+    class SessionPipeListener(PipeListener):
+        """Named pipe listener whose access list admits every signed-in user (see SESSION_PIPE_SDDL)"""
+        
+        def _new_handle(self, first=False):
+            import ctypes
+            from ctypes import wintypes
+            
+            class SECURITY_ATTRIBUTES(ctypes.Structure):
+                _fields_ = [('nLength', wintypes.DWORD), ('lpSecurityDescriptor', wintypes.LPVOID),
+                            ('bInheritHandle', wintypes.BOOL)]
+                            
+            descriptor = wintypes.LPVOID()
+            if not ctypes.windll.advapi32.ConvertStringSecurityDescriptorToSecurityDescriptorW(
+                    SESSION_PIPE_SDDL, 1, ctypes.byref(descriptor), None):
+                raise ctypes.WinError()
+            try:
+                attributes = SECURITY_ATTRIBUTES(ctypes.sizeof(SECURITY_ATTRIBUTES), descriptor, False)
+                flags = _winapi.PIPE_ACCESS_DUPLEX | _winapi.FILE_FLAG_OVERLAPPED
+                if first:
+                    flags |= _winapi.FILE_FLAG_FIRST_PIPE_INSTANCE
+                create = ctypes.windll.kernel32.CreateNamedPipeW
+                create.restype = wintypes.HANDLE
+                handle = create(self._address, flags,
+                                _winapi.PIPE_TYPE_MESSAGE | _winapi.PIPE_READMODE_MESSAGE | _winapi.PIPE_WAIT,
+                                _winapi.PIPE_UNLIMITED_INSTANCES, BUFSIZE, BUFSIZE,
+                                _winapi.NMPWAIT_WAIT_FOREVER, ctypes.byref(attributes))
+            finally:
+                ctypes.windll.kernel32.LocalFree(descriptor)
+            if handle is None or handle == wintypes.HANDLE(-1).value:
+                raise ctypes.WinError()
+            return handle
+            
+    def session_pipe_client(address: str) -> PipeConnection:
+        """Connect to the session pipe asking only for SESSION_PIPE_ACCESS (what it grants users)"""
+        _winapi.WaitNamedPipe(address, 5000)
+        handle = _winapi.CreateFile(address, SESSION_PIPE_ACCESS, 0, _winapi.NULL, _winapi.OPEN_EXISTING,
+                                    _winapi.FILE_FLAG_OVERLAPPED, _winapi.NULL)
+        _winapi.SetNamedPipeHandleState(handle, _winapi.PIPE_READMODE_MESSAGE, None, None)
+        return PipeConnection(handle)
+
+
+def load_or_create_authkey(path: str = None, create: bool = False) -> bytes:
+    """Shared secret that clients must present; readable by the owner only"""
+    path = path or SETTINGS['control_key_file']
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    if not create:
+        raise FileNotFoundError(f"Control key not found: {path} (is the daemon running?)")
+        
+    key = secrets.token_bytes(32)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+class ControlServer:
+    """
+    Serves requests of the form {'cmd': name, ...} and answers with
+    {'ok': bool, ...}, both JSON in length-prefixed messages (never
+    pickled, so a client can only send data). Each client connection is
+    handled on its own thread.
+    """
+    
+    COMMANDS = ('status', 'threats', 'allow', 'block', 'metrics')
+    
+    def __init__(self, app, address: str = None):
+        self.app = app
+        self.address = address or default_address()
+        self.authkey = None
+        self.listener = None
+        self.thread = None
+        self.running = False
+        
+    def listen(self) -> Listener:
+        """Owner-only socket/pipe; clients must present the control key"""
+        self.authkey = load_or_create_authkey(create=True)
+        listener = Listener(self.address, authkey=self.authkey)
+        if not self.address.startswith('\\\\'):
+            os.chmod(self.address, 0o600)
+        return listener
+        
+    def start(self):
+        """Bind the socket/pipe and start accepting clients"""
+        if not self.address.startswith('\\\\') and os.path.exists(self.address):
+            os.unlink(self.address)  # Stale socket from a previous run
+            
+        self.listener = self.listen()
+        self.running = True
+        self.thread = threading.Thread(target=self.accept_loop, name=f'sf-{type(self).__name__}', daemon=True)
+        self.thread.start()
+        print(f"[CONTROL] Listening on {self.address}")
+        
+    def stop(self):
+        """Stop accepting clients and remove the socket"""
+        self.running = False
+        if self.listener is not None:
+            try:
+                # Wake a blocked accept(); the bogus handshake is rejected (the session endpoint has none)
+                if self.authkey:
+                    Client(self.address, authkey=b'shutdown').close()
+                else:
+                    ControlClient(self.address, session=True).close()
+            except Exception:
+                pass
+            try:
+                self.listener.close()
+            except OSError:
+                pass
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+            
+    def accept_loop(self):
+        while self.running:
+            try:
+                conn = self.listener.accept()
+            except Exception as e:
+                if self.running:
+                    print(f"[CONTROL] Rejected client: {e}")
+                    continue
+                return
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+            
+    def open(self, conn):
+        """Per-connection state passed to dispatch() (raises OSError to refuse the client)"""
+        return None
+        
+    def close(self, client):
+        """The connection of open()'s client has closed"""
+        
+    def serve(self, conn):
+        """Answer requests from one client until it disconnects"""
+        with conn:
+            if not self.running:
+                return
+            try:
+                client = self.open(conn)
+            except OSError as e:
+                print(f"[CONTROL] Rejected client: {e}")
+                return
+            try:
+                while self.running:
+                    try:
+                        request = decode(conn.recv_bytes(MAX_REQUEST))
+                    except (EOFError, OSError):
+                        return  # Disconnected, or a request over MAX_REQUEST
+                    conn.send_bytes(encode(self.dispatch(request, client)))
+            finally:
+                self.close(client)
+                
+    def dispatch(self, request, client=None) -> Dict:
+        """Route one request to the application"""
+        if not isinstance(request, dict) or request.get('cmd') not in self.COMMANDS:
+            return {'ok': False, 'error': f"Unknown command, expected one of {', '.join(self.COMMANDS)}"}
+            
+        cmd = request['cmd']
+        try:
+            if cmd == 'status':
+                return {'ok': True, 'status': self.app.status()}
+            if cmd == 'threats':
+                return {'ok': True, 'threats': self.app.recent_threat_list(request.get('limit'))}
+            if cmd == 'metrics':
+                return {'ok': True, 'metrics': self.app.metrics()}
+            # allow / block
+            threat_id = request.get('id')
+            if not isinstance(threat_id, int):
+                return {'ok': False, 'error': "'id' of a pending threat is required"}
+            ttl = request.get('ttl')
+            if ttl is not None and (not isinstance(ttl, (int, float)) or isinstance(ttl, bool) or ttl < 0):
+                return {'ok': False, 'error': "'ttl' must be a number of seconds (0 = no expiry)"}
+            return self.app.decide(threat_id, cmd, ttl)
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+
+
+class SessionServer(ControlServer):
+    """
+    Serves the warning UI clients in users' sessions (control.py session).
+    Any local user may connect, without the control key: the session of
+    a connection is read from the process at the other end, never taken
+    from the request, and the connection can only receive and decide the
+    warnings routed to that session.
+    """
+    
+    COMMANDS = ('next_warning', 'allow', 'block')
+    
+    def __init__(self, app, address: str = None):
+        super().__init__(app, address or default_session_address())
+        
+    def listen(self) -> Listener:
+        if sys.platform == 'win32':
+            return SessionPipeListener(self.address)
+        if not hasattr(socket, 'SO_PEERCRED'):
+            raise OSError("the peer of a Unix socket cannot be identified on this platform")
+        listener = Listener(self.address)
+        os.chmod(self.address, 0o666)
+        return listener
+        
+    def open(self, conn) -> int:
+        """Attach the connection to the warning router under its peer's session"""
+        from sessions import shard_key, shard_label
+        
+        session = shard_label(shard_key(peer_pid(conn)))
+        if not session:
+            raise OSError("session of the client process unknown")
+        return self.app.router.attach(session)
+        
+    def close(self, client):
+        self.app.detach_session_client(client)
+        
+    def dispatch(self, request, client=None) -> Dict:
+        if not isinstance(request, dict) or request.get('cmd') not in self.COMMANDS:
+            return {'ok': False, 'error': f"Unknown command, expected one of {', '.join(self.COMMANDS)}"}
+            
+        cmd = request['cmd']
+        try:
+            if cmd == 'next_warning':
+                timeout = request.get('timeout', SESSION_POLL)
+                if not isinstance(timeout, (int, float)) or isinstance(timeout, bool) or not 0 <= timeout <= 60:
+                    return {'ok': False, 'error': "'timeout' must be 0-60 seconds"}
+                return {'ok': True, 'session': self.app.router.session_of(client),
+                        'threat': self.app.next_warning(client, timeout)}
+            # allow / block, for the allow_ttl configured by the administrator
+            threat_id = request.get('id')
+            if not isinstance(threat_id, int):
+                return {'ok': False, 'error': "'id' of a pending threat is required"}
+            if not self.app.router.owns(client, threat_id):
+                return {'ok': False, 'error': f"No pending threat with id {threat_id} in this session"}
+            return self.app.decide(threat_id, cmd)
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+
+
+class ControlClient:
+    """Connect to a running daemon (session=True: to its session UI endpoint, no key needed)"""
+    
+    def __init__(self, address: str = None, session: bool = False):
+        if session and sys.platform == 'win32':
+            self.conn = session_pipe_client(address or default_session_address())
+        elif session:
+            self.conn = Client(address or default_session_address())
+        else:
+            self.conn = Client(address or default_address(), authkey=load_or_create_authkey())
+            
+    def request(self, cmd: str, **args) -> Dict:
+        self.conn.send_bytes(encode(dict(args, cmd=cmd)))
+        return json.loads(self.conn.recv_bytes())
+        
+    def close(self):
+        self.conn.close()
+
+
+def run_session_client():
+    """Show the warnings routed to this login session until interrupted"""
+    from records import Threat, pack_ip
+    from ui import WarningScreen
+    
+    client = ControlClient(session=True)
+    
+    def decide(action):
+        def send(threat):
+            response = client.request(action, id=threat.id)
+            print(f"[SESSION] {action} threat {threat.id}: {'ok' if response.get('ok') else response.get('error')}")
+        return send
+        
+    timeout = 0  # The first answer only tells which session the daemon sees this client in
+    try:
+        while True:
+            response = client.request('next_warning', timeout=timeout)
+            if not response.get('ok'):
+                print(f"[SESSION] {response.get('error')}")
+                sys.exit(1)
+            if not timeout:
+                print(f"[SESSION] Showing warnings for session {response['session']}")
+                timeout = SESSION_POLL
+            data = response['threat']
+            if data is None:
+                continue
+            threat = Threat(data['software_name'], data['process_name'], data['pid'], pack_ip(data['remote_ip']),
+                            data['remote_port'], data['country'], data['score'], data['detected_at'])
+            threat.id = data['id']
+            threat.session = response['session']
+            WarningScreen(threat, decide('block'), decide('allow')).show()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+
+def main():
+    """Command line client: control.py status|threats|metrics|allow ID [TTL]|block ID|session"""
+    if len(sys.argv) == 2 and sys.argv[1] == 'session':
+        run_session_client()
+        return
+    if len(sys.argv) < 2 or sys.argv[1] not in ControlServer.COMMANDS:
+        print(f"Usage: python control.py {{{'|'.join(ControlServer.COMMANDS + ('session',))}}} [threat id]")
+        sys.exit(2)
+        
+    cmd = sys.argv[1]
+    args = {}
+    if cmd in ('allow', 'block'):
+        if len(sys.argv) < 3:
+            print(f"Usage: python control.py {cmd} <threat id>")
+            sys.exit(2)
+        args['id'] = int(sys.argv[2])
+        if cmd == 'allow' and len(sys.argv) > 3:
+            args['ttl'] = float(sys.argv[3])  # Seconds; 0 = no expiry
+        
+    client = ControlClient()
+    response = client.request(cmd, **args)
+    client.close()
+    
+    print(json.dumps(response, indent=2, default=str))
+    sys.exit(0 if response.get('ok') else 1)
+
+
+if __name__ == '__main__':
+    main()
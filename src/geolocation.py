@@ -0,0 +1,437 @@
+"""
+SpamFisher Geolocation
+Country lookups across several providers with keep-alive sessions,
+hedged requests, batch resolution, per-provider health tracking and a small cache
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import GEOLOCATION_PROVIDERS, SETTINGS
+
+
+class GeoProvider:
+    """One lookup service with its own keep-alive session, latency and circuit breaker"""
+    
+    def __init__(self, name: str, url: str, key: str, code_key: str = None,
+                 batch_url: str = None, batch_size: int = 100, batch_ip_key: str = 'query'):
+        self.name = name
+        self.url = url
+        self.key = key
+        self.code_key = code_key
+        self.batch_url = batch_url  # POST a JSON list of IPs, get a list of answers back
+        self.batch_size = batch_size
+        self.batch_ip_key = batch_ip_key  # Field echoing the IP in each batch answer
+        self.session = None  # requests.Session, created on first use
+        self.latency = None  # EWMA of successful response times (seconds)
+        self.failures = 0  # Consecutive failures
+        self.open_until = 0.0  # Breaker open (provider skipped) until this monotonic time
+        self.trial = False  # Half-open: one trial request is in flight
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        
+    def get_session(self):
+        with self.lock:
+            if self.session is None:
+                import requests  # Deferred - only needed once a threat is found
+                self.session = requests.Session()
+            return self.session
+            
+    def state(self, now: float) -> str:
+        """'closed' (healthy), 'open' (skipped) or 'half-open' (cooldown over, next request is a trial)"""
+        if self.failures < SETTINGS['geo_breaker_failures']:
+            return 'closed'
+        if now < self.open_until or self.trial:
+            return 'open'
+        return 'half-open'
+        
+    def try_acquire(self, now: float) -> bool:
+        """Claim the right to send a request; only one trial at a time while half-open"""
+        with self.lock:
+            state = self.state(now)
+            if state == 'half-open':
+                self.trial = True
+            return state != 'open'
+            
+    def release(self):
+        """Give back a claim whose request was cancelled before it was sent"""
+        with self.lock:
+            self.trial = False
+            
+    def record_success(self, elapsed: float):
+        with self.lock:
+            self.failures = 0
+            self.trial = False
+            self.latency = elapsed if self.latency is None else 0.7 * self.latency + 0.3 * elapsed
+            
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.errors += 1
+            self.trial = False
+            if self.failures >= SETTINGS['geo_breaker_failures']:
+                self.open_until = time.monotonic() + SETTINGS['geo_breaker_cooldown']
+                
+    def parse(self, data) -> Optional[Tuple[str, str]]:
+        """(country name, ISO code) from one answer object, or None"""
+        country = data.get(self.key) if isinstance(data, dict) else None
+        if not country:
+            return None
+        return country, (data.get(self.code_key) or '') if self.code_key else ''
+        
+    def request(self, method: str, url: str, timeout: float, **kwargs):
+        """Send one request and update health; returns the decoded JSON or None"""
+        self.requests += 1
+        started = time.monotonic()
+        try:
+            response = self.get_session().request(method, url, timeout=timeout, **kwargs)
+            if response.status_code != 200:
+                raise ValueError(f"returned status {response.status_code}")
+            data = response.json()
+        except Exception as e:
+            self.record_failure()
+            print(f"[DEBUG] {self.name} error: {e}")
+            return None
+            
+        # The provider answered; a missing country (reserved range etc.) is not its fault
+        self.record_success(time.monotonic() - started)
+        return data
+        
+    def fetch(self, ip: str, timeout: float) -> Optional[Tuple[str, str]]:
+        """Look up one IP; returns (country, code) or None"""
+        data = self.request('GET', self.url.format(ip=ip), timeout)
+        return None if data is None else self.parse(data)
+        
+    def fetch_batch(self, ips: List[str], timeout: float) -> Optional[Dict[str, Tuple[str, str]]]:
+        """Look up several IPs in one round trip; None if the request failed"""
+        data = self.request('POST', self.batch_url, timeout, json=ips)
+        if data is None:
+            return None
+            
+        results = {}
+        for item in data if isinstance(data, list) else []:
+            answer = self.parse(item)
+            if answer and item.get(self.batch_ip_key) in ips:
+                results[item[self.batch_ip_key]] = answer
+        return results
+        
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+
+
+class GeoProviderManager:
+    """
+    Resolves IPs to countries. The fastest healthy provider is asked
+    first; if it has not answered within geo_hedge_delay the next one
+    is asked as well, and the first country returned wins. Providers
+    that keep failing are skipped until their cooldown ends. Requests
+    already on the wire when another provider wins are left to finish
+    in the background - their outcome only updates provider health.
+    """
+    
+    def __init__(self, providers: List[Dict] = None):
+        self.providers = [GeoProvider(**p) for p in (providers or GEOLOCATION_PROVIDERS)]
+        self.pool = ThreadPoolExecutor(SETTINGS['enrich_workers'] * len(self.providers),
+                                       thread_name_prefix='sf-geo')
+        self.lookup_pool = ThreadPoolExecutor(SETTINGS['enrich_workers'], thread_name_prefix='sf-geo-lookup')
+        self.cache = OrderedDict()  # ip -> (country, code, expires at)
+        self.cache_size = SETTINGS['geo_cache_size']  # Lowered by the resource governor under load
+        self.cache_lock = threading.Lock()
+        
+    def cache_get(self, ip: str) -> Optional[Tuple[str, str]]:
+        """Cached (country, code) for an IP, or None"""
+        with self.cache_lock:
+            entry = self.cache.get(ip)
+            if entry is None:
+                return None
+            if entry[2] < time.monotonic():
+                del self.cache[ip]
+                return None
+            self.cache.move_to_end(ip)
+            return entry[0], entry[1]
+            
+    def cache_put(self, ip: str, answer: Tuple[str, str]):
+        with self.cache_lock:
+            self.cache[ip] = (answer[0], answer[1], time.monotonic() + SETTINGS['geo_cache_ttl'])
+            self.cache.move_to_end(ip)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+                
+    def resize_cache(self, size: int):
+        """Change how many IPs are cached, dropping the least recently used beyond it"""
+        with self.cache_lock:
+            self.cache_size = max(1, size)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+                
+    def export_cache(self) -> List[Tuple[str, str, str, float]]:
+        """Live cache entries as (ip, country, code, wall-clock expiry), for checkpoints"""
+        offset = time.time() - time.monotonic()
+        with self.cache_lock:
+            return [(ip, entry[0], entry[1], entry[2] + offset) for ip, entry in self.cache.items()]
+            
+    def import_cache(self, entries: Iterable[Tuple[str, str, str, float]]):
+        """Restore entries from export_cache() that have not expired"""
+        offset = time.time() - time.monotonic()
+        with self.cache_lock:
+            for ip, country, code, expires_at in entries:
+                if expires_at - offset > time.monotonic() and ip not in self.cache:
+                    self.cache[ip] = (country, code, expires_at - offset)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+                
+    def country_code(self, ip: str) -> str:
+        """Cached ISO country code for an IP ('' if not resolved yet)"""
+        answer = self.cache_get(ip)
+        return answer[1] if answer else ''
+        
+    def candidates(self) -> List[GeoProvider]:
+        """Providers not currently skipped, fastest first (unmeasured ones in config order)"""
+        now = time.monotonic()
+        usable = [p for p in self.providers if p.state(now) != 'open']
+        return sorted(usable, key=lambda p: float('inf') if p.latency is None else p.latency)
+        
+    def lookup(self, ip: str) -> str:
+        """Country for an IP address ('Unknown' if no provider answers in time)"""
+        answer = self.cache_get(ip)
+        if answer:
+            return answer[0]
+            
+        answer = self.query(ip)
+        if answer:
+            print(f"[DEBUG] Got country for {ip}: {answer[0]}")
+            self.cache_put(ip, answer)
+            return answer[0]
+            
+        print(f"[DEBUG] All geolocation services failed, returning Unknown")
+        if SETTINGS['log_events']:
+            logging.warning(f"Geolocation failed for {ip}")
+        return 'Unknown'
+        
+    async def lookup_async(self, ip: str) -> str:
+        """Awaitable lookup - the HTTP requests run off the event loop"""
+        return await asyncio.to_thread(self.lookup, ip)
+        
+    def lookup_many(self, ips: Iterable[str]) -> Dict[str, str]:
+        """
+        Countries for several IPs. Cache misses are sent to a batch
+        endpoint in one round trip per chunk; anything the batch could
+        not answer falls back to concurrent single lookups.
+        """
+        results = {}
+        unresolved = []
+        for ip in dict.fromkeys(ips):
+            answer = self.cache_get(ip)
+            if answer:
+                results[ip] = answer[0]
+            else:
+                unresolved.append(ip)
+        if not unresolved:
+            return results
+            
+        deadline = time.monotonic() + SETTINGS['geo_timeout']
+        if len(unresolved) > 1:
+            for ip, answer in self.query_batch(unresolved, deadline).items():
+                self.cache_put(ip, answer)
+                results[ip] = answer[0]
+            unresolved = [ip for ip in unresolved if ip not in results]
+            if unresolved:
+                print(f"[DEBUG] Batch lookup left {len(unresolved)} IPs, trying them one by one")
+                
+        for ip, country in zip(unresolved, self.lookup_pool.map(self.lookup, unresolved)):
+            results[ip] = country
+        return results
+        
+    async def lookup_many_async(self, ips: Iterable[str]) -> Dict[str, str]:
+        """Awaitable lookup_many"""
+        return await asyncio.to_thread(self.lookup_many, list(ips))
+        
+    def query_batch(self, ips: List[str], deadline: float) -> Dict[str, Tuple[str, str]]:
+        """Resolve IPs through batch-capable providers, fastest first"""
+        results = {}
+        for provider in self.candidates():
+            if not provider.batch_url:
+                continue
+            remaining = [ip for ip in ips if ip not in results]
+            for offset in range(0, len(remaining), provider.batch_size):
+                now = time.monotonic()
+                if now >= deadline or not provider.try_acquire(now):
+                    break
+                answers = provider.fetch_batch(remaining[offset:offset + provider.batch_size], deadline - now)
+                if answers is None:
+                    break
+                results.update(answers)
+            if len(results) == len(ips):
+                break
+        return results
+        
+    def query(self, ip: str) -> Optional[Tuple[str, str]]:
+        """Hedged request across the candidate providers, bounded by geo_timeout"""
+        deadline = time.monotonic() + SETTINGS['geo_timeout']
+        waiting = self.candidates()
+        pending = set()
+        owners = {}  # Future -> provider, to release a trial that never left the pool
+        hedge_at = 0.0
+        
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+                
+            # Ask the next provider when nothing is in flight or the current one is slow
+            if waiting and (not pending or now >= hedge_at):
+                provider = waiting.pop(0)
+                if provider.try_acquire(now):
+                    future = self.pool.submit(provider.fetch, ip, deadline - now)
+                    owners[future] = provider
+                    pending.add(future)
+                    hedge_at = now + SETTINGS['geo_hedge_delay']
+                continue
+                
+            if not pending:
+                break
+                
+            wake = min(deadline, hedge_at) if waiting else deadline
+            done, pending = wait(pending, timeout=max(0.0, wake - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                answer = future.result()
+                if answer:
+                    self.cancel(pending, owners)
+                    return answer
+                    
+        self.cancel(pending, owners)
+        return None
+        
+    @staticmethod
+    def cancel(pending, owners):
+        """Drop queued requests; a half-open trial that never ran must not keep its provider open"""
+        for future in pending:
+            if future.cancel():
+                owners[future].release()
+                
+    def health(self) -> List[Dict]:
+        """Per-provider state for metrics"""
+        now = time.monotonic()
+        return [{
+            'name': p.name,
+            'state': p.state(now),
+            'latency_ms': None if p.latency is None else round(p.latency * 1000, 1),
+            'failures': p.failures,
+            'requests': p.requests,
+            'errors': p.errors
+        } for p in self.providers]
+        
+    def close(self):
+        """Stop the request pools and close keep-alive sessions"""
+        self.lookup_pool.shutdown(wait=False, cancel_futures=True)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        for provider in self.providers:
+            provider.close()
+
+
+def stand_in_server():
+    """
+    Local stand-in geolocation service for benchmarks. Paths select the
+    behaviour: /hung/ stalls, /down/ fails, /fast/ answers after 20 ms,
+    POST /batch answers a list of IPs in one response.
+    """
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    class StandIn(BaseHTTPRequestHandler):
+        delays = {'/hung/': 3.0, '/down/': 0.0, '/fast/': 0.02, '/batch': 0.02}
+        
+        def answer(self, status, payload=None):
+            body = json.dumps(payload).encode() if payload is not None else b''
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            
+        def do_GET(self):
+            prefix = '/' + self.path.split('/')[1] + '/'
+            time.sleep(self.delays.get(prefix, 0))
+            if prefix == '/down/':
+                self.answer(503)
+            else:
+                self.answer(200, {'country': 'Testland', 'countryCode': 'TL'})
+                
+        def do_POST(self):
+            time.sleep(self.delays['/batch'])
+            ips = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            self.answer(200, [{'query': ip, 'country': 'Testland', 'countryCode': 'TL'} for ip in ips])
+            
+        def log_message(self, *args):
+            pass
+            
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def benchmark(lookups: int = 5, batch: int = 40):
+    """Compare sequential fallback, hedged and batched lookups against a local stand-in service"""
+    import requests
+    
+    server, base = stand_in_server()
+    providers = [{'name': name, 'url': f'{base}/{name}/{{ip}}', 'key': 'country', 'code_key': 'countryCode'}
+                 for name in ('hung', 'down', 'fast')]
+    print(f"SpamFisher geolocation benchmark (stand-in providers: hung, failing, fast)")
+    
+    start = time.perf_counter()
+    for index in range(lookups):
+        for provider in providers:
+            try:
+                response = requests.get(provider['url'].format(ip=f'198.51.100.{index}'), timeout=5)
+                if response.status_code == 200 and response.json().get('country'):
+                    break
+            except requests.RequestException:
+                continue
+    sequential = (time.perf_counter() - start) / lookups
+    
+    manager = GeoProviderManager(providers)
+    start = time.perf_counter()
+    for index in range(lookups):
+        manager.lookup(f'203.0.113.{index}')
+    hedged = (time.perf_counter() - start) / lookups
+    
+    print(f"  sequential fallback  {sequential * 1000:8.1f} ms per lookup")
+    print(f"  hedged manager       {hedged * 1000:8.1f} ms per lookup")
+    for provider in manager.health():
+        print(f"    {provider['name']:<5} {provider['state']:<9} latency {provider['latency_ms']} ms, "
+              f"{provider['errors']}/{provider['requests']} failed")
+    manager.close()
+    
+    # Many unresolved IPs at once: one lookup each vs one batch round trip
+    fast = [dict(providers[2], batch_url=f'{base}/batch')]
+    ips = [f'192.0.2.{index}' for index in range(batch)]
+    
+    manager = GeoProviderManager(fast)
+    start = time.perf_counter()
+    for ip in ips:
+        manager.lookup(ip)
+    single = time.perf_counter() - start
+    manager.close()
+    
+    manager = GeoProviderManager(fast)
+    start = time.perf_counter()
+    manager.lookup_many(ips)
+    batched = time.perf_counter() - start
+    requests_sent = sum(provider['requests'] for provider in manager.health())
+    manager.close()
+    
+    print(f"  {batch} IPs one by one   {single * 1000:8.1f} ms ({batch} requests)")
+    print(f"  {batch} IPs batched      {batched * 1000:8.1f} ms ({requests_sent} requests)")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    benchmark()
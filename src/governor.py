@@ -0,0 +1,108 @@
+"""
+SpamFisher Resource Governor
+Keeps the agent's own CPU time and memory within configured budgets on the
+low-end machines it protects, trading scan frequency, cache size and
+geolocation for footprint when it goes over
+"""
+
+import time
+from typing import Dict, Optional
+import psutil
+from config import SETTINGS
+
+
+# Degrade levels: name, check interval multiplier, share of geo_cache_size
+# kept, and whether threats are geolocated (otherwise only from the cache)
+LEVELS = (
+    ('normal', 1, 1.0, True),
+    ('reduced', 2, 0.5, True),
+    ('minimal', 4, 0.125, False),
+)
+
+# Fraction of a budget usage must fall under before a level is given back
+RECOVERY = 0.75
+
+
+class ResourceGovernor:
+    """
+    Samples the agent's own CPU time and resident memory every
+    governor_interval seconds. After governor_hysteresis samples in a row
+    over either budget it steps one level down; after as many samples
+    well under both it steps back up, so a single busy cycle (a burst of
+    threats, a signature reload) does not make it oscillate.
+    """
+    
+    def __init__(self, process: psutil.Process = None):
+        self.process = process or psutil.Process()
+        self.level = 0
+        self.last_sample = None  # (monotonic time, CPU seconds used)
+        self.over = 0  # Consecutive samples over budget
+        self.under = 0  # Consecutive samples under the recovery mark
+        self.degraded_since = None
+        self.stats = {'level': LEVELS[0][0], 'cpu_percent': None, 'rss_mb': None, 'peak_rss_mb': 0.0,
+                      'cpu_budget': SETTINGS['cpu_budget'], 'memory_budget_mb': SETTINGS['memory_budget_mb'],
+                      'degraded': 0, 'recovered': 0, 'degraded_seconds': 0.0}
+                      
+    @property
+    def interval_scale(self) -> int:
+        return LEVELS[self.level][1]
+        
+    @property
+    def enrichment(self) -> bool:
+        return LEVELS[self.level][3]
+        
+    def measure(self):
+        """CPU seconds used so far and resident memory in MB"""
+        with self.process.oneshot():
+            cpu = self.process.cpu_times()
+            rss = self.process.memory_info().rss
+        return cpu.user + cpu.system, rss / (1024 * 1024)
+        
+    def sample(self, now: float = None) -> Optional[int]:
+        """Take one sample; returns the new level if it changed, else None"""
+        now = time.monotonic() if now is None else now
+        try:
+            cpu_seconds, rss_mb = self.measure()
+        except psutil.Error:
+            return None
+        last, self.last_sample = self.last_sample, (now, cpu_seconds)
+        if self.degraded_since is not None:
+            self.stats['degraded_seconds'] = round(self.stats['degraded_seconds'] + now - self.degraded_since, 1)
+            self.degraded_since = now
+        if last is None or now <= last[0]:
+            return None  # CPU usage needs two samples
+            
+        cpu_percent = (cpu_seconds - last[1]) / (now - last[0]) * 100
+        self.stats['cpu_percent'] = round(cpu_percent, 2)
+        self.stats['rss_mb'] = round(rss_mb, 1)
+        self.stats['peak_rss_mb'] = max(self.stats['peak_rss_mb'], self.stats['rss_mb'])
+        
+        cpu_budget, memory_budget = SETTINGS['cpu_budget'], SETTINGS['memory_budget_mb']
+        if cpu_percent > cpu_budget or rss_mb > memory_budget:
+            self.over += 1
+            self.under = 0
+        elif cpu_percent < cpu_budget * RECOVERY and rss_mb < memory_budget * RECOVERY:
+            self.under += 1
+            self.over = 0
+        else:
+            self.over = self.under = 0
+            
+        hysteresis = SETTINGS['governor_hysteresis']
+        if self.over >= hysteresis and self.level < len(LEVELS) - 1:
+            self.set_level(self.level + 1, now)
+            self.stats['degraded'] += 1
+        elif self.under >= hysteresis and self.level > 0:
+            self.set_level(self.level - 1, now)
+            self.stats['recovered'] += 1
+        else:
+            return None
+        return self.level
+        
+    def set_level(self, level: int, now: float):
+        self.level = level
+        self.over = self.under = 0
+        self.stats['level'] = LEVELS[level][0]
+        self.degraded_since = now if level else None
+        
+    def to_dict(self) -> Dict:
+        return dict(self.stats, interval_scale=self.interval_scale, enrichment=self.enrichment)
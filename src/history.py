@@ -0,0 +1,298 @@
+"""
+SpamFisher Connection History
+Append-only columnar ring buffer of external connections for post-incident forensics
+"""
+
+import mmap
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+from config import SETTINGS
+
+
+MAGIC = b'SFHIST01'
+VERSION = 2  # 2: per-event country code column
+
+# Header: magic, version, capacity, total records ever written
+HEADER_FORMAT = '<8sHIQ'
+HEADER_SIZE = 64
+SOFTWARE_SLOTS = 64
+SOFTWARE_NAME_SIZE = 32
+SOFTWARE_TABLE_SIZE = SOFTWARE_SLOTS * SOFTWARE_NAME_SIZE
+
+# Column layout: (name, memoryview format, item size). Addresses are raw
+# 16-byte IPv6 (IPv4 stored as v4-mapped) and countries 2-byte ISO codes,
+# so they are kept as byte columns.
+COLUMNS = [
+    ('timestamp', 'd', 8),
+    ('pid', 'I', 4),
+    ('local_port', 'H', 2),
+    ('remote_port', 'H', 2),
+    ('software', 'B', 1),
+    ('status', 'B', 1),
+    ('local_addr', None, 16),
+    ('remote_addr', None, 16),
+    ('country', None, 2),
+]
+RECORD_SIZE = sum(size for _, _, size in COLUMNS)
+
+# Connection states we record; CLOSED marks a connection that disappeared
+STATUS_CODES = {
+    'UNKNOWN': 0,
+    'ESTABLISHED': 1,
+    'CLOSED': 2,
+    'LISTEN': 3,
+    'SYN_SENT': 4,
+    'SYN_RECV': 5,
+    'CLOSE_WAIT': 6,
+    'TIME_WAIT': 7,
+}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+_V4_PREFIX = b'\x00' * 10 + b'\xff\xff'
+
+
+def pack_ip(ip) -> bytes:
+    """Pack an IPv4/IPv6 address (string or records.pack_ip integer) into 16 bytes (IPv4 as v4-mapped)"""
+    if isinstance(ip, int):
+        return ip.to_bytes(16, 'big')
+    if ':' in ip:
+        return socket.inet_pton(socket.AF_INET6, ip.split('%')[0])
+    return _V4_PREFIX + socket.inet_aton(ip)
+
+
+def pack_country(code: str) -> bytes:
+    """ISO country code as 2 bytes (zeros when unknown)"""
+    return (code or '').upper().encode('ascii', 'replace')[:2].ljust(2, b'\x00')
+
+
+def unpack_ip(packed: bytes) -> str:
+    """Inverse of pack_ip"""
+    if packed[:12] == _V4_PREFIX:
+        return socket.inet_ntoa(packed[12:])
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+class ConnectionHistory:
+    """
+    Fixed-size on-disk ring buffer of connection events.
+    Each field lives in its own contiguous column so time-range queries
+    only touch the timestamp column until a match is found.
+    """
+    
+    def __init__(self, path: str = None, capacity: int = None):
+        self.path = path or SETTINGS['history_file']
+        self.capacity = capacity or SETTINGS['history_capacity']
+        self.lock = threading.Lock()
+        self._open()
+        
+    def _open(self):
+        """Open (or create) the history file and map its columns"""
+        size = HEADER_SIZE + SOFTWARE_TABLE_SIZE + self.capacity * RECORD_SIZE
+        
+        fresh = True
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                header = f.read(struct.calcsize(HEADER_FORMAT))
+            try:
+                magic, version, capacity, _ = struct.unpack(HEADER_FORMAT, header)
+                if magic == MAGIC and version == VERSION:
+                    # Existing file wins - its capacity defines the layout
+                    self.capacity = capacity
+                    size = HEADER_SIZE + SOFTWARE_TABLE_SIZE + capacity * RECORD_SIZE
+                    fresh = False
+                else:
+                    print(f"[HISTORY] Unsupported history file format, starting new: {self.path}")
+            except struct.error:
+                print(f"[HISTORY] Corrupt history header, starting new: {self.path}")
+                
+        mode = 'r+b' if not fresh else 'w+b'
+        self.file = open(self.path, mode)
+        if fresh or os.path.getsize(self.path) != size:
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        
+        if fresh:
+            struct.pack_into(HEADER_FORMAT, self.map, 0, MAGIC, VERSION, self.capacity, 0)
+            
+        _, _, _, self.total = struct.unpack_from(HEADER_FORMAT, self.map, 0)
+        
+        # Interned software key table (slot 0 means unknown)
+        self.software_ids = {}
+        self.software_names = {0: ''}
+        for slot in range(1, SOFTWARE_SLOTS):
+            offset = HEADER_SIZE + slot * SOFTWARE_NAME_SIZE
+            raw = bytes(self.map[offset:offset + SOFTWARE_NAME_SIZE]).rstrip(b'\x00')
+            if raw:
+                name = raw.decode('utf-8', 'replace')
+                self.software_ids[name] = slot
+                self.software_names[slot] = name
+                
+        # Typed views over each column
+        self.columns = {}
+        offset = HEADER_SIZE + SOFTWARE_TABLE_SIZE
+        self.view = memoryview(self.map)
+        for name, fmt, item_size in COLUMNS:
+            region = self.view[offset:offset + self.capacity * item_size]
+            self.columns[name] = region.cast(fmt) if fmt else region
+            offset += self.capacity * item_size
+            
+    def _software_id(self, software: Optional[str]) -> int:
+        """Intern a software key into the on-disk table"""
+        if not software:
+            return 0
+        slot = self.software_ids.get(software)
+        if slot is not None:
+            return slot
+            
+        slot = len(self.software_ids) + 1
+        if slot >= SOFTWARE_SLOTS:
+            return 0
+            
+        offset = HEADER_SIZE + slot * SOFTWARE_NAME_SIZE
+        encoded = software.encode('utf-8')[:SOFTWARE_NAME_SIZE]
+        self.map[offset:offset + SOFTWARE_NAME_SIZE] = encoded.ljust(SOFTWARE_NAME_SIZE, b'\x00')
+        self.software_ids[software] = slot
+        self.software_names[slot] = software
+        return slot
+        
+    def record(self, pid: int, software: Optional[str], status: str,
+               local_ip: str, local_port: int, remote_ip: str, remote_port: int,
+               timestamp: float = None, country: str = ''):
+        """Append one connection event, overwriting the oldest when full"""
+        with self.lock:
+            index = self.total % self.capacity
+            columns = self.columns
+            
+            columns['timestamp'][index] = timestamp if timestamp is not None else time.time()
+            columns['pid'][index] = pid
+            columns['local_port'][index] = local_port
+            columns['remote_port'][index] = remote_port
+            columns['software'][index] = self._software_id(software)
+            columns['status'][index] = STATUS_CODES.get(status, 0)
+            columns['local_addr'][index * 16:index * 16 + 16] = pack_ip(local_ip)
+            columns['remote_addr'][index * 16:index * 16 + 16] = pack_ip(remote_ip)
+            columns['country'][index * 2:index * 2 + 2] = pack_country(country)
+            
+            self.total += 1
+            struct.pack_into('<Q', self.map, struct.calcsize(HEADER_FORMAT) - 8, self.total)
+            
+    def __len__(self):
+        return min(self.total, self.capacity)
+        
+    def _physical(self, logical: int) -> int:
+        """Map a logical position (0 = oldest kept record) to a slot index"""
+        start = self.total - len(self)
+        return (start + logical) % self.capacity
+        
+    def _lower_bound(self, timestamp: float) -> int:
+        """First logical position with a timestamp >= the given one"""
+        timestamps = self.columns['timestamp']
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if timestamps[self._physical(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+        
+    def _row(self, index: int) -> Dict:
+        """Decode one slot into a dict"""
+        columns = self.columns
+        return {
+            'timestamp': columns['timestamp'][index],
+            'pid': columns['pid'][index],
+            'software': self.software_names.get(columns['software'][index], ''),
+            'status': STATUS_NAMES.get(columns['status'][index], 'UNKNOWN'),
+            'local_ip': unpack_ip(bytes(columns['local_addr'][index * 16:index * 16 + 16])),
+            'local_port': columns['local_port'][index],
+            'remote_ip': unpack_ip(bytes(columns['remote_addr'][index * 16:index * 16 + 16])),
+            'remote_port': columns['remote_port'][index],
+            'country': bytes(columns['country'][index * 2:index * 2 + 2]).rstrip(b'\x00').decode('ascii', 'replace'),
+        }
+        
+    def query(self, since: float = None, until: float = None, pid: int = None,
+              software: str = None, remote_ip: str = None, limit: int = None) -> List[Dict]:
+        """
+        Return recorded events in time order matching all given filters.
+        Time bounds are resolved by binary search; other filters compare
+        packed integers/bytes column-wise before any row is decoded.
+        """
+        with self.lock:
+            start = self._lower_bound(since) if since is not None else 0
+            end = self._lower_bound(until) if until is not None else len(self)
+            
+            software_id = None
+            if software is not None:
+                software_id = self.software_ids.get(software)
+                if software_id is None:
+                    return []
+            packed_remote = pack_ip(remote_ip) if remote_ip else None
+            
+            columns = self.columns
+            results = []
+            for logical in range(start, end):
+                index = self._physical(logical)
+                if pid is not None and columns['pid'][index] != pid:
+                    continue
+                if software_id is not None and columns['software'][index] != software_id:
+                    continue
+                if packed_remote is not None and columns['remote_addr'][index * 16:index * 16 + 16] != packed_remote:
+                    continue
+                results.append(self._row(index))
+                if limit and len(results) >= limit:
+                    break
+                    
+            return results
+            
+    def set_country(self, remote_ip: str, code: str, since: float) -> int:
+        """Fill in the country of events for a remote IP recorded since a time; returns events updated"""
+        packed_remote = pack_ip(remote_ip)
+        packed_country = pack_country(code)
+        with self.lock:
+            columns = self.columns
+            updated = 0
+            for logical in range(self._lower_bound(since), len(self)):
+                index = self._physical(logical)
+                if columns['remote_addr'][index * 16:index * 16 + 16] != packed_remote:
+                    continue
+                if columns['country'][index * 2:index * 2 + 2] == b'\x00\x00':
+                    columns['country'][index * 2:index * 2 + 2] = packed_country
+                    updated += 1
+            return updated
+            
+    def close(self):
+        """Flush and release the mapping"""
+        with self.lock:
+            for column in self.columns.values():
+                column.release()
+            self.columns = {}
+            self.view.release()
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+
+
+def main():
+    """Print recorded connection events (default: last 24 hours)"""
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24
+    history = ConnectionHistory()
+    
+    events = history.query(since=time.time() - hours * 3600)
+    print(f"Connection history: {len(events)} events in the last {hours:g} hours")
+    for event in events:
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event['timestamp']))
+        print(f"{stamp}  {event['status']:<12} {event['software'] or '?':<14} "
+              f"PID {event['pid']:<6} {event['local_ip']}:{event['local_port']} -> "
+              f"{event['remote_ip']}:{event['remote_port']} {event['country'] or '??'}")
+              
+    history.close()
+
+
+if __name__ == '__main__':
+    main()
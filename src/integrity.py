@@ -0,0 +1,311 @@
+"""
+SpamFisher Integrity Manifest
+Signed list of SHA-256 hashes of the agent's source files (integrity.json),
+checked incrementally: a file is hashed again only when its size, times or
+inode changed, so the periodic check costs one stat per file
+"""
+
+import hashlib
+import importlib.machinery
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+from config import SETTINGS
+from signatures import resolve_data_path
+
+
+MANIFEST_VERSION = 1
+
+# Checked for existence when there is no manifest (the check before manifests)
+CRITICAL_FILES = ('main.py', 'monitor.py', 'ui.py', 'config.py', 'security.py')
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Files in the source directory an import could pick up (.py, .pyc, extension modules)
+MODULE_SUFFIXES = tuple(importlib.machinery.all_suffixes())
+
+Identity = Tuple[int, int, int, int]  # (size, mtime_ns, ctime_ns, inode)
+
+
+class IntegrityError(Exception):
+    """The manifest is missing, malformed or its signature does not verify"""
+
+
+def file_identity(st: os.stat_result) -> Identity:
+    # ctime as well as mtime: whoever edits a file can set its mtime back, not its ctime
+    return (st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino)
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def signed_bytes(version: int, files: Dict[str, str]) -> bytes:
+    """What the signature covers: the version and file hashes as canonical JSON"""
+    return json.dumps({'version': version, 'files': files}, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def load_public_key(path: str):
+    """Ed25519 public key stored as 64 hex digits (raises IntegrityError)"""
+    try:
+        from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+    except ImportError:
+        raise IntegrityError("cryptography is not installed, the manifest signature cannot be checked")
+    try:
+        with open(path, 'r', encoding='ascii') as f:
+            return Ed25519PublicKey.from_public_bytes(bytes.fromhex(f.read().strip()))
+    except FileNotFoundError:
+        raise IntegrityError(f"public key not found: {path}")
+    except (OSError, ValueError) as e:
+        raise IntegrityError(f"unreadable public key {path}: {e}")
+
+
+def load_manifest(path: str, public_key) -> Dict[str, str]:
+    """File hashes from a manifest whose signature verifies (raises IntegrityError)"""
+    from cryptography.exceptions import InvalidSignature
+    
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        raise IntegrityError(f"manifest not found: {path}")
+    except (OSError, ValueError) as e:
+        raise IntegrityError(f"unreadable manifest {path}: {e}")
+        
+    if not isinstance(data, dict) or data.get('version') != MANIFEST_VERSION:
+        raise IntegrityError(f"not a version {MANIFEST_VERSION} manifest")
+    files = data.get('files')
+    if not isinstance(files, dict) or not files or \
+            not all(isinstance(name, str) and isinstance(digest, str) for name, digest in files.items()):
+        raise IntegrityError("'files' must map file names to hashes")
+    for name in files:
+        if os.path.isabs(name) or '..' in name.replace('\\', '/').split('/'):
+            raise IntegrityError(f"file outside the source directory: {name}")
+    try:
+        public_key.verify(bytes.fromhex(data.get('signature', '')), signed_bytes(MANIFEST_VERSION, files))
+    except (InvalidSignature, ValueError):
+        raise IntegrityError("manifest signature does not verify")
+    return files
+
+
+class IntegrityManifest:
+    """
+    Verifies the source files against the signed manifest. File names in
+    the manifest are relative to the directory it is in, whatever the
+    working directory. The hash of each file is remembered with its
+    identity (size, mtime, ctime, inode), so a file is read again only
+    when its identity changes. The cache is kept in memory only - one
+    written to disk could be rewritten along with the sources - so the
+    first check after start hashes every file, and so does every check
+    integrity_full_interval seconds after that, in case a file was changed
+    with its identity restored. Modules in the
+    source directory that the manifest does not list are reported, since
+    they could shadow an import. Without a manifest only the critical files are checked for existence,
+    unless integrity_required is set.
+    """
+    
+    def __init__(self, path: str = None, key_path: str = None):
+        self.path = resolve_data_path(path or SETTINGS['integrity_manifest'])
+        self.key_path = resolve_data_path(key_path or SETTINGS['integrity_public_key'])
+        self.root = os.path.dirname(self.path)
+        self.files: Optional[Dict[str, str]] = None  # name -> expected hash, once the manifest verified
+        self.manifest_state = None  # Identity of the manifest file last loaded
+        self.cache: Dict[str, Tuple[Identity, str]] = {}  # name -> (identity, hash) when last hashed
+        self.next_full = 0.0  # Monotonic time of the next check that hashes every file
+        self.stats = {'state': None, 'files': 0, 'checks': 0, 'hashed': 0, 'cached': 0,
+                      'last_check_ms': None, 'last_full_check': None, 'problems': []}
+        
+    def load(self) -> bool:
+        """
+        Read the manifest if it changed and verify its signature; False when
+        there is none (raises IntegrityError)
+        """
+        try:
+            state = file_identity(os.stat(self.path))
+        except FileNotFoundError:
+            self.files = self.manifest_state = None
+            return False
+        if state != self.manifest_state:
+            self.files = None
+            self.files = load_manifest(self.path, load_public_key(self.key_path))
+            self.manifest_state = state
+        return True
+        
+    def verify(self, full: bool = None) -> List[str]:
+        """
+        Check every file; returns what is wrong, or an empty list. full
+        hashes every file whatever its identity (None: when it is due).
+        """
+        started = time.perf_counter()
+        now = time.monotonic()
+        if full is None:
+            full = now >= self.next_full
+        try:
+            signed = self.load()
+        except IntegrityError as e:
+            signed = False
+            problems = [str(e)]
+        else:
+            if signed:
+                problems = self.check_files(full)
+                if full:
+                    self.next_full = now + SETTINGS['integrity_full_interval']
+                    self.stats['last_full_check'] = time.time()
+            elif SETTINGS['integrity_required']:
+                problems = [f"manifest not found: {self.path}"]
+            else:
+                problems = [f"missing: {name}" for name in CRITICAL_FILES
+                            if not os.path.exists(os.path.join(self.root, name))]
+                            
+        self.stats['state'] = 'failed' if problems else ('verified' if signed else 'unsigned')
+        self.stats['problems'] = problems
+        self.stats['checks'] += 1
+        self.stats['last_check_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return problems
+        
+    def check_files(self, full: bool) -> List[str]:
+        problems = []
+        for name, expected in self.files.items():
+            path = os.path.join(self.root, name)
+            try:
+                identity = file_identity(os.stat(path))
+            except OSError:
+                problems.append(f"missing: {name}")
+                continue
+            cached = self.cache.get(name)
+            if cached is not None and cached[0] == identity and not full:
+                digest = cached[1]
+                self.stats['cached'] += 1
+            else:
+                try:
+                    digest = hash_file(path)
+                except OSError as e:
+                    problems.append(f"unreadable: {name} ({e})")
+                    continue
+                self.stats['hashed'] += 1
+                self.cache[name] = (identity, digest)
+            if digest != expected:
+                problems.append(f"modified: {name}")
+        self.stats['files'] = len(self.files)
+        
+        try:
+            entries = os.listdir(self.root)
+        except OSError:
+            entries = []
+        for name in entries:
+            if name not in self.files and (name.endswith(MODULE_SUFFIXES) or
+                                           os.path.isfile(os.path.join(self.root, name, '__init__.py'))):
+                problems.append(f"unlisted: {name}")
+        return problems
+        
+    def to_dict(self) -> Dict:
+        return dict(self.stats, manifest=self.path)
+
+
+def generate_key(private_path: str, public_path: str):
+    """New Ed25519 signing key (owner-readable hex) and its public key"""
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+    from cryptography.hazmat.primitives import serialization
+    
+    key = Ed25519PrivateKey.generate()
+    private = key.private_bytes(serialization.Encoding.Raw, serialization.PrivateFormat.Raw,
+                                serialization.NoEncryption())
+    public = key.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    fd = os.open(private_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w', encoding='ascii') as f:
+        f.write(private.hex() + '\n')
+    with open(public_path, 'w', encoding='ascii') as f:
+        f.write(public.hex() + '\n')
+
+
+def sign(private_path: str, manifest_path: str, root: str = SOURCE_DIR) -> int:
+    """Hash every .py file in root and write a signed manifest; returns the file count"""
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+    
+    with open(private_path, 'r', encoding='ascii') as f:
+        key = Ed25519PrivateKey.from_private_bytes(bytes.fromhex(f.read().strip()))
+    files = {name: hash_file(os.path.join(root, name)) for name in sorted(os.listdir(root)) if name.endswith('.py')}
+    missing = [name for name in CRITICAL_FILES if name not in files]
+    if missing:
+        raise IntegrityError(f"critical files missing: {missing}")
+    manifest = {'version': MANIFEST_VERSION, 'files': files,
+                'signature': key.sign(signed_bytes(MANIFEST_VERSION, files)).hex()}
+    temp = f"{manifest_path}.tmp"
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+        f.write('\n')
+    os.replace(temp, manifest_path)
+    return len(files)
+
+
+def benchmark(runs: int = 50):
+    """Time a check that hashes every file against one served from the identity cache"""
+    import shutil
+    import tempfile
+    
+    with tempfile.TemporaryDirectory(prefix='sf-integrity-') as root:
+        for name in os.listdir(SOURCE_DIR):
+            if name.endswith('.py'):
+                shutil.copy(os.path.join(SOURCE_DIR, name), root)
+        private_path = os.path.join(root, 'signing.key')
+        public_path = os.path.join(root, 'integrity.pub')
+        manifest_path = os.path.join(root, 'integrity.json')
+        generate_key(private_path, public_path)
+        count = sign(private_path, manifest_path, root)
+        size = sum(os.path.getsize(os.path.join(root, name)) for name in os.listdir(root) if name.endswith('.py'))
+        manifest = IntegrityManifest(manifest_path, public_path)
+        print(f"SpamFisher integrity benchmark ({count} files, {size // 1024} KiB)")
+        
+        for label, full in (("full (every file hashed)", True), ("incremental (identity cache)", False)):
+            started = time.perf_counter()
+            for _ in range(runs):
+                problems = manifest.verify(full)
+            print(f"  {label:34} {(time.perf_counter() - started) / runs * 1000:8.3f} ms"
+                  f"{'' if not problems else f' ({problems})'}")
+                  
+        started = time.perf_counter()
+        restarted = IntegrityManifest(manifest_path, public_path)
+        restarted.verify()  # As at startup (security.verify_integrity)
+        print(f"  {'restart (signature + every file)':34} {(time.perf_counter() - started) * 1000:8.3f} ms, "
+              f"{restarted.stats['hashed']} files hashed")
+              
+        with open(os.path.join(root, 'ui.py'), 'a', encoding='utf-8') as f:
+            f.write('\n# tampered\n')
+        open(os.path.join(root, 'psutil.py'), 'w').close()
+        print(f"  after appending to ui.py and adding psutil.py: {restarted.verify()}")
+
+
+def main():
+    """integrity.py [--check | --keygen PRIVATE_KEY | --sign PRIVATE_KEY | --benchmark]"""
+    args = sys.argv[1:]
+    manifest_path = resolve_data_path(SETTINGS['integrity_manifest'])
+    if args == ['--check']:
+        manifest = IntegrityManifest()
+        problems = manifest.verify(True)
+        for problem in problems:
+            print(f"[SECURITY] {problem}")
+        print(f"[SECURITY] {manifest.stats['state']}: {manifest.stats['files']} files, {manifest.path}")
+        sys.exit(1 if problems else 0)
+    elif len(args) == 2 and args[0] == '--keygen':
+        public_path = resolve_data_path(SETTINGS['integrity_public_key'])
+        generate_key(args[1], public_path)
+        print(f"[SECURITY] Signing key written to {args[1]} (keep it off the protected machines), "
+              f"public key to {public_path}")
+    elif len(args) == 2 and args[0] == '--sign':
+        count = sign(args[1], manifest_path)
+        print(f"[SECURITY] Signed {count} files into {manifest_path}")
+    elif args == ['--benchmark']:
+        benchmark()
+    else:
+        print(main.__doc__)
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
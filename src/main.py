@@ -4,13 +4,27 @@ Combines monitoring and UI to protect against remote access scams
 SECURITY ENHANCED VERSION
 """
 
+import asyncio
 import time
+
+STARTED_AT = time.perf_counter()  # Reference point for startup timing
+
 import threading
 import os
 import sys
 import signal
+import subprocess
+import argparse
+from collections import deque
 from monitor import ConnectionMonitor
-from ui import WarningScreen
+from pipeline import ScanPipeline
+from timewheel import TimingWheel
+from checkpoint import Checkpoint, CheckpointError
+from governor import LEVELS, ResourceGovernor
+from sessions import WarningRouter
+from rules import PolicyStore
+from integrity import IntegrityManifest
+from records import pack_ip, unpack_ip
 from config import SETTINGS
 from security import (
     request_admin_rights, 
@@ -19,52 +33,109 @@ from security import (
     SecureBlocklist,
     is_admin
 )
-import pystray
-from PIL import Image, ImageDraw
+# UI (tkinter), tray (pystray, PIL), geolocation (requests), encryption
+# (cryptography) and the shared status block (multiprocessing) are imported
+# on first use so monitoring starts sooner
 
 
 class SpamFisher:
     """Main application controller with security features"""
     
-    def __init__(self):
-        # Security check
-        if not verify_integrity():
+    def __init__(self, interactive=True):
+        self.interactive = interactive  # False in daemon mode: no prompts, no UI
+        
+        # Security check (re-run in the background, see watch_integrity)
+        self.integrity = IntegrityManifest()
+        if not verify_integrity(self.integrity):
             print("[SECURITY] Integrity check failed - some files may be compromised")
+            if not interactive:
+                print("[SECURITY] Refusing to start in daemon mode")
+                sys.exit(1)
             response = input("Continue anyway? (yes/no): ")
             if response.lower() != 'yes':
                 sys.exit(1)
         
         self.monitor = ConnectionMonitor()
+        self.pipeline = ScanPipeline(self.monitor, self.handle_threat, self.prefilter_threat, self.on_scan_cycle)
         self.running = True
-        self.warning_active = False
+        self.loop = None  # Event loop running the pipeline (set by run_async)
+        self.stop_event = None
+        self.warning_lock = threading.Lock()  # Guards the one-warning-at-a-time slot
+        self._warning_active = False
+        self.router = WarningRouter()  # Warnings for sessions with their own UI client (control.py session)
+        self.policy = PolicyStore()  # Operator rules (policy.json), checked after the user's own decisions
+        self.policy_hits = {action: 0 for action in ('block', 'allow', 'warn')}
         self.allowed_pids = set()  # PIDs that user has allowed (temporary, session-only)
+        self.allow_expiry = TimingWheel(SETTINGS['expiry_tick'])  # ('pid', pid) / ('list', key) -> allow TTL
         self.alerted_connections = {}  # Track which connections we've already alerted on
         
-        # Use encrypted whitelist
+        # Threat log for the control API (daemon mode decides through it)
+        self.started_at = time.time()
+        self.recent_threats = deque(maxlen=SETTINGS['recent_threats'])
+        self.pending_threats = {}  # threat id -> threat awaiting allow/block
+        self.next_threat_id = 1
+        self.counters = {'detected': 0, 'blocked': 0, 'block_failed': 0, 'allowed': 0, 'auto_blocked': 0}
+        self.warning_latency = deque(maxlen=50)  # (ms from show_warning, ms from detection) per warning
+        self.state_lock = threading.Lock()
+        
+        # Encrypted whitelist/blocklist are decrypted in the background once
+        # monitoring is running (see load_lists); decisions wait for them
         self.secure_whitelist = SecureWhitelist()
-        self.permanent_whitelist = self.secure_whitelist.load()
-        self.clean_whitelist()  # Remove stale entries
-        
-        # Use encrypted blocklist
         self.secure_blocklist = SecureBlocklist()
-        self.permanent_blocklist = self.secure_blocklist.load()
+        self.permanent_whitelist = {}
+        self.permanent_blocklist = {}
+        self.lists_ready = threading.Event()
         
         self.tray_icon = None
+        self.status_writer = None  # Shared memory status block (see open_status)
+        self.governor = ResourceGovernor()  # Keeps the agent's own CPU and memory within budget
+        
+        # Session state left by the previous run, so handled sessions are not warned about again
+        self.checkpoint = Checkpoint(SETTINGS['checkpoint_file'])
+        self.restore_checkpoint()
         
         print(f"[DEBUG] SpamFisher initialized")
         print(f"[DEBUG] Admin rights: {'Yes' if is_admin() else 'No (limited protection)'}")
-        print(f"[DEBUG] Permanent whitelist loaded: {len(self.permanent_whitelist)} entries")
-        print(f"[DEBUG] Permanent blocklist loaded: {len(self.permanent_blocklist)} entries")
     
+    def load_lists(self):
+        """Decrypt and clean the permanent lists (runs after monitoring has started)"""
+        try:
+            # Use encrypted whitelist
+            self.permanent_whitelist = self.secure_whitelist.load()
+            self.clean_whitelist()  # Remove stale and expired entries, schedule the rest
+            
+            # Use encrypted blocklist
+            self.permanent_blocklist = self.secure_blocklist.load()
+            
+            print(f"[DEBUG] Permanent whitelist loaded: {len(self.permanent_whitelist)} entries")
+            print(f"[DEBUG] Permanent blocklist loaded: {len(self.permanent_blocklist)} entries")
+        finally:
+            self.lists_ready.set()
+            self.publish_status()
+            
     def clean_whitelist(self):
-        """Remove entries for processes that no longer exist"""
+        """Remove expired entries and entries without a TTL whose process no longer exists"""
         import psutil
         cleaned = {}
+        now = time.time()
+        running = None  # One PID snapshot for every entry without a TTL
         
         for key, value in self.permanent_whitelist.items():
             try:
+                expires_at = value.get('expires_at')
+                if expires_at:
+                    # Allowed for a while: kept until it expires, whatever the PID
+                    if expires_at > now:
+                        cleaned[key] = value
+                        with self.state_lock:
+                            self.allow_expiry.schedule(('list', key), expires_at)
+                    else:
+                        print(f"[DEBUG] Removing expired whitelist entry: {key}")
+                    continue
                 pid = value.get('pid')
-                if pid and psutil.pid_exists(pid):
+                if running is None:
+                    running = set(psutil.pids())
+                if pid and pid in running:
                     cleaned[key] = value
                 else:
                     print(f"[DEBUG] Removing stale whitelist entry: {key}")
@@ -75,31 +146,37 @@ class SpamFisher:
             self.permanent_whitelist = cleaned
             self.secure_whitelist.save(self.permanent_whitelist)
     
-    def add_to_permanent_whitelist(self, threat_info):
-        """Add connection to permanent whitelist"""
-        key = f"{threat_info['software_name']}_{threat_info['remote_ip']}"
+    def add_to_permanent_whitelist(self, threat_info, expires_at=None):
+        """Add connection to permanent whitelist (until expires_at, if given)"""
+        key = threat_info.list_key
         
         self.permanent_whitelist[key] = {
-            'software': threat_info['software_name'],
-            'remote_ip': threat_info['remote_ip'],
-            'country': threat_info['country'],
-            'pid': threat_info['pid'],
-            'process_name': threat_info['process_name'],
-            'first_allowed': time.strftime('%Y-%m-%d %H:%M:%S')
+            'software': threat_info.software_name,
+            'remote_ip': threat_info.remote_address,
+            'country': threat_info.country,
+            'pid': threat_info.pid,
+            'process_name': threat_info.process_name,
+            'first_allowed': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'expires_at': expires_at
         }
+        with self.state_lock:
+            if expires_at:
+                self.allow_expiry.schedule(('list', key), expires_at)
+            else:
+                self.allow_expiry.cancel(('list', key))
         
         self.secure_whitelist.save(self.permanent_whitelist)
         print(f"[DEBUG] Added to permanent whitelist: {key}")
     
     def add_to_permanent_blocklist(self, threat_info):
         """Add connection to permanent blocklist"""
-        key = f"{threat_info['software_name']}_{threat_info['remote_ip']}"
+        key = threat_info.list_key
         
         self.permanent_blocklist[key] = {
-            'software': threat_info['software_name'],
-            'remote_ip': threat_info['remote_ip'],
-            'country': threat_info['country'],
-            'process_name': threat_info['process_name'],
+            'software': threat_info.software_name,
+            'remote_ip': threat_info.remote_address,
+            'country': threat_info.country,
+            'process_name': threat_info.process_name,
             'blocked_at': time.strftime('%Y-%m-%d %H:%M:%S')
         }
         
@@ -108,60 +185,34 @@ class SpamFisher:
     
     def is_whitelisted(self, threat_info):
         """Check if connection is in permanent whitelist"""
-        key = f"{threat_info['software_name']}_{threat_info['remote_ip']}"
+        key = threat_info.list_key
         return key in self.permanent_whitelist
     
     def is_blocklisted(self, threat_info):
         """Check if connection is in permanent blocklist"""
-        key = f"{threat_info['software_name']}_{threat_info['remote_ip']}"
+        key = threat_info.list_key
         return key in self.permanent_blocklist
         
     def create_tray_icon(self):
         """Create a simple system tray icon"""
-        # Create a fisherman icon
-        def create_image():
-            # Create a 64x64 image
-            width = 64
-            height = 64
-            image = Image.new('RGB', (width, height), (46, 125, 50))  # Green background
-            draw = ImageDraw.Draw(image)
-            
-            # Draw fisherman silhouette in white
-            # Head (circle)
-            draw.ellipse([26, 10, 38, 22], fill='white')
-            
-            # Body (rectangle)
-            draw.rectangle([28, 22, 36, 38], fill='white')
-            
-            # Arms - left arm holding fishing rod
-            draw.line([28, 26, 18, 24], fill='white', width=3)
-            
-            # Fishing rod
-            draw.line([18, 24, 12, 8], fill='#8B4513', width=2)  # Brown rod
-            
-            # Fishing line
-            draw.line([12, 8, 45, 35], fill='white', width=1)
-            
-            # Hook at end of line
-            draw.arc([43, 33, 47, 40], start=0, end=270, fill='white', width=2)
-            
-            # Legs
-            draw.line([30, 38, 26, 50], fill='white', width=3)
-            draw.line([34, 38, 38, 50], fill='white', width=3)
-            
-            # Water line at bottom (blue waves)
-            draw.arc([0, 48, 20, 58], start=0, end=180, fill='#2196F3', width=2)
-            draw.arc([18, 48, 38, 58], start=0, end=180, fill='#2196F3', width=2)
-            draw.arc([36, 48, 56, 58], start=0, end=180, fill='#2196F3', width=2)
-            draw.arc([54, 48, 74, 58], start=0, end=180, fill='#2196F3', width=2)
-            
-            return image
+        import pystray
+        from assets import tray_icon
+        from status import StatusReader, describe
         
-        # Create menu
+        # Create menu; the scan and threat lines are read from the shared status block
         admin_status = "Admin rights: Yes ✓" if is_admin() else "Admin rights: No (limited protection)"
+        status = StatusReader()
+        
+        def threats_text(item):
+            current = status.read()
+            if current is None:
+                return "Threats: -"
+            return (f"Threats: {current['detected'] + current['auto_blocked']} detected, "
+                    f"{current['blocked'] + current['auto_blocked']} blocked")
         
         menu = pystray.Menu(
-            pystray.MenuItem('SpamFisher - Protecting...', lambda: None, enabled=False),
+            pystray.MenuItem(lambda item: describe(status.read()), lambda: None, enabled=False),
+            pystray.MenuItem(threats_text, lambda: None, enabled=False),
             pystray.MenuItem(admin_status, lambda: None, enabled=False),
             pystray.Menu.SEPARATOR,
             pystray.MenuItem('Exit', self.exit_application)
@@ -170,7 +221,7 @@ class SpamFisher:
         # Create tray icon
         self.tray_icon = pystray.Icon(
             "SpamFisher",
-            create_image(),
+            tray_icon(),  # Fisherman icon (assets.py)
             "SpamFisher - Remote Access Protection Active",
             menu
         )
@@ -180,121 +231,524 @@ class SpamFisher:
     def exit_application(self):
         """Exit the application"""
         print("\nShutting down SpamFisher...")
-        self.running = False
-        if self.tray_icon:
-            self.tray_icon.stop()
+        self.request_stop()
+        
+    def record_threat(self, threat_info, state):
+        """Give a threat an id and keep it in the recent threat log"""
+        with self.state_lock:
+            threat_info.id = self.next_threat_id
+            threat_info.state = state
+            self.next_threat_id += 1
+            self.recent_threats.append(threat_info)
+            if state == 'pending':
+                self.pending_threats[threat_info.id] = threat_info
+            self.counters['auto_blocked' if state == 'auto-blocked' else 'detected'] += 1
+        self.publish_status()
+    
+    def resolve_threat(self, threat_info, state):
+        """Record the decision taken on a pending threat"""
+        with self.state_lock:
+            threat_info.state = state
+            self.pending_threats.pop(threat_info.id, None)
+            self.counters[state] += 1
+        self.publish_status()
+    
+    def decide(self, threat_id, action, ttl=None):
+        """Allow (for ttl seconds, see handle_allow) or block a pending threat (control API)"""
+        with self.state_lock:
+            threat_info = self.pending_threats.get(threat_id)
+        if threat_info is None:
+            return {'ok': False, 'error': f"No pending threat with id {threat_id}"}
+        
+        if action == 'block':
+            self.handle_block(threat_info)
+        else:
+            self.handle_allow(threat_info, ttl)
+        return {'ok': True, 'id': threat_id, 'state': threat_info.state}
+    
+    def next_warning(self, client, timeout):
+        """Wait for a warning routed to the session of a UI client (control API)"""
+        threat = self.router.wait(client, timeout)
+        return threat.to_dict() if threat is not None else None
+    
+    def detach_session_client(self, client):
+        """A session UI client disconnected: warn here about what it left undecided"""
+        for threat in self.router.detach(client):
+            self.warn_locally(threat)
+    
+    def warn_locally(self, threat):
+        """Fall back to the agent's own warning for a threat no session client decided"""
+        print(f"[SESSION] Threat {threat.id} was not decided in session {threat.session} - warning here")
+        if not self.interactive:
+            print(f"[DEBUG] Threat {threat.id} awaiting allow/block through the control API")
+            return
+        if self.claim_warning():
+            self.show_warning(threat)
+            return
+        # Another warning is showing: forget this one so the session is re-detected after it closes
+        with self.state_lock:
+            self.pending_threats.pop(threat.id, None)
+            threat.state = 'returned'
+        self.alerted_connections.pop(threat.connection_key, None)
+    
+    def recent_threat_list(self, limit=None):
+        """Most recent threats first"""
+        with self.state_lock:
+            threats = [threat.to_dict() for threat in reversed(self.recent_threats)]
+        return threats[:limit] if limit else threats
+    
+    def status(self):
+        """Current state for the control API"""
+        return {
+            'running': self.running,
+            'mode': 'interactive' if self.interactive else 'daemon',
+            'admin': bool(is_admin()),
+            'uptime': time.time() - self.started_at,
+            'lists_loaded': self.lists_ready.is_set(),
+            'whitelist_entries': len(self.permanent_whitelist),
+            'allows_expiring': len(self.allow_expiry),
+            'blocklist_entries': len(self.permanent_blocklist),
+            'warning_active': self.warning_active,
+            'pending_threats': sorted(self.pending_threats),
+            'signatures_version': self.monitor.signatures.current.version,
+            'relays_version': self.monitor.relays.current.version,
+            'policy_version': self.policy.current.version,
+            'resource_level': self.governor.stats['level'],
+            'session_clients': self.router.sessions(),
+            'integrity': self.integrity.stats['state']
+        }
+    
+    def metrics(self):
+        """Counters for the control API"""
+        with self.state_lock:
+            metrics = {'threats': dict(self.counters)}
+        metrics['pipeline'] = dict(self.pipeline.stats)
+        metrics['geolocation'] = self.monitor.geo.health()
+        metrics['warning'] = self.warning_metrics()
+        metrics['blocking'] = dict(self.monitor.prearm.stats)
+        if self.monitor.flows is not None:
+            metrics['flows'] = dict(self.monitor.flows.stats)
+        metrics['checkpoint'] = dict(self.checkpoint.stats)
+        metrics['governor'] = self.governor.to_dict()
+        metrics['policy'] = dict(self.policy_hits, rules=len(self.policy.current))
+        metrics['sessions'] = dict(self.monitor.shards.stats, **self.router.stats, shards=self.monitor.shards.to_list())
+        metrics['integrity'] = self.integrity.to_dict()
+        metrics['uptime'] = time.time() - self.started_at
+        return metrics
+    
+    def warning_metrics(self):
+        """Time-to-visible-warning over the recent warnings"""
+        with self.state_lock:
+            samples = list(self.warning_latency)
+        if not samples:
+            return {'shown': 0}
+        shown, detected = (sorted(column) for column in zip(*samples))
+        return {
+            'shown': len(samples),
+            'last_ms': samples[-1][0],
+            'median_ms': shown[len(shown) // 2],
+            'median_from_detection_ms': detected[len(detected) // 2]
+        }
+    
+    def open_status(self):
+        """Create the shared status block (runs after monitoring has started)"""
+        from status import StatusBusy, StatusWriter
         
+        try:
+            writer = StatusWriter()
+        except (StatusBusy, OSError) as e:
+            print(f"[STATUS] Live status not published: {e}")
+            return
+        writer.publish(started_at=self.started_at)
+        self.status_writer = writer
+        self.publish_status()
+    
+    def publish_status(self):
+        """Write the current state to the shared status block"""
+        writer = self.status_writer
+        if writer is None:
+            return
+        from status import threat_fields, FLAG_LISTS_LOADED, FLAG_RUNNING, FLAG_THREAT_ACTIVE, FLAG_WARNING_ACTIVE
+        
+        with self.state_lock:
+            values = dict(self.counters)
+            values['pending'] = len(self.pending_threats)
+            threat = next(reversed(self.pending_threats.values()), None)
+        stats = self.pipeline.stats
+        values.update(threat_fields(threat))
+        values.update(
+            flags=(FLAG_RUNNING if self.running else 0)
+            | (FLAG_LISTS_LOADED if self.lists_ready.is_set() else 0)
+            | (FLAG_WARNING_ACTIVE if self.warning_active else 0)
+            | (FLAG_THREAT_ACTIVE if threat is not None else 0),
+            cycles=stats['cycles'],
+            watched=stats['watched'],
+            last_scan_at=stats['last_scan_at'],
+            scan_duration=stats['scan_duration']
+        )
+        writer.publish(**values)
+    
+    def on_scan_cycle(self):
+        """Publish scan timing after every classified scan and refresh the tray menu"""
+        self.publish_status()
+        if self.tray_icon is not None and self.tray_icon.visible:
+            self.tray_icon.update_menu()
+    
     def handle_block(self, threat_info):
         """User chose to block the connection"""
-        print(f"Blocking connection from {threat_info['country']}...")
+        print(f"Blocking connection from {threat_info.country}...")
         
         # Kill the process and add firewall rule
         success = self.monitor.block_connection(
-            threat_info['pid'],
-            threat_info['process_name']
+            threat_info.pid,
+            threat_info.process_name
         )
         
         if success:
             print("✅ Connection blocked and firewalled successfully!")
             # Add to permanent blocklist
             self.add_to_permanent_blocklist(threat_info)
-            print(f"✅ Added {threat_info['software_name']} from {threat_info['country']} to permanent blocklist")
+            print(f"✅ Added {threat_info.software_name} from {threat_info.country} to permanent blocklist")
         else:
             print("❌ Failed to block connection (may need admin rights)")
         
-        self.warning_active = False
+        self.resolve_threat(threat_info, 'blocked' if success else 'block_failed')
+        if not self.router.settle(threat_info):
+            self.release_warning()
     
-    def handle_allow(self, threat_info):
-        """User chose to allow the connection"""
-        print(f"User allowed connection from {threat_info['country']}")
+    def handle_allow(self, threat_info, ttl=None):
+        """User chose to allow the connection (for ttl seconds; SETTINGS['allow_ttl'] if None, 0 for good)"""
+        print(f"User allowed connection from {threat_info.country}")
         print("⚠️ Connection remains active - user accepted the risk")
         
+        ttl = SETTINGS['allow_ttl'] if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl and ttl > 0 else None
+        until = f" until {time.strftime('%Y-%m-%d %H:%M', time.localtime(expires_at))}" if expires_at else ""
+        
         # Add to BOTH temporary and permanent whitelists
         # Temporary: for this session
-        self.allowed_pids.add(threat_info['pid'])
-        print(f"Added PID {threat_info['pid']} to session whitelist")
-        
-        # Permanent: saved to encrypted file, persists across restarts
-        self.add_to_permanent_whitelist(threat_info)
-        print(f"Added {threat_info['software_name']} from {threat_info['country']} to permanent whitelist")
-        
-        self.warning_active = False
+        with self.state_lock:
+            self.allowed_pids.add(threat_info.pid)
+            if expires_at:
+                self.allow_expiry.schedule(('pid', threat_info.pid), expires_at)
+            else:
+                self.allow_expiry.cancel(('pid', threat_info.pid))
+        print(f"Added PID {threat_info.pid} to session whitelist{until}")
+        
+        # Permanent: saved to encrypted file, persists across restarts (until it expires)
+        self.add_to_permanent_whitelist(threat_info, expires_at)
+        print(f"Added {threat_info.software_name} from {threat_info.country} to permanent whitelist{until}")
+        
+        self.resolve_threat(threat_info, 'allowed')
+        if not self.router.settle(threat_info):
+            self.release_warning()
+    
+    @property
+    def warning_active(self):
+        return self._warning_active
+    
+    def claim_warning(self):
+        """Take the warning slot; False if a warning is already showing"""
+        with self.warning_lock:
+            if self._warning_active:
+                return False
+            self._warning_active = True
+        self.publish_status()
+        return True
     
-    def monitoring_loop(self):
-        """Background monitoring thread"""
+    def release_warning(self):
+        """Free the warning slot once the user has decided"""
+        with self.warning_lock:
+            self._warning_active = False
+        self.publish_status()
+    
+    def prefilter_threat(self, threat):
+        """Drop threats that need no action before they are enriched"""
+        # Skip if warning is already shown (on this display; other sessions have their own)
+        if self.warning_active and not self.router.has_client(threat.session):
+            return False
+        
+        # Lists still loading - let the act stage decide once they are ready
+        if not self.lists_ready.is_set():
+            return True
+            
+        # Blocklisted connections go straight to auto-block, reusing the stored country
+        if self.is_blocklisted(threat):
+            key = threat.list_key
+            threat.country = self.permanent_blocklist[key].get('country', 'Unknown')
+            return True
+        
+        if self.is_whitelisted(threat):
+            return False
+        if threat.pid in self.allowed_pids:
+            return False
+        if threat.connection_key in self.alerted_connections:
+            return False
+        
+        return True
+    
+    def handle_threat(self, threat):
+        """Decide what to do with an enriched threat (act stage)"""
+        self.lists_ready.wait()
+        
+        print(f"[DEBUG] Threat detected - checking whitelists and blocklists...")
+        print(f"[DEBUG] Current allowed_pids: {self.allowed_pids}")
+        print(f"[DEBUG] Current alerted_connections: {list(self.alerted_connections.keys())}")
+        print(f"[DEBUG] Threat PID: {threat.pid}")
+        
+        # Check blocklist FIRST - auto-block if previously blocked
+        if self.is_blocklisted(threat):
+            print(f"[DEBUG] Connection is in permanent blocklist - auto-blocking")
+            print(f"🚨 BLOCKED: Previously blocked connection from {threat.country} detected!")
+            # Auto-block without showing warning
+            self.record_threat(threat, 'auto-blocked')
+            self.pipeline.submit_action(self.monitor.block_connection, threat.pid, threat.process_name)
+            return
+        
+        # Check permanent whitelist
+        if self.is_whitelisted(threat):
+            print(f"[DEBUG] Skipping alert - connection is in permanent whitelist")
+            return
+        
+        # Skip if user already allowed this PID in this session
+        if threat.pid in self.allowed_pids:
+            print(f"[DEBUG] Skipping alert - PID {threat.pid} was previously allowed in this session")
+            return
+        
+        # Create a unique key for this connection
+        connection_key = threat.connection_key
+        print(f"[DEBUG] Connection key: {connection_key}")
+        
+        # Skip if we've already alerted on this exact connection
+        if connection_key in self.alerted_connections:
+            print(f"[DEBUG] Skipping alert - already alerted on this connection")
+            return
+        
+        # Operator policy: the first matching rule blocks, allows or warns as usual
+        decision = self.policy.current.evaluate(threat, self.monitor.geo.country_code(threat.remote_address))
+        if decision is not None:
+            self.policy_hits[decision.action] += 1
+            print(f"[POLICY] Rule '{decision.rule}' matched - {decision.action}")
+            if decision.action == 'block':
+                self.record_threat(threat, 'auto-blocked')
+                self.pipeline.submit_action(self.monitor.block_connection, threat.pid, threat.process_name)
+                return
+            if decision.action == 'allow':
+                return
+        
+        # A UI client in the process's own session shows the warning there
+        if self.router.has_client(threat.session):
+            self.alerted_connections[connection_key] = True
+            self.record_threat(threat, 'pending')
+            self.router.dispatch(threat)
+            print(f"[SESSION] Threat {threat.id} sent to session {threat.session}")
+            return
+        
+        # Only one warning at a time; the session is re-detected after it closes
+        if self.interactive and not self.claim_warning():
+            return
+        
+        print(f"\n🚨 THREAT DETECTED!")
+        print(f"Software: {threat.software_name}")
+        print(f"Remote IP: {threat.remote_address}")
+        print(f"Country: {threat.country}")
+        
+        # Mark this connection as alerted
+        self.alerted_connections[connection_key] = True
+        self.record_threat(threat, 'pending')
+        
+        if not self.interactive:
+            print(f"[DEBUG] Threat {threat.id} awaiting allow/block through the control API")
+            return
+        
+        # Show warning screen
+        self.show_warning(threat)
+    
+    async def run_async(self):
+        """Run the scan pipeline and background upkeep until request_stop()"""
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
         print("SpamFisher monitoring started...")
         print("Watching for remote access threats...")
         
-        while self.running:
-            # Skip if warning is already shown
-            if self.warning_active:
-                time.sleep(1)
-                continue
-            
-            # Scan for threats
-            threat = self.monitor.scan_for_threats()
-            
-            if threat:
-                print(f"[DEBUG] Threat detected - checking whitelists and blocklists...")
-                print(f"[DEBUG] Current allowed_pids: {self.allowed_pids}")
-                print(f"[DEBUG] Current alerted_connections: {list(self.alerted_connections.keys())}")
-                print(f"[DEBUG] Threat PID: {threat['pid']}")
-                
-                # Check blocklist FIRST - auto-block if previously blocked
-                if self.is_blocklisted(threat):
-                    print(f"[DEBUG] Connection is in permanent blocklist - auto-blocking")
-                    print(f"🚨 BLOCKED: Previously blocked connection from {threat['country']} detected!")
-                    # Auto-block without showing warning
-                    self.monitor.block_connection(threat['pid'], threat['process_name'])
-                    time.sleep(SETTINGS['check_interval'])
-                    continue
-                
-                # Check permanent whitelist
-                if self.is_whitelisted(threat):
-                    print(f"[DEBUG] Skipping alert - connection is in permanent whitelist")
-                    time.sleep(SETTINGS['check_interval'])
-                    continue
-                
-                # Skip if user already allowed this PID in this session
-                if threat['pid'] in self.allowed_pids:
-                    print(f"[DEBUG] Skipping alert - PID {threat['pid']} was previously allowed in this session")
-                    time.sleep(SETTINGS['check_interval'])
-                    continue
-                
-                # Create a unique key for this connection
-                connection_key = f"{threat['pid']}_{threat['remote_ip']}"
-                print(f"[DEBUG] Connection key: {connection_key}")
-                
-                # Skip if we've already alerted on this exact connection
-                if connection_key in self.alerted_connections:
-                    print(f"[DEBUG] Skipping alert - already alerted on this connection")
-                    time.sleep(SETTINGS['check_interval'])
-                    continue
-                
-                print(f"\n🚨 THREAT DETECTED!")
-                print(f"Software: {threat['software_name']}")
-                print(f"Remote IP: {threat['remote_ip']}")
-                print(f"Country: {threat['country']}")
-                
-                # Mark this connection as alerted
-                self.alerted_connections[connection_key] = True
-                
-                # Show warning screen
-                self.warning_active = True
-                self.show_warning(threat)
-            
-            time.sleep(SETTINGS['check_interval'])
+        tasks = [
+            asyncio.create_task(self.pipeline.run(), name='sf-pipeline'),
+            # Everything detection does not need comes up after the first scan is underway
+            asyncio.create_task(asyncio.to_thread(self.load_lists), name='sf-load-lists'),
+            asyncio.create_task(asyncio.to_thread(self.open_status), name='sf-status'),
+            asyncio.create_task(self.watch_signatures(), name='sf-signatures'),
+            asyncio.create_task(self.expire_allows(), name='sf-allow-expiry'),
+            asyncio.create_task(self.checkpoint_state(), name='sf-checkpoint'),
+            asyncio.create_task(self.govern_resources(), name='sf-governor'),
+            asyncio.create_task(self.watch_integrity(), name='sf-integrity'),
+        ]
+        if self.interactive:
+            tasks.append(asyncio.create_task(self.prewarm_assets(), name='sf-assets'))
+        try:
+            await self.stop_event.wait()
+        finally:
+            self.running = False
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.to_thread(self.pipeline.close)
+            try:
+                await asyncio.to_thread(self.save_checkpoint)
+            except Exception as e:
+                print(f"[CHECKPOINT] Save failed: {e}")
+            self.monitor.geo.close()
+            if self.status_writer is not None:
+                self.status_writer.close()
+                self.status_writer = None
+    
+    async def prewarm_assets(self):
+        """Prepare the warning layouts once the first scan is done, so the first warning does not build them"""
+        while not self.pipeline.first_cycle.is_set():
+            await asyncio.sleep(0.1)
+        from assets import prewarm
+        await asyncio.to_thread(prewarm)
+    
+    def restore_checkpoint(self):
+        """Resume session allows, alerted connections and cached countries from the last checkpoint"""
+        try:
+            state = self.checkpoint.load()
+        except CheckpointError as e:
+            print(f"[CHECKPOINT] Starting fresh ({e})")
+            return
+        with self.state_lock:
+            for pid, expires_at in state.allowed:
+                self.allowed_pids.add(pid)
+                if expires_at:
+                    self.allow_expiry.schedule(('pid', pid), expires_at)
+            for key in state.alerted:
+                self.alerted_connections[key] = True
+        self.monitor.geo.import_cache((unpack_ip(ip), country, code, expires_at)
+                                      for ip, country, code, expires_at in state.geo)
+        print(f"[CHECKPOINT] Resumed from {time.time() - state.saved_at:.0f}s ago: "
+              f"{len(state.allowed)} allowed PIDs, {len(state.alerted)} alerted connections, "
+              f"{len(state.geo)} cached countries")
+    
+    def save_checkpoint(self):
+        """Write the session state if it changed since the last checkpoint"""
+        with self.state_lock:
+            allowed = [(pid, self.allow_expiry.expires_at(('pid', pid)) if ('pid', pid) in self.allow_expiry else 0.0)
+                       for pid in self.allowed_pids]
+            # Connections still awaiting a decision are warned about again after a restart
+            pending = {threat.connection_key for threat in self.pending_threats.values()}
+            alerted = [key for key in self.alerted_connections if key not in pending]
+        geo = [(pack_ip(ip), country, code, expires_at)
+               for ip, country, code, expires_at in self.monitor.geo.export_cache()]
+        self.checkpoint.save(allowed, alerted, geo)
+    
+    async def checkpoint_state(self):
+        """Checkpoint the session state every few seconds"""
+        while True:
+            await asyncio.sleep(SETTINGS['checkpoint_interval'])
+            try:
+                await asyncio.to_thread(self.save_checkpoint)
+            except Exception as e:
+                print(f"[CHECKPOINT] Save failed: {e}")
+    
+    async def expire_allows(self):
+        """Advance the allow expiry wheel every tick and evict what expired in one batch (and expire routed warnings)"""
+        while True:
+            await asyncio.sleep(SETTINGS['expiry_tick'])
+            with self.state_lock:
+                expired = self.allow_expiry.advance()
+            for threat in self.router.expire():
+                self.warn_locally(threat)
+            if expired:
+                try:
+                    await asyncio.to_thread(self.evict_allows, expired)
+                except Exception as e:
+                    print(f"[ALLOW] Eviction failed: {e}")
+    
+    def evict_allows(self, expired):
+        """Drop expired allow decisions from memory and from the encrypted whitelist (one save)"""
+        keys = [key for kind, key in expired if kind == 'list']
+        with self.state_lock:
+            for kind, key in expired:
+                if kind == 'pid':
+                    self.allowed_pids.discard(key)
+        removed = [key for key in keys if self.permanent_whitelist.pop(key, None) is not None]
+        if removed:
+            self.secure_whitelist.save(self.permanent_whitelist)
+        print(f"[ALLOW] Expired {len(expired)} allow decision(s), {len(removed)} whitelist entries removed")
+    
+    async def govern_resources(self):
+        """Sample the agent's own CPU and memory use and degrade or recover when the level changes"""
+        while True:
+            await asyncio.sleep(SETTINGS['governor_interval'])
+            level = self.governor.sample()
+            if level is not None:
+                self.apply_resource_level(level)
+    
+    def apply_resource_level(self, level):
+        """Set scan interval, geolocation cache size and enrichment for a governor level"""
+        name, interval_scale, cache_share, enrichment = LEVELS[level]
+        self.pipeline.interval_scale = interval_scale
+        self.monitor.enrichment = enrichment
+        self.monitor.geo.resize_cache(int(SETTINGS['geo_cache_size'] * cache_share))
+        stats = self.governor.stats
+        print(f"[GOVERNOR] Resource level {name} (CPU {stats['cpu_percent']}%, {stats['rss_mb']} MB): "
+              f"checking every {SETTINGS['check_interval'] * interval_scale}s, "
+              f"geolocation {'on' if enrichment else 'cached only'}")
+    
+    async def watch_integrity(self):
+        """Re-check the source files against the manifest, reporting each new problem once"""
+        reported = set()
+        while True:
+            await asyncio.sleep(SETTINGS['integrity_interval'])
+            problems = await asyncio.to_thread(self.integrity.verify)
+            for problem in problems:
+                if problem not in reported:
+                    print(f"[SECURITY] WARNING: Integrity check failed while running: {problem}")
+            if reported and not problems:
+                print("[SECURITY] Integrity check passed again")
+            reported = set(problems)
+    
+    async def watch_signatures(self):
+        """Poll the signature, relay range and policy files for changes"""
+        while True:
+            await asyncio.sleep(SETTINGS['signature_reload_interval'])
+            for store in (self.monitor.signatures, self.monitor.relays, self.policy):
+                try:
+                    await asyncio.to_thread(store.reload)
+                except Exception as e:
+                    print(f"[SIGNATURES] Reload of {store.path} failed: {e}")
+    
+    async def scan_once(self):
+        """Enumerate, classify and enrich once; returns the threats without acting"""
+        return await self.pipeline.scan_once()
+    
+    def request_stop(self):
+        """Ask run_async() to shut down (safe from any thread or signal handler)"""
+        self.running = False
+        if self.loop is not None and self.stop_event is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.stop_event.set)
+            except RuntimeError:
+                pass  # Loop already closed
     
     def show_warning(self, threat_info):
         """Display warning in main thread"""
         # Create and show warning in a way that doesn't block monitoring
-        import threading
+        started = time.perf_counter()
+        from ui import WarningScreen
+        
+        def visible(_):
+            shown_ms = (time.perf_counter() - started) * 1000
+            detected_ms = (time.time() - threat_info.detected_at) * 1000
+            with self.state_lock:
+                self.warning_latency.append((shown_ms, detected_ms))
+            print(f"[UI] Warning visible after {shown_ms:.0f} ms ({detected_ms:.0f} ms after detection)")
         
         def show_warning_thread():
             warning = WarningScreen(
                 threat_info,
                 self.handle_block,
-                self.handle_allow
+                self.handle_allow,
+                visible
             )
             warning.show()
         
@@ -304,10 +758,6 @@ class SpamFisher:
     
     def run(self):
         """Start the application"""
-        # Start monitoring in background thread
-        monitor_thread = threading.Thread(target=self.monitoring_loop, daemon=True)
-        monitor_thread.start()
-        
         # Create tray icon
         icon = self.create_tray_icon()
         
@@ -317,44 +767,90 @@ class SpamFisher:
         print("Or press Ctrl+C in this window to stop")
         print("=" * 50)
         
-        # Run tray icon in a thread so we can handle Ctrl+C
-        import signal
-        
-        def run_tray():
-            icon.run()
-        
-        tray_thread = threading.Thread(target=run_tray, daemon=True)
+        # Tray runs in its own thread; the main thread drives the event loop
+        tray_thread = threading.Thread(target=icon.run, daemon=True)
         tray_thread.start()
         
         # Handle Ctrl+C gracefully
         def signal_handler(sig, frame):
             print("\n[SpamFisher] Ctrl+C detected, shutting down...")
-            self.running = False
-            if self.tray_icon:
-                self.tray_icon.stop()
-            sys.exit(0)
+            self.request_stop()
         
         signal.signal(signal.SIGINT, signal_handler)
         
-        # Keep main thread alive and responsive to Ctrl+C
         try:
-            while self.running:
-                time.sleep(0.5)
+            asyncio.run(self.run_async())
         except KeyboardInterrupt:
             print("\n[SpamFisher] Keyboard interrupt, shutting down...")
+        finally:
             self.running = False
             if self.tray_icon:
                 self.tray_icon.stop()
+    
+    def run_daemon(self):
+        """Run only the monitoring engine, controlled through the local socket/pipe"""
+        from control import ControlServer, SessionServer
+        
+        control = ControlServer(self)
+        control.start()
+        sessions = SessionServer(self)
+        try:
+            sessions.start()
+        except OSError as e:
+            sessions = None
+            print(f"[SESSION] Session clients unavailable ({e}) - warnings stay with the agent")
+        
+        print("SpamFisher daemon running - use control.py to query or decide")
+        
+        def signal_handler(sig, frame):
+            print(f"\n[SpamFisher] Signal {sig} received, shutting down...")
+            self.request_stop()
+        
+        signal.signal(signal.SIGINT, signal_handler)
+        if hasattr(signal, 'SIGTERM'):
+            signal.signal(signal.SIGTERM, signal_handler)
+        
+        try:
+            asyncio.run(self.run_async())
+        finally:
+            control.stop()
+            if sessions is not None:
+                sessions.stop()
+        print("[SpamFisher] Daemon stopped")
 
 
 def main():
     """Entry point"""
+    parser = argparse.ArgumentParser(description='SpamFisher - Remote Access Scam Protection')
+    parser.add_argument('--daemon', action='store_true',
+                        help='run headless with a local control socket (no prompts, no UI)')
+    parser.add_argument('--check-allocations', action='store_true',
+                        help='measure memory allocated by an idle scan cycle and exit')
+    parser.add_argument('--benchmark-startup', action='store_true',
+                        help='measure time-to-first-scan and exit')
+    args = parser.parse_args()
+    
+    if args.benchmark_startup:
+        benchmark_startup()
+        return
+    
+    if args.check_allocations:
+        from monitor import idle_allocation_check
+        sys.exit(0 if idle_allocation_check() else 1)
+    
     print("=" * 50)
     print("SpamFisher - Remote Access Scam Protection")
     print("SECURITY ENHANCED VERSION")
     print("=" * 50)
     print()
     
+    if args.daemon:
+        if not is_admin():
+            print("[SECURITY] Not running as administrator - firewall blocking unavailable")
+        app = SpamFisher(interactive=False)
+        app.run_daemon()
+        return
+    
     # Request admin rights for full protection
     if not is_admin():
         print("[SECURITY] Administrator rights required for full protection")
@@ -372,5 +868,45 @@ def main():
     app.run()
 
 
+def benchmark_startup(runs=5):
+    """Measure import time, init time and time-to-first-scan over cold starts"""
+    probe = (
+        "import threading, time\n"
+        "import main\n"
+        "imported = time.perf_counter()\n"
+        "app = main.SpamFisher()\n"
+        "constructed = time.perf_counter()\n"
+        "threading.Thread(target=main.asyncio.run, args=(app.run_async(),), daemon=True).start()\n"
+        "app.pipeline.first_cycle.wait(60)\n"
+        "app.lists_ready.wait(60)\n"
+        "ready = time.perf_counter()\n"
+        "app.request_stop()\n"
+        "start = main.STARTED_AT\n"
+        "print('BENCH', imported - start, constructed - start, app.pipeline.first_cycle_at - start, ready - start)\n"
+    )
+    
+    print(f"SpamFisher startup benchmark ({runs} cold starts)")
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', probe],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True
+        ).stdout
+        for line in output.splitlines():
+            if line.startswith('BENCH '):
+                results.append([float(value) * 1000 for value in line.split()[1:]])
+    
+    if not results:
+        print("Benchmark failed - no timings reported")
+        return
+    
+    labels = ['imports done', 'SpamFisher() done', 'first scan done', 'lists loaded']
+    for index, label in enumerate(labels):
+        values = sorted(result[index] for result in results)
+        print(f"  {label:<18} median {values[len(values) // 2]:8.1f} ms   worst {values[-1]:8.1f} ms")
+
+
 if __name__ == '__main__':
     main()
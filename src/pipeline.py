@@ -0,0 +1,269 @@
+"""
+SpamFisher Scan Pipeline
+Runs enumerate, classify, enrich and act as separate asyncio stages so a
+slow step (exe lookup, geolocation timeout, netsh) cannot stall detection
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+from config import SETTINGS
+from records import Threat
+
+
+class DroppingQueue(asyncio.Queue):
+    """Bounded queue that discards its oldest item instead of blocking the producer"""
+    
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize)
+        self.dropped = 0
+        
+    def put_latest(self, item):
+        """Put an item, evicting the oldest one when the queue is full"""
+        while True:
+            try:
+                self.put_nowait(item)
+                return
+            except asyncio.QueueFull:
+                try:
+                    self.get_nowait()
+                    self.dropped += 1
+                except asyncio.QueueEmpty:
+                    pass
+
+
+class ScanPipeline:
+    """
+    enumerate -> classify -> enrich -> act
+    
+    Each stage is a task on the event loop. Blocking psutil work runs on
+    a single scan thread (so per-process scoring state is only touched
+    by one thread), enrichment is awaited concurrently up to
+    enrich_workers at a time, and kill/firewall actions go to an action
+    pool. Stages are joined by bounded queues; under backpressure
+    enrichment work is dropped oldest-first (the next cycle will
+    re-detect anything still active) so enumeration never waits on a
+    slow lookup.
+    """
+    
+    def __init__(self, monitor, on_threat: Callable[[Threat], None],
+                 prefilter: Optional[Callable[[Threat], bool]] = None,
+                 on_cycle: Optional[Callable[[], None]] = None):
+        self.monitor = monitor
+        self.on_threat = on_threat
+        self.prefilter = prefilter
+        self.on_cycle = on_cycle  # Called on the loop after each classified scan
+        
+        self.scan_pool = ThreadPoolExecutor(1, thread_name_prefix='sf-scan')
+        self.action_pool = ThreadPoolExecutor(SETTINGS['action_workers'], thread_name_prefix='sf-action')
+        
+        # Loop-owned state, only touched from the event loop thread
+        self.in_flight = set()  # (pid, remote_ip) currently between classify and act
+        self.enriching = set()  # keys currently being enriched
+        self.enrich_tasks = set()
+        self.history_task = None  # Background batch geolocation of recorded connections
+        self.interval_scale = 1  # check_interval multiplier, raised by the resource governor
+        
+        self.stats = {'cycles': 0, 'classified': 0, 'classify_errors': 0, 'threats': 0,
+                      'stale_dropped': 0, 'watched': 0, 'last_scan_at': 0.0, 'scan_duration': 0.0}
+        self.first_cycle = threading.Event()  # Set once the first scan has been classified
+        self.first_cycle_at = None  # time.perf_counter() of the first completed scan
+        
+    async def run(self):
+        """Run all stages until cancelled"""
+        size = SETTINGS['pipeline_queue_size']
+        self.classify_queue = DroppingQueue(size)
+        self.enrich_queue = DroppingQueue(size)
+        self.act_queue = asyncio.Queue(size)
+        self.enrich_slots = asyncio.Semaphore(SETTINGS['enrich_workers'])
+        
+        stages = [
+            asyncio.create_task(self.enumerate_stage(), name='sf-enumerate'),
+            asyncio.create_task(self.classify_stage(), name='sf-classify'),
+            asyncio.create_task(self.enrich_stage(), name='sf-enrich'),
+            asyncio.create_task(self.act_stage(), name='sf-act'),
+        ]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            pending = stages + list(self.enrich_tasks)
+            if self.history_task is not None:
+                pending.append(self.history_task)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            self.in_flight.clear()
+            self.enriching.clear()
+            
+    def close(self):
+        """Wait for running scans and actions, then release the pools"""
+        self.scan_pool.shutdown(wait=True, cancel_futures=True)
+        self.action_pool.shutdown(wait=True)
+        
+    def submit_action(self, fn: Callable, *args):
+        """Run a blocking action (kill, firewall) off the detection path"""
+        return self.action_pool.submit(self._guarded, fn, *args)
+        
+    def _guarded(self, fn: Callable, *args):
+        try:
+            return fn(*args)
+        except Exception as e:
+            print(f"[PIPELINE] Action {getattr(fn, '__name__', fn)} failed: {e}")
+            if SETTINGS['log_events']:
+                logging.error(f"Pipeline action failed: {e}")
+                
+    async def scan_once(self) -> List[Threat]:
+        """Enumerate, classify and enrich once without acting (for embedders)"""
+        loop = asyncio.get_running_loop()
+        running_software = await loop.run_in_executor(self.scan_pool, self.monitor.enumerate_software)
+        threats = await loop.run_in_executor(self.scan_pool, self.classify_batch, running_software, False)
+        return await self.monitor.enrich_many_async(threats)
+        
+    async def enumerate_stage(self):
+        """Find watched processes every check interval"""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            try:
+                running_software = await loop.run_in_executor(self.scan_pool, self.monitor.enumerate_software)
+                self.classify_queue.put_latest((loop.time() - started, running_software))
+                self.stats['cycles'] += 1
+            except Exception as e:
+                print(f"[PIPELINE] Enumeration failed: {e}")
+            self.resolve_history_countries()
+                
+            interval = SETTINGS['check_interval'] * self.interval_scale
+            await asyncio.sleep(max(0.0, interval - (loop.time() - started)))
+            
+    def resolve_history_countries(self):
+        """Start a batch lookup for IPs recorded without a country, one at a time"""
+        if not self.monitor.unresolved_countries or not self.monitor.enrichment:
+            return
+        if self.history_task is not None and not self.history_task.done():
+            return
+        self.history_task = asyncio.create_task(asyncio.to_thread(self.monitor.resolve_history_countries))
+        
+    async def classify_stage(self):
+        """Score each watched process; only threats move on"""
+        loop = asyncio.get_running_loop()
+        while True:
+            enumerate_duration, running_software = await self.classify_queue.get()
+            started = loop.time()
+            threats = await loop.run_in_executor(self.scan_pool, self.classify_batch, running_software)
+            for threat in threats:
+                self.queue_enrichment(threat)
+                
+            self.stats['watched'] = len(running_software)
+            self.stats['last_scan_at'] = time.time()
+            self.stats['scan_duration'] = enumerate_duration + loop.time() - started
+            if not self.first_cycle.is_set():
+                self.first_cycle_at = time.perf_counter()
+                self.first_cycle.set()
+            if self.on_cycle:
+                try:
+                    self.on_cycle()
+                except Exception as e:
+                    print(f"[PIPELINE] Cycle callback failed: {e}")
+                
+    def classify_batch(self, running_software, use_prefilter: bool = True) -> List[Threat]:
+        """Classify one enumeration result (runs on the scan thread)"""
+        threats = []
+        for software in running_software:
+            try:
+                threat = self.monitor.classify(software)
+            except Exception as e:
+                # A failure here means a watched process goes unscored, so keep the traceback
+                self.stats['classify_errors'] += 1
+                print(f"[PIPELINE] Classification failed for PID {software.pid}: {e}")
+                if SETTINGS['log_events']:
+                    logging.error(f"Classification failed for PID {software.pid}: {e}", exc_info=True)
+                continue
+                
+            self.stats['classified'] += 1
+            if not threat:
+                continue
+            if use_prefilter and self.prefilter and not self.prefilter(threat):
+                continue
+            threats.append(threat)
+        return threats
+        
+    def queue_enrichment(self, threat: Threat):
+        """Hand a threat to the enrich stage unless it is already in flight"""
+        key = threat.connection_key
+        if key in self.in_flight:
+            return
+        self.in_flight.add(key)
+        
+        threat.queued_at = time.monotonic()
+        before = self.enrich_queue.dropped
+        self.enrich_queue.put_latest(threat)
+        if self.enrich_queue.dropped != before:
+            self.stats['stale_dropped'] += self.enrich_queue.dropped - before
+            self.release_stale()
+            
+    def release_stale(self):
+        """Forget in-flight keys whose queued threat was evicted"""
+        queued = {t.connection_key
+                  for q in (self.enrich_queue, self.act_queue)
+                  for t in list(q._queue)}
+        self.in_flight &= queued | self.enriching
+        
+    async def enrich_stage(self):
+        """Start enrichment for queued threats, dropping stale ones; threats queued together share one lookup"""
+        while True:
+            batch = [await self.enrich_queue.get()]
+            while not self.enrich_queue.empty():
+                batch.append(self.enrich_queue.get_nowait())
+                
+            fresh = []
+            for threat in batch:
+                key = threat.connection_key
+                if time.monotonic() - threat.queued_at > SETTINGS['enrich_max_age']:
+                    self.stats['stale_dropped'] += 1
+                    self.in_flight.discard(key)
+                    continue
+                fresh.append(threat)
+            if not fresh:
+                continue
+                
+            await self.enrich_slots.acquire()
+            keys = {threat.connection_key for threat in fresh}
+            self.enriching |= keys
+            task = asyncio.create_task(self.enrich_batch(fresh, keys))
+            self.enrich_tasks.add(task)
+            task.add_done_callback(self.enrich_tasks.discard)
+            
+    async def enrich_batch(self, threats: List[Threat], keys):
+        """Enrich threats found together and pass them to the act stage"""
+        try:
+            threats = await self.monitor.enrich_many_async(threats)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[PIPELINE] Enrichment failed: {e}")
+            for threat in threats:
+                threat.country = threat.country or 'Unknown'
+        finally:
+            self.enrich_slots.release()
+            self.enriching -= keys
+            
+        for threat in threats:
+            await self.act_queue.put(threat)
+            
+    async def act_stage(self):
+        """Deliver enriched threats to the application one at a time"""
+        while True:
+            threat = await self.act_queue.get()
+            self.in_flight.discard(threat.connection_key)
+            
+            self.stats['threats'] += 1
+            try:
+                # Decisions may wait on list loading or persist to disk
+                await asyncio.to_thread(self.on_threat, threat)
+            except Exception as e:
+                print(f"[PIPELINE] Threat handler failed: {e}")
+                if SETTINGS['log_events']:
+                    logging.error(f"Threat handler failed: {e}")
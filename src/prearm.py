@@ -0,0 +1,221 @@
+"""
+SpamFisher Pre-armed Blocking
+Everything BLOCK needs - the process handle, executable path, child tree
+and firewall rule - is prepared when a watched process first appears, so
+blocking is only signals followed by a firewall commit
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, Optional
+import psutil
+from security import StagedFirewallRule
+
+
+class ArmedProcess:
+    """Handles and staged firewall rule for one watched process"""
+    
+    __slots__ = ('pid', 'process_name', 'process', 'exe', 'children', 'firewall', 'refreshed_at')
+    
+    def __init__(self, process: psutil.Process, process_name: str, tree=None):
+        self.pid = process.pid
+        self.process_name = process_name
+        self.process = process  # Remembers its create time, so a recycled PID is never signalled
+        try:
+            self.exe = process.exe()
+        except psutil.Error as e:
+            print(f"[SECURITY] Could not get executable path for PID {self.pid}: {e}")
+            self.exe = None
+        self.firewall = StagedFirewallRule(self.exe, process_name) if self.exe else None
+        self.children = {}
+        self.refresh(tree)
+        
+    def refresh(self, tree=None):
+        """Re-read the child tree from the ancestry index (or psutil), keeping known handles"""
+        self.refreshed_at = time.monotonic()
+        if tree is not None:
+            known = self.children
+            children = {}
+            for pid in tree.members_of(self.pid):
+                child = known.get(pid)
+                if child is None or not child.is_running():
+                    try:
+                        child = psutil.Process(pid)
+                    except psutil.Error:
+                        continue
+                children[pid] = child
+            self.children = children
+            return
+        try:
+            current = self.process.children(recursive=True)
+        except psutil.Error:
+            return
+        known = self.children
+        self.children = {child.pid: known[child.pid] if known.get(child.pid) == child else child
+                         for child in current}
+                         
+    def fire(self) -> Optional[float]:
+        """
+        Terminate the process tree, children first. Returns the seconds
+        until the process and its known children had been signalled - the
+        disconnect - or None if the process could not be signalled
+        (already exited, or access denied).
+        """
+        started = time.perf_counter()
+        children = list(self.children.values())
+        for child in children:
+            try:
+                child.terminate()
+            except psutil.Error:
+                pass
+        try:
+            self.process.terminate()
+        except psutil.Error as e:
+            print(f"[SECURITY] Error killing process tree: {e}")
+            return None
+        signalled = time.perf_counter() - started
+        
+        # Children started since the last scan
+        try:
+            late = [child for child in self.process.children(recursive=True) if child.pid not in self.children]
+        except psutil.Error:
+            late = []
+        for child in late:
+            try:
+                child.terminate()
+            except psutil.Error:
+                pass
+                
+        # Wait for termination, force kill if still alive
+        _, alive = psutil.wait_procs([self.process] + children + late, timeout=3)
+        for process in alive:
+            try:
+                print(f"[SECURITY] Force killing PID {process.pid}")
+                process.kill()
+            except psutil.Error:
+                pass
+                
+        print(f"[SECURITY] Terminated {self.process_name} (PID: {self.pid}) "
+              f"and {len(children) + len(late)} child process(es)")
+        return signalled
+
+
+class PrearmTable:
+    """
+    Armed processes by PID. sync() runs on the scan thread every cycle;
+    take() is called by whichever thread carries out a block. With an
+    ancestry index, child trees are refreshed only when it reports births
+    or deaths under a watched process.
+    """
+    
+    def __init__(self, tree=None):
+        self.tree = tree  # ancestry.ProcessTree, updated by the monitor before sync()
+        self.armed: Dict[int, ArmedProcess] = {}
+        self.lock = threading.Lock()
+        self.stats = {'armed': 0, 'blocked_armed': 0, 'blocked_cold': 0, 'last_disconnect_ms': None}
+        
+    def sync(self, running_software: Iterable):
+        """Arm newly seen watched processes, refresh changed child trees, forget vanished ones"""
+        seen = 0
+        for software in running_software:
+            seen += 1
+            if software.pid in self.armed:
+                continue
+            try:
+                armed = ArmedProcess(psutil.Process(software.pid), software.process_name, self.tree)
+            except psutil.Error:
+                continue
+            with self.lock:
+                self.armed[software.pid] = armed
+            self.stats['armed'] += 1
+            
+        if self.tree is not None:
+            for pid in self.tree.take_changed():
+                armed = self.armed.get(pid)
+                if armed is not None:
+                    armed.refresh(self.tree)
+                
+        if len(self.armed) > seen:
+            watched = {software.pid for software in running_software}
+            with self.lock:
+                for pid in [pid for pid in self.armed if pid not in watched]:
+                    del self.armed[pid]
+                    
+    def take(self, pid: int, process_name: str) -> Optional[ArmedProcess]:
+        """The armed process for a PID, arming it now if the scan has not yet"""
+        with self.lock:
+            armed = self.armed.pop(pid, None)
+        if armed is not None and armed.process.is_running():
+            self.stats['blocked_armed'] += 1
+            return armed
+        self.stats['blocked_cold'] += 1
+        try:
+            return ArmedProcess(psutil.Process(pid), process_name)  # Not in the index yet: walk psutil
+        except psutil.Error as e:
+            print(f"[SECURITY] Error killing process tree: {e}")
+            return None
+            
+    def record_disconnect(self, seconds: float):
+        self.stats['last_disconnect_ms'] = round(seconds * 1000, 1)
+
+
+def spawn_tree(children: int = 3) -> psutil.Process:
+    """A sleeping Python process with sleeping children, to block in the benchmark"""
+    import subprocess
+    import sys
+    
+    code = ("import subprocess, sys, time\n"
+            f"[subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)']) for _ in range({children})]\n"
+            "print('ready', flush=True)\n"
+            "time.sleep(60)\n")
+    popen = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, text=True)
+    popen.stdout.readline()
+    return psutil.Process(popen.pid)
+
+
+def benchmark(runs: int = 5):
+    """Time-to-disconnect (every process in the tree signalled): before, cold and pre-armed"""
+    from records import RunningSoftware
+    from security import get_process_executable_path
+    
+    print(f"SpamFisher blocking benchmark ({runs} runs, process with 3 children)")
+    
+    def median(values):
+        return sorted(values)[len(values) // 2] * 1000
+        
+    def before(process):
+        # The steps block_connection took before pre-arming, up to the last signal
+        started = time.perf_counter()
+        get_process_executable_path(process.pid)
+        parent = psutil.Process(process.pid)
+        children = parent.children(recursive=True)
+        for child in children:
+            child.name()
+            child.terminate()
+        parent.name()
+        parent.terminate()
+        elapsed = time.perf_counter() - started
+        psutil.wait_procs([parent] + children, timeout=3)
+        return elapsed
+        
+    def cold(process):
+        started = time.perf_counter()
+        armed = PrearmTable().take(process.pid, process.name())
+        return time.perf_counter() - started + armed.fire()
+        
+    def armed(process):
+        table = PrearmTable()
+        table.sync([RunningSoftware('bench', 'bench', process.name(), process.pid, ())])
+        return table.take(process.pid, process.name()).fire()
+        
+    results = [(label, [measure(spawn_tree()) for _ in range(runs)])
+               for label, measure in (('look up, then kill (before)', before),
+                                      ('pre-arm at block time (cold)', cold),
+                                      ('pre-armed kill', armed))]
+    for label, times in results:
+        print(f"  {label:<30} median {median(times):8.2f} ms")
+    print("  (firewall rules are committed after the disconnect in every case)")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,143 @@
+"""
+SpamFisher Records
+Compact typed records passed between the scan stages
+"""
+
+import ipaddress
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+
+_V4_MAPPED = 0xFFFF << 32
+
+
+@lru_cache(maxsize=4096)
+def pack_ip(ip: str) -> int:
+    """IPv4/IPv6 address as one 128-bit integer (IPv4 as v4-mapped)"""
+    address = ipaddress.ip_address(ip.split('%')[0])
+    if address.version == 4:
+        return _V4_MAPPED | int(address)
+    if address.ipv4_mapped is not None:
+        return _V4_MAPPED | int(address.ipv4_mapped)
+    return int(address)
+
+
+@lru_cache(maxsize=4096)
+def is_unicast(value: int) -> bool:
+    """False for multicast, broadcast, link-local, loopback, unspecified and reserved packed addresses"""
+    if value >> 32 == 0xFFFF:
+        address = ipaddress.IPv4Address(value & 0xFFFFFFFF)
+    else:
+        address = ipaddress.IPv6Address(value)
+    return not (address.is_multicast or address.is_link_local or address.is_loopback or
+                address.is_unspecified or address.is_reserved)
+
+
+@lru_cache(maxsize=4096)
+def unpack_ip(value: int) -> str:
+    """Inverse of pack_ip"""
+    if value >> 32 == 0xFFFF:
+        return str(ipaddress.IPv4Address(value & 0xFFFFFFFF))
+    return str(ipaddress.IPv6Address(value))
+
+
+class RunningSoftware(NamedTuple):
+    """A watched process found by the enumerate stage"""
+    key: str  # Interned signature key
+    name: str
+    process_name: str
+    pid: int
+    ports: Sequence[int]  # Shared with the signature entry, not copied
+    io_rate: float = 0.0
+    
+    def to_dict(self) -> Dict:
+        return dict(self._asdict(), ports=list(self.ports))
+
+
+class ExternalConnection(NamedTuple):
+    """An established connection, or a live UDP flow, to a non-local address"""
+    remote_ip: int  # pack_ip()
+    remote_port: int
+    local_ip: int
+    local_port: int
+    protocol: str = 'tcp'  # 'tcp' or 'udp' (flows.py)
+    
+    @property
+    def remote_address(self) -> str:
+        return unpack_ip(self.remote_ip)
+        
+    @property
+    def local_address(self) -> str:
+        return unpack_ip(self.local_ip)
+        
+    def to_dict(self) -> Dict:
+        return {
+            'remote_ip': self.remote_address,
+            'remote_port': self.remote_port,
+            'local_ip': self.local_address,
+            'local_port': self.local_port,
+            'protocol': self.protocol
+        }
+
+
+class Threat:
+    """
+    A detected session on its way through enrich and act. Mutable because
+    later stages fill in country, id and state; slotted to keep it small.
+    """
+    
+    __slots__ = ('software_name', 'process_name', 'pid', 'remote_ip', 'remote_port',
+                 'country', 'score', 'detected_at', 'id', 'state', 'queued_at', 'session')
+                 
+    def __init__(self, software_name: str, process_name: str, pid: int, remote_ip: int,
+                 remote_port: int, country: Optional[str] = None, score: float = 0.0,
+                 detected_at: float = 0.0):
+        self.software_name = software_name
+        self.process_name = process_name
+        self.pid = pid
+        self.remote_ip = remote_ip  # pack_ip()
+        self.remote_port = remote_port
+        self.country = country  # None until enriched
+        self.score = score
+        self.detected_at = detected_at
+        self.id = None  # Assigned when recorded for the control API
+        self.state = None
+        self.queued_at = None
+        self.session = None  # Login session the process runs in (sessions.py), for routing the warning
+        
+    @property
+    def remote_address(self) -> str:
+        return unpack_ip(self.remote_ip)
+        
+    @property
+    def connection_key(self) -> Tuple[int, int]:
+        """Identifies this session's connection within a run"""
+        return (self.pid, self.remote_ip)
+        
+    @property
+    def list_key(self) -> str:
+        """Key used by the persistent whitelist/blocklist"""
+        return f"{self.software_name}_{self.remote_address}"
+        
+    def to_dict(self) -> Dict:
+        """Plain dict in the pre-record threat_info format"""
+        data = {
+            'software_name': self.software_name,
+            'process_name': self.process_name,
+            'pid': self.pid,
+            'remote_ip': self.remote_address,
+            'remote_port': self.remote_port,
+            'country': self.country,
+            'score': self.score,
+            'detected_at': self.detected_at
+        }
+        if self.id is not None:
+            data['id'] = self.id
+            data['state'] = self.state
+        if self.session is not None:
+            data['session'] = self.session
+        return data
+        
+    def __repr__(self):
+        return f"Threat({self.to_dict()})"
+
@@ -0,0 +1,269 @@
+"""
+SpamFisher Vendor Relay Ranges
+Locally stored address ranges of each remote access vendor's relay
+servers, indexed so telling a relay from a direct peer is a bucket lookup
+"""
+
+import bisect
+import ipaddress
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+from config import SETTINGS
+from records import pack_ip
+from scoring import RELAY_PORT
+from signatures import resolve_data_path
+
+
+# Ranges are split into buckets of one IPv4 /16 or one IPv6 /32
+V4_BUCKET_BITS = 16
+V6_BUCKET_BITS = 96
+V4_MAPPED = 0xFFFF << 32
+
+# Widest range accepted, so one entry cannot expand into too many buckets
+V4_MIN_PREFIX = 8
+V6_MIN_PREFIX = 16
+
+
+def is_v4(value: int) -> bool:
+    return value >> 32 == 0xFFFF
+
+
+def parse_range(cidr: str) -> Tuple[int, int]:
+    """First and last address of a CIDR block, packed like records.pack_ip (raises ValueError)"""
+    network = ipaddress.ip_network(cidr.strip(), strict=False)
+    if network.version == 4:
+        if network.prefixlen < V4_MIN_PREFIX:
+            raise ValueError(f"{cidr} is wider than /{V4_MIN_PREFIX}")
+        return V4_MAPPED | int(network.network_address), V4_MAPPED | int(network.broadcast_address)
+    if network.prefixlen < V6_MIN_PREFIX:
+        raise ValueError(f"{cidr} is wider than /{V6_MIN_PREFIX}")
+    return int(network.network_address), int(network.broadcast_address)
+
+
+class RelayRanges:
+    """Merged relay ranges of one vendor, bucketed by /16 (IPv4) or /32 (IPv6)"""
+    
+    def __init__(self, ranges: List[Tuple[int, int]]):
+        self.v4 = {}  # bucket -> (sorted starts, ends)
+        self.v6 = {}
+        self.count = 0
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        for start, end in merged:
+            self.count += 1
+            buckets, bits = (self.v4, V4_BUCKET_BITS) if is_v4(start) else (self.v6, V6_BUCKET_BITS)
+            for bucket in range(start >> bits, (end >> bits) + 1):
+                low = max(start, bucket << bits)
+                high = min(end, ((bucket + 1) << bits) - 1)
+                entry = buckets.get(bucket)
+                if entry is None:
+                    entry = buckets[bucket] = ([], [])
+                entry[0].append(low)
+                entry[1].append(high)
+                
+    def contains(self, ip: int) -> bool:
+        """True if a packed address is inside one of the ranges"""
+        if is_v4(ip):
+            entry = self.v4.get(ip >> V4_BUCKET_BITS)
+        else:
+            entry = self.v6.get(ip >> V6_BUCKET_BITS)
+        if entry is None:
+            return False
+        starts, ends = entry
+        i = bisect.bisect_right(starts, ip) - 1
+        return i >= 0 and ip <= ends[i]
+
+
+class RelaySet:
+    """Immutable relay index for every vendor, replaced as a whole on reload"""
+    
+    def __init__(self, version: int, ranges: Dict[str, RelayRanges]):
+        self.version = version
+        self.ranges = ranges
+        
+    def for_software(self, software_key: Optional[str]) -> Optional[RelayRanges]:
+        """Ranges of one vendor, or None if none are known (callers fall back to the port heuristic)"""
+        return self.ranges.get(software_key)
+
+
+def validate(data) -> RelaySet:
+    """Validate raw relay data and build a RelaySet (raises ValueError)"""
+    if not isinstance(data, dict):
+        raise ValueError("Relay file must be a JSON object")
+        
+    version = data.get('version')
+    if not isinstance(version, int) or isinstance(version, bool) or version < 1:
+        raise ValueError("Relay file needs a positive integer 'version'")
+        
+    ranges = data.get('ranges')
+    if not isinstance(ranges, dict):
+        raise ValueError("Relay file needs a 'ranges' object")
+        
+    indexed = {}
+    for key, cidrs in ranges.items():
+        if not isinstance(cidrs, list) or not all(isinstance(c, str) for c in cidrs):
+            raise ValueError(f"Entry {key}: ranges must be a list of CIDR strings")
+        parsed = []
+        for cidr in cidrs:
+            try:
+                parsed.append(parse_range(cidr))
+            except ValueError as e:
+                raise ValueError(f"Entry {key}: {e}")
+        if parsed:
+            indexed[sys.intern(key)] = RelayRanges(parsed)
+            
+    return RelaySet(version, indexed)
+
+
+class RelayStore:
+    """
+    Loads the relay data file and keeps `current` up to date, the same
+    way SignatureStore does: a reload swaps in a complete new RelaySet.
+    """
+    
+    def __init__(self, path: str = None):
+        self.path = resolve_data_path(path or SETTINGS['relays_file'])
+        self.current = RelaySet(0, {})  # No ranges: the port heuristic applies
+        self.file_state = None
+        self.reload()
+        
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            return None
+            
+    def reload(self) -> bool:
+        """Load the data file if it changed; returns True if the ranges were swapped"""
+        state = self._stat()
+        if state is None or state == self.file_state:
+            return False
+        self.file_state = state
+        
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                candidate = validate(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"[RELAYS] Rejected {self.path}: {e}")
+            if SETTINGS['log_events']:
+                logging.error(f"Rejected relay file {self.path}: {e}")
+            return False
+            
+        if candidate.version < self.current.version:
+            print(f"[RELAYS] Ignoring downgrade from version {self.current.version} to {candidate.version}")
+            return False
+            
+        self.current = candidate
+        total = sum(ranges.count for ranges in candidate.ranges.values())
+        if candidate.ranges:
+            print(f"[RELAYS] Loaded version {candidate.version}: {total} ranges for {len(candidate.ranges)} programs "
+                  f"({', '.join(sorted(candidate.ranges))}); the others use the port {RELAY_PORT} heuristic")
+        else:
+            print(f"[RELAYS] Loaded version {candidate.version}: no relay ranges - remote port {RELAY_PORT} is taken "
+                  f"as a relay for every program (python relays.py --update FEED to supply ranges)")
+        if SETTINGS['log_events']:
+            logging.info(f"Loaded relay ranges version {candidate.version} ({total} ranges)")
+        return True
+
+
+def read_feed(path: str) -> Dict[str, List[str]]:
+    """
+    Read an update feed: one '<software key> <CIDR>' pair per line, '#'
+    starts a comment. Every software key in the feed gets its full list
+    of ranges replaced.
+    """
+    feed = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split()
+            if len(parts) != 2:
+                raise ValueError(f"{path}:{number}: expected '<software key> <CIDR>'")
+            parse_range(parts[1])
+            feed.setdefault(parts[0], []).append(parts[1])
+    return feed
+
+
+def update(feed_path: str, path: str = None) -> int:
+    """Merge a feed into the relay data file under a new version; returns the version written"""
+    path = resolve_data_path(path or SETTINGS['relays_file'])
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        data = {'version': 0, 'ranges': {}}
+        
+    feed = read_feed(feed_path)
+    data['ranges'].update(feed)
+    data['version'] = data.get('version', 0) + 1
+    data['updated'] = time.strftime('%Y-%m-%d')
+    validate(data)
+    
+    # Write next to the file and rename over it, so the watcher never reads half a file
+    temp = f"{path}.tmp"
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+        f.write('\n')
+    os.replace(temp, path)
+    print(f"[RELAYS] Wrote version {data['version']} to {path}: {', '.join(sorted(feed)) or 'no changes'}")
+    return data['version']
+
+
+def benchmark(lookups: int = 100000):
+    """Time a lookup in a synthetic index of 5000 ranges against a linear scan"""
+    import random
+    
+    random.seed(42)
+    ranges = [parse_range(f"{random.randrange(1, 224)}.{random.randrange(256)}.{random.randrange(256)}.0/"
+                          f"{random.choice((20, 22, 24))}") for _ in range(5000)]
+    index = RelayRanges(ranges)
+    addresses = [pack_ip(f"{random.randrange(1, 224)}.{random.randrange(256)}.0.1") for _ in range(lookups)]
+    
+    print(f"SpamFisher relay lookup benchmark ({len(ranges)} ranges, {index.count} after merging)")
+    started = time.perf_counter()
+    for ip in addresses:
+        index.contains(ip)
+    indexed = (time.perf_counter() - started) / lookups
+    started = time.perf_counter()
+    for ip in addresses[:1000]:
+        any(start <= ip <= end for start, end in ranges)
+    linear = (time.perf_counter() - started) / 1000
+    print(f"  bucket index   {indexed * 1e6:8.3f} us per lookup")
+    print(f"  linear scan    {linear * 1e6:8.3f} us per lookup")
+
+
+def main():
+    """relays.py [--update FEED | --lookup SOFTWARE IP | --benchmark]"""
+    args = sys.argv[1:]
+    if args[:1] == ['--update'] and len(args) == 2:
+        try:
+            update(args[1])
+        except (OSError, ValueError) as e:
+            print(f"[RELAYS] Update failed: {e}")
+            sys.exit(1)
+    elif args[:1] == ['--lookup'] and len(args) == 3:
+        ranges = RelayStore().current.for_software(args[1])
+        if ranges is None:
+            print(f"No relay ranges for {args[1]}; the port heuristic applies")
+        else:
+            print('relay' if ranges.contains(pack_ip(args[2])) else 'peer')
+    elif args == ['--benchmark']:
+        benchmark()
+    else:
+        print(main.__doc__)
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+"""
+SpamFisher Detection Policy
+Declarative rules (policy.json) compiled at load time into one bitset
+index per condition, so a threat is checked against thousands of rules
+with a few dictionary or bisect lookups and integer ANDs
+"""
+
+import bisect
+import ipaddress
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import SETTINGS
+from records import Threat
+from signatures import resolve_data_path
+
+
+ACTIONS = ('block', 'allow', 'warn')
+CONDITIONS = ('software', 'ports', 'remote', 'country', 'hours', 'min_score', 'max_score')
+V4_MAPPED = 0xFFFF << 32
+
+
+def parse_ports(value) -> Tuple[int, int]:
+    """Port number or 'low-high' as an inclusive range (raises ValueError)"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        low = high = value
+    elif isinstance(value, str) and '-' in value:
+        low, high = (int(part) for part in value.split('-', 1))
+    else:
+        raise ValueError(f"bad port {value!r}")
+    if not 0 < low <= high < 65536:
+        raise ValueError(f"bad port range {value!r}")
+    return low, high
+
+
+def parse_network(cidr: str) -> Tuple[int, int]:
+    """First and last address of a CIDR block, packed like records.pack_ip (raises ValueError)"""
+    network = ipaddress.ip_network(cidr.strip(), strict=False)
+    if network.version == 4:
+        return V4_MAPPED | int(network.network_address), V4_MAPPED | int(network.broadcast_address)
+    return int(network.network_address), int(network.broadcast_address)
+
+
+def parse_hours(value: str) -> List[int]:
+    """'HH-HH' local hours, end exclusive, wrapping past midnight ('22-06')"""
+    start, end = (int(part) for part in value.split('-', 1))
+    if not (0 <= start < 24 and 0 <= end <= 24) or start == end:
+        raise ValueError(f"bad hours {value!r}")
+    if start < end:
+        return list(range(start, end))
+    return list(range(start, 24)) + list(range(0, end))
+
+
+class IntervalIndex:
+    """
+    Rules whose condition is a set of numeric intervals. The number line
+    is cut at every interval boundary; each piece stores the bitmask of
+    rules covering it, so a lookup is one bisect.
+    """
+    
+    def __init__(self, intervals: Iterable[Tuple[float, float, int]]):
+        # A rule's own intervals are merged first, so each adds its bit once
+        by_rule = {}
+        for low, high, bit in intervals:
+            by_rule.setdefault(bit, []).append((low, high))
+        events = {}  # bound -> +bit where a rule's interval starts, -bit where it ends
+        for bit, spans in by_rule.items():
+            merged = []
+            for low, high in sorted(spans):
+                if merged and low <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], high)
+                else:
+                    merged.append([low, high])
+            for low, high in merged:
+                events.setdefault(low, []).append(bit)
+                events.setdefault(high, []).append(-bit)
+        self.bounds = sorted(events)
+        self.masks = []
+        mask = 0
+        for bound in self.bounds:
+            for bit in events[bound]:
+                mask = mask | bit if bit > 0 else mask & ~-bit
+            self.masks.append(mask)
+            
+    def lookup(self, value) -> int:
+        i = bisect.bisect_right(self.bounds, value) - 1
+        return self.masks[i] if i >= 0 else 0
+
+
+class Decision:
+    """The first rule matching a threat"""
+    
+    __slots__ = ('action', 'rule', 'index')
+    
+    def __init__(self, action: str, rule: str, index: int):
+        self.action = action
+        self.rule = rule
+        self.index = index
+        
+    def __repr__(self):
+        return f"Decision({self.action!r}, rule={self.rule!r})"
+
+
+class CompiledPolicy:
+    """
+    Rule i is bit i. For each condition, `any_*` holds the rules without
+    that condition and the index holds the rules that have it, keyed by
+    value. A threat's candidate set is the AND over all conditions, and
+    the lowest set bit is the first matching rule in file order.
+    """
+    
+    def __init__(self, version: int, rules: List[Dict]):
+        self.version = version
+        self.rules = [(rule['action'], rule['name']) for rule in rules]
+        everyone = (1 << len(rules)) - 1
+        self.everyone = everyone
+        
+        software: Dict[str, int] = {}
+        countries: Dict[str, int] = {}
+        ports, networks, scores = [], [], []
+        self.hours = [0] * 24
+        self.any_software = self.any_ports = self.any_remote = self.any_country = everyone
+        self.any_hours = self.any_score = everyone
+        
+        for i, rule in enumerate(rules):
+            bit = 1 << i
+            match = rule['match']
+            if 'software' in match:
+                self.any_software &= ~bit
+                for name in match['software']:
+                    name = name.casefold()
+                    software[name] = software.get(name, 0) | bit
+            if 'ports' in match:
+                self.any_ports &= ~bit
+                ports.extend((low, high + 1, bit) for low, high in match['ports'])
+            if 'remote' in match:
+                self.any_remote &= ~bit
+                networks.extend((start, end + 1, bit) for start, end in match['remote'])
+            if 'country' in match:
+                self.any_country &= ~bit
+                for name in match['country']:
+                    name = name.casefold()
+                    countries[name] = countries.get(name, 0) | bit
+            if 'hours' in match:
+                self.any_hours &= ~bit
+                for hour in match['hours']:
+                    self.hours[hour] |= bit
+            if 'min_score' in match or 'max_score' in match:
+                self.any_score &= ~bit
+                scores.append((match.get('min_score', float('-inf')), match.get('max_score', float('inf')), bit))
+                
+        self.software = software
+        self.countries = countries
+        self.ports = IntervalIndex(ports)
+        self.networks = IntervalIndex(networks)
+        self.scores = IntervalIndex(scores)
+        
+    def __len__(self) -> int:
+        return len(self.rules)
+        
+    def candidates(self, software_name: str, process_name: str, remote_ip: int, remote_port: int,
+                   country: Optional[str], country_code: str, hour: int, score: float) -> int:
+        """Bitmask of the rules matching every condition"""
+        mask = self.everyone
+        if not mask:
+            return 0
+        mask &= (self.any_software | self.software.get(software_name.casefold(), 0)
+                 | self.software.get(process_name.casefold(), 0))
+        if mask:
+            mask &= self.any_ports | self.ports.lookup(remote_port)
+        if mask:
+            mask &= self.any_remote | self.networks.lookup(remote_ip)
+        if mask:
+            mask &= (self.any_country | (self.countries.get(country.casefold(), 0) if country else 0)
+                     | (self.countries.get(country_code.casefold(), 0) if country_code else 0))
+        if mask:
+            mask &= self.any_hours | self.hours[hour]
+        if mask:
+            mask &= self.any_score | self.scores.lookup(score)
+        return mask
+        
+    def evaluate(self, threat: Threat, country_code: str = '') -> Optional[Decision]:
+        """First rule matching an enriched threat, or None"""
+        mask = self.candidates(threat.software_name, threat.process_name, threat.remote_ip, threat.remote_port,
+                               threat.country, country_code, time.localtime(threat.detected_at).tm_hour,
+                               threat.score)
+        if not mask:
+            return None
+        index = (mask & -mask).bit_length() - 1
+        action, name = self.rules[index]
+        return Decision(action, name, index)
+
+
+def validate_rule(number: int, rule) -> Dict:
+    """Check one rule and convert its conditions to the compiled form (raises ValueError)"""
+    if not isinstance(rule, dict):
+        raise ValueError(f"Rule {number}: must be an object")
+    name = rule.get('name', f"#{number}")
+    if not isinstance(name, str):
+        raise ValueError(f"Rule {number}: 'name' must be a string")
+    if rule.get('action') not in ACTIONS:
+        raise ValueError(f"Rule {name}: 'action' must be one of {', '.join(ACTIONS)}")
+    match = rule.get('match', {})
+    if not isinstance(match, dict):
+        raise ValueError(f"Rule {name}: 'match' must be an object")
+    unknown = set(match) - set(CONDITIONS)
+    if unknown:
+        raise ValueError(f"Rule {name}: unknown conditions {', '.join(sorted(unknown))}")
+        
+    compiled = {}
+    try:
+        for key in ('software', 'country'):
+            if key in match:
+                values = match[key]
+                if not isinstance(values, list) or not all(isinstance(v, str) and v for v in values):
+                    raise ValueError(f"'{key}' must be a list of strings")
+                compiled[key] = values
+        if 'ports' in match:
+            if not isinstance(match['ports'], list):
+                raise ValueError("'ports' must be a list")
+            compiled['ports'] = [parse_ports(port) for port in match['ports']]
+        if 'remote' in match:
+            if not isinstance(match['remote'], list) or not all(isinstance(c, str) for c in match['remote']):
+                raise ValueError("'remote' must be a list of CIDR strings")
+            compiled['remote'] = [parse_network(cidr) for cidr in match['remote']]
+        if 'hours' in match:
+            if not isinstance(match['hours'], str):
+                raise ValueError("'hours' must be 'HH-HH'")
+            compiled['hours'] = parse_hours(match['hours'])
+        for key in ('min_score', 'max_score'):
+            if key in match:
+                if not isinstance(match[key], (int, float)) or isinstance(match[key], bool):
+                    raise ValueError(f"'{key}' must be a number")
+                compiled[key] = float(match[key])
+        if compiled.get('min_score', float('-inf')) >= compiled.get('max_score', float('inf')):
+            raise ValueError("'min_score' must be below 'max_score' (the range would match no score)")
+    except ValueError as e:
+        raise ValueError(f"Rule {name}: {e}")
+    return {'name': sys.intern(name), 'action': sys.intern(rule['action']), 'match': compiled}
+
+
+def validate(data) -> CompiledPolicy:
+    """Validate raw policy data and compile it (raises ValueError)"""
+    if not isinstance(data, dict):
+        raise ValueError("Policy file must be a JSON object")
+        
+    version = data.get('version')
+    if not isinstance(version, int) or isinstance(version, bool) or version < 1:
+        raise ValueError("Policy file needs a positive integer 'version'")
+        
+    rules = data.get('rules')
+    if not isinstance(rules, list):
+        raise ValueError("Policy file needs a 'rules' list")
+        
+    return CompiledPolicy(version, [validate_rule(number, rule) for number, rule in enumerate(rules, 1)])
+
+
+class PolicyStore:
+    """
+    Loads the policy file and keeps `current` up to date, the same way
+    SignatureStore does: a reload compiles a complete new policy and
+    swaps it in.
+    """
+    
+    def __init__(self, path: str = None):
+        self.path = resolve_data_path(path or SETTINGS['policy_file'])
+        self.current = CompiledPolicy(0, [])  # No rules: every threat is warned about
+        self.file_state = None
+        self.reload()
+        
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            return None
+            
+    def reload(self) -> bool:
+        """Load the policy file if it changed; returns True if the policy was swapped"""
+        state = self._stat()
+        if state is None or state == self.file_state:
+            return False
+        self.file_state = state
+        
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                candidate = validate(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"[POLICY] Rejected {self.path}: {e}")
+            if SETTINGS['log_events']:
+                logging.error(f"Rejected policy file {self.path}: {e}")
+            return False
+            
+        if candidate.version < self.current.version:
+            print(f"[POLICY] Ignoring downgrade from version {self.current.version} to {candidate.version}")
+            return False
+            
+        self.current = candidate
+        print(f"[POLICY] Loaded version {candidate.version}: {len(candidate)} rules")
+        if SETTINGS['log_events']:
+            logging.info(f"Loaded policy version {candidate.version} ({len(candidate)} rules)")
+        return True
+
+
+def matches(rule: Dict, threat: Threat, country_code: str, hour: int) -> bool:
+    """One rule checked condition by condition, as hand-written branches would (benchmark baseline)"""
+    match = rule['match']
+    if 'software' in match and not any(name.casefold() in (threat.software_name.casefold(),
+                                                           threat.process_name.casefold())
+                                       for name in match['software']):
+        return False
+    if 'ports' in match and not any(low <= threat.remote_port <= high for low, high in match['ports']):
+        return False
+    if 'remote' in match and not any(start <= threat.remote_ip <= end for start, end in match['remote']):
+        return False
+    if 'country' in match and not any(name.casefold() in ((threat.country or '').casefold(), country_code.casefold())
+                                      for name in match['country']):
+        return False
+    if 'hours' in match and hour not in match['hours']:
+        return False
+    if not match.get('min_score', float('-inf')) <= threat.score < match.get('max_score', float('inf')):
+        return False
+    return True
+
+
+def synthetic_rules(count: int, rng) -> List[Dict]:
+    """Random rules of the kinds an operator would write, each matching few threats"""
+    software = ['AnyDesk', 'TeamViewer', 'UltraViewer', 'SupRemo', 'VNC', 'RustDesk']
+    countries = ['IN', 'NG', 'PK', 'BD', 'RU', 'CN', 'BR', 'US', 'GB', 'DE', 'FR']
+    rules = []
+    for i in range(count):
+        match = {}
+        kind = i % 4
+        if kind == 0:
+            match['remote'] = [f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.0/24"]
+        elif kind == 1:
+            match['country'] = rng.sample(countries, 2)
+            match['hours'] = f"{rng.randrange(24)}-{rng.randrange(24)}"
+        elif kind == 2:
+            match['ports'] = [rng.randrange(1024, 60000)]
+            match['software'] = [rng.choice(software)]
+        else:
+            match['min_score'] = round(rng.uniform(1.0, 5.0), 2)
+            match['max_score'] = match['min_score'] + 0.01
+            match['software'] = [rng.choice(software)]
+        if match.get('hours') and match['hours'].split('-')[0] == match['hours'].split('-')[1]:
+            del match['hours']
+        rules.append({'name': f"r{i}", 'action': rng.choice(ACTIONS), 'match': match})
+    return rules
+
+
+def benchmark(sizes: Tuple[int, ...] = (10, 100, 1000, 5000), threats: int = 2000):
+    """Time compiling and evaluating growing policies against checking each rule in turn"""
+    import random
+    from records import pack_ip
+    
+    rng = random.Random(11)
+    samples = []
+    for _ in range(threats):
+        threat = Threat(rng.choice(['AnyDesk', 'TeamViewer', 'VNC']), 'AnyDesk.exe', 1000,
+                        pack_ip(f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.7"),
+                        rng.randrange(1024, 60000), 'Romania', rng.uniform(1.0, 6.0), time.time())
+        samples.append(threat)
+        
+    print(f"SpamFisher policy benchmark ({threats} threats per size)")
+    print(f"  {'rules':>6} {'compile':>10} {'indexed':>12} {'rule by rule':>14}")
+    for size in sizes:
+        raw = synthetic_rules(size, rng)
+        started = time.perf_counter()
+        policy = validate({'version': 1, 'rules': raw})
+        compile_ms = (time.perf_counter() - started) * 1000
+        rules = [validate_rule(n, rule) for n, rule in enumerate(raw, 1)]
+        
+        started = time.perf_counter()
+        indexed = [policy.evaluate(threat, 'RO') for threat in samples]
+        indexed_us = (time.perf_counter() - started) / threats * 1e6
+        
+        subset = samples[:max(20, threats * 10 // size)]
+        started = time.perf_counter()
+        for threat, expected in zip(subset, indexed):
+            hour = time.localtime(threat.detected_at).tm_hour
+            first = next((i for i, rule in enumerate(rules) if matches(rule, threat, 'RO', hour)), None)
+            assert first == (expected.index if expected else None), "indexed and linear results differ"
+        linear_us = (time.perf_counter() - started) / len(subset) * 1e6
+        print(f"  {size:>6} {compile_ms:>8.1f} ms {indexed_us:>9.2f} us {linear_us:>11.1f} us")
+
+
+def main():
+    """rules.py [--check [FILE] | --benchmark]"""
+    args = sys.argv[1:]
+    if args[:1] == ['--check'] and len(args) <= 2:
+        store = PolicyStore(args[1] if len(args) == 2 else None)
+        if store.file_state is None or store.current.version == 0:
+            sys.exit(1)
+    elif args == ['--benchmark']:
+        benchmark()
+    else:
+        print(main.__doc__)
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""
+SpamFisher Session Scoring
+Incremental per-process behavioral features and weighted session scores
+"""
+
+from collections import deque
+from typing import Callable, Dict, List, Optional
+from records import ExternalConnection
+from config import REMOTE_ACCESS_SOFTWARE, SCORING
+
+
+# Remote port taken to be a vendor relay for software without known relay ranges (relays.json)
+RELAY_PORT = 443
+
+
+class ProcessWindow:
+    """Sliding window of per-cycle feature values for one process"""
+    
+    def __init__(self, size: int):
+        self.size = size
+        self.cycles = deque()  # (features, remotes) per cycle, oldest first
+        self.sums = {}  # feature name -> running sum over the window
+        self.remote_cycles = {}  # remote ip -> number of cycles it appeared in
+        
+    def push(self, features: Dict[str, float], remotes: set):
+        """Add one cycle and evict the oldest, keeping sums up to date"""
+        self.cycles.append((features, remotes))
+        for name, value in features.items():
+            self.sums[name] = self.sums.get(name, 0.0) + value
+        for remote in remotes:
+            self.remote_cycles[remote] = self.remote_cycles.get(remote, 0) + 1
+            
+        if len(self.cycles) > self.size:
+            old_features, old_remotes = self.cycles.popleft()
+            for name, value in old_features.items():
+                self.sums[name] -= value
+            for remote in old_remotes:
+                count = self.remote_cycles[remote] - 1
+                if count:
+                    self.remote_cycles[remote] = count
+                else:
+                    del self.remote_cycles[remote]
+                    
+    def mean(self, name: str) -> float:
+        """Average of a feature over the cycles currently in the window"""
+        if not self.cycles:
+            return 0.0
+        return self.sums.get(name, 0.0) / len(self.cycles)
+
+
+class SessionScore:
+    """Result of scoring one process for one cycle"""
+    
+    def __init__(self, score: float, threshold: float, features: Dict[str, float],
+                 connection: Optional[ExternalConnection]):
+        self.score = score
+        self.threshold = threshold
+        self.features = features
+        self.connection = connection
+        
+    @property
+    def is_threat(self) -> bool:
+        return self.connection is not None and self.score >= self.threshold
+
+
+class CycleContext:
+    """Everything a feature extractor may look at for one process and cycle"""
+    
+    def __init__(self, pid: int, software_key: Optional[str], known_ports: List[int],
+                 listening_ports: List[int], connections: List[ExternalConnection],
+                 window: ProcessWindow, settings: Dict, io_rate: float = 0.0, shells: int = 0,
+                 relays=None):
+        self.pid = pid
+        self.software_key = software_key
+        self.known_ports = known_ports
+        self.listening_ports = listening_ports
+        self.connections = connections
+        self.window = window
+        self.settings = settings
+        self.io_rate = io_rate  # bytes/second from the I/O sampler
+        self.shells = shells  # Shells running under the process, from the ancestry index
+        self.relays = relays  # relays.RelayRanges of the vendor, None if unknown
+        self.remotes = {conn.remote_ip for conn in connections}
+        
+    def is_relay(self, conn: ExternalConnection) -> bool:
+        """Connection to a vendor relay: a range lookup when ranges are known, the relay port otherwise"""
+        if self.relays is not None:
+            return self.relays.contains(conn.remote_ip)
+        return conn.remote_port == RELAY_PORT
+        
+    def peer_connections(self) -> int:
+        """Connections that count towards the excess features (known relays never do)"""
+        if self.relays is None:
+            return len(self.connections)
+        return sum(1 for conn in self.connections if not self.relays.contains(conn.remote_ip))
+        
+    def peer_remotes(self) -> int:
+        """Distinct remotes that are not known relays"""
+        if self.relays is None:
+            return len(self.remotes)
+        return sum(1 for remote in self.remotes if not self.relays.contains(remote))
+
+
+def incoming_on_known_port(ctx: CycleContext) -> float:
+    """Someone is connected to a port the software accepts sessions on"""
+    return float(any(conn.local_port in ctx.known_ports for conn in ctx.connections))
+
+
+def incoming_on_listening_port(ctx: CycleContext) -> float:
+    """Connection on a (dynamic) listening port that is not a relay"""
+    return float(any(
+        conn.local_port in ctx.listening_ports and not ctx.is_relay(conn)
+        for conn in ctx.connections
+    ))
+
+
+def remote_known_port(ctx: CycleContext) -> float:
+    """Connections going out to remote desktop ports"""
+    return float(sum(1 for conn in ctx.connections if conn.remote_port in ctx.known_ports))
+
+
+def connection_excess(ctx: CycleContext) -> float:
+    """Connections above what the software keeps open while idle"""
+    return float(max(0, ctx.peer_connections() - ctx.settings['baseline_connections']))
+
+
+def distinct_remote_excess(ctx: CycleContext) -> float:
+    """Distinct remote peers above the idle baseline"""
+    return float(max(0, ctx.peer_remotes() - ctx.settings['baseline_connections']))
+
+
+def new_remotes(ctx: CycleContext) -> float:
+    """Remote peers not seen anywhere in the window"""
+    return float(sum(1 for remote in ctx.remotes if remote not in ctx.window.remote_cycles))
+
+
+def byte_rate(ctx: CycleContext) -> float:
+    """Process I/O throughput in MB/s since the previous cycle, capped at byte_rate_cap"""
+    return min(ctx.io_rate / 1_000_000, ctx.settings['byte_rate_cap'])
+
+
+def streaming(ctx: CycleContext) -> float:
+    """Throughput high enough to be a live desktop stream rather than an idle relay"""
+    if not ctx.connections:
+        return 0.0
+    return float(ctx.io_rate >= ctx.settings['stream_bytes_per_sec'])
+
+
+def shell_child(ctx: CycleContext) -> float:
+    """A shell is running under the software while it has an external connection"""
+    if not ctx.connections:
+        return 0.0
+    return float(ctx.shells > 0)
+
+
+# Features that are scored on the current cycle only; all others are
+# averaged over the sliding window
+INSTANT_FEATURES = {'incoming_known', 'incoming_listening', 'new_remotes', 'streaming', 'shell_child'}
+
+DEFAULT_FEATURES = {
+    'incoming_known': incoming_on_known_port,
+    'incoming_listening': incoming_on_listening_port,
+    'remote_known': remote_known_port,
+    'connections': connection_excess,
+    'distinct_remotes': distinct_remote_excess,
+    'new_remotes': new_remotes,
+    'byte_rate': byte_rate,
+    'streaming': streaming,
+    'shell_child': shell_child,
+}
+
+
+class SessionScorer:
+    """
+    Pluggable weighted scoring of remote access sessions.
+    Each feature extractor is run once per cycle per watched process;
+    windowed features are kept as running sums so scoring stays O(1)
+    in the window length.
+    """
+    
+    def __init__(self, signatures=None, relays=None):
+        self.signatures = signatures  # SignatureStore; falls back to config
+        self.relays = relays  # RelayStore; without it every vendor uses the relay port heuristic
+        self.settings_source = None
+        self.features = dict(DEFAULT_FEATURES)
+        self.instant_features = set(INSTANT_FEATURES)
+        self.windows = {}  # pid -> ProcessWindow
+        self.settings_cache = {}  # software key -> merged scoring settings
+        
+    def register_feature(self, name: str, extractor: Callable[[CycleContext], float],
+                         instant: bool = False):
+        """Add a custom feature; give it a weight in SCORING or per software"""
+        self.features[name] = extractor
+        if instant:
+            self.instant_features.add(name)
+        self.settings_cache.clear()
+        
+    def settings_for(self, software_key: Optional[str]) -> Dict:
+        """Default scoring settings overlaid with the software entry's overrides"""
+        if self.signatures is not None:
+            source = self.signatures.current
+            if source is not self.settings_source:
+                # Signatures were reloaded - rebuild merged settings lazily
+                self.settings_source = source
+                self.settings_cache.clear()
+            entry = source.get(software_key)
+        else:
+            entry = REMOTE_ACCESS_SOFTWARE.get(software_key, {})
+            
+        settings = self.settings_cache.get(software_key)
+        if settings is not None:
+            return settings
+            
+        override = entry.get('scoring', {})
+        settings = dict(SCORING)
+        settings.update({k: v for k, v in override.items() if k != 'weights'})
+        settings['weights'] = dict(SCORING['weights'])
+        settings['weights'].update(override.get('weights', {}))
+        
+        self.settings_cache[software_key] = settings
+        return settings
+        
+    def update(self, pid: int, software_key: Optional[str], known_ports: List[int],
+               listening_ports: List[int], connections: List[ExternalConnection],
+               io_rate: float = 0.0, shells: int = 0) -> SessionScore:
+        """Feed one cycle of observations for a process and score it"""
+        settings = self.settings_for(software_key)
+        window = self.windows.get(pid)
+        if window is None:
+            window = self.windows[pid] = ProcessWindow(settings['window'])
+            
+        relays = self.relays.current.for_software(software_key) if self.relays is not None else None
+        ctx = CycleContext(pid, software_key, known_ports, listening_ports,
+                           connections, window, settings, io_rate, shells, relays)
+        current = {name: extractor(ctx) for name, extractor in self.features.items()}
+        connection = self.pick_connection(ctx) if connections else None
+        window.push(current, ctx.remotes)
+        
+        weights = settings['weights']
+        features = {}
+        score = 0.0
+        for name, value in current.items():
+            if name not in self.instant_features:
+                value = window.mean(name)
+            features[name] = value
+            score += weights.get(name, 0.0) * value
+            
+        return SessionScore(score, settings['threshold'], features, connection)
+        
+    def pick_connection(self, ctx: CycleContext) -> ExternalConnection:
+        """Choose the connection most likely to be the remote user"""
+        for conn in ctx.connections:
+            if conn.local_port in ctx.known_ports:
+                return conn
+        for conn in ctx.connections:
+            if conn.local_port in ctx.listening_ports and not ctx.is_relay(conn):
+                return conn
+        for conn in ctx.connections:
+            if conn.remote_port in ctx.known_ports:
+                return conn
+        for conn in ctx.connections:
+            if conn.remote_ip not in ctx.window.remote_cycles:
+                return conn
+        return ctx.connections[0]
+        
+    def prune(self, running_pids: set):
+        """Drop windows of processes that are gone"""
+        for pid in [pid for pid in self.windows if pid not in running_pids]:
+            del self.windows[pid]
@@ -7,7 +7,6 @@ import ctypes
 import sys
 import subprocess
 import os
-from cryptography.fernet import Fernet
 import json
 
 
@@ -46,62 +45,68 @@ def request_admin_rights():
     return True
 
 
-def add_firewall_block(executable_path, process_name):
+class StagedFirewallRule:
     """
-    Add Windows Firewall rule to block an executable
-    Requires administrator privileges
+    The netsh commands that block one executable, built ahead of time.
+    They are independent of each other, so commit() runs them concurrently.
     """
-    if not is_admin():
-        print("[SECURITY] Cannot add firewall rule - not running as admin")
-        return False
     
-    try:
+    def __init__(self, executable_path, process_name):
+        self.executable_path = executable_path
+        self.process_name = process_name
         rule_name = f"SpamFisher_Block_{process_name}"
         
-        # Remove existing rule if present
-        subprocess.run(
-            ['netsh', 'advfirewall', 'firewall', 'delete', 'rule', 
-             f'name={rule_name}'],
-            capture_output=True,
-            check=False  # Don't raise error if rule doesn't exist
-        )
-        
-        # Add new blocking rule (inbound)
-        result_in = subprocess.run(
-            ['netsh', 'advfirewall', 'firewall', 'add', 'rule',
-             f'name={rule_name}_IN',
-             'dir=in',
-             'action=block',
-             f'program={executable_path}',
-             'enable=yes'],
-            capture_output=True,
-            text=True
-        )
+        # Remove existing rule if present (failure is expected when there is none)
+        self.cleanup = ['netsh', 'advfirewall', 'firewall', 'delete', 'rule', f'name={rule_name}']
         
-        # Add new blocking rule (outbound)
-        result_out = subprocess.run(
+        # Blocking rules (inbound, outbound)
+        self.rules = [
             ['netsh', 'advfirewall', 'firewall', 'add', 'rule',
-             f'name={rule_name}_OUT',
-             'dir=out',
+             f'name={rule_name}_{suffix}',
+             f'dir={direction}',
              'action=block',
              f'program={executable_path}',
-             'enable=yes'],
-            capture_output=True,
-            text=True
-        )
-        
-        if result_in.returncode == 0 and result_out.returncode == 0:
-            print(f"[SECURITY] Firewall rules added for {process_name}")
-            return True
-        else:
-            print(f"[SECURITY] Failed to add firewall rules:")
-            print(f"  Inbound: {result_in.stderr}")
-            print(f"  Outbound: {result_out.stderr}")
+             'enable=yes']
+            for suffix, direction in (('IN', 'in'), ('OUT', 'out'))
+        ]
+    
+    def commit(self):
+        """Add the rules; requires administrator privileges"""
+        if not is_admin():
+            print("[SECURITY] Cannot add firewall rule - not running as admin")
             return False
+        
+        try:
+            processes = [
+                subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+                for command in [self.cleanup] + self.rules
+            ]
+            results = []
+            for process in processes:
+                _, stderr = process.communicate()
+                results.append((process.returncode, stderr))
+            rule_results = results[1:]
             
-    except Exception as e:
-        print(f"[SECURITY] Error adding firewall rule: {e}")
-        return False
+            if all(returncode == 0 for returncode, _ in rule_results):
+                print(f"[SECURITY] Firewall rules added for {self.process_name}")
+                return True
+            else:
+                print(f"[SECURITY] Failed to add firewall rules:")
+                print(f"  Inbound: {rule_results[0][1]}")
+                print(f"  Outbound: {rule_results[1][1]}")
+                return False
+                
+        except Exception as e:
+            print(f"[SECURITY] Error adding firewall rule: {e}")
+            return False
+
+
+def add_firewall_block(executable_path, process_name):
+    """
+    Add Windows Firewall rule to block an executable
+    Requires administrator privileges
+    """
+    return StagedFirewallRule(executable_path, process_name).commit()
 
 
 def get_process_executable_path(pid):
@@ -164,11 +169,22 @@ class SecureBlocklist:
     def __init__(self, key_file='blocklist.key', data_file='blocklist.enc'):
         self.key_file = key_file
         self.data_file = data_file
-        self.cipher = self._load_or_create_key()
+        self._cipher = None
+        self._cipher_loaded = False
+    
+    @property
+    def cipher(self):
+        """Encryption key, loaded (and cryptography imported) on first use"""
+        if not self._cipher_loaded:
+            self._cipher = self._load_or_create_key()
+            self._cipher_loaded = True
+        return self._cipher
     
     def _load_or_create_key(self):
         """Load existing encryption key or create new one"""
         try:
+            from cryptography.fernet import Fernet
+            
             if os.path.exists(self.key_file):
                 with open(self.key_file, 'rb') as f:
                     key = f.read()
@@ -256,11 +272,22 @@ class SecureWhitelist:
     def __init__(self, key_file='whitelist.key', data_file='whitelist.enc'):
         self.key_file = key_file
         self.data_file = data_file
-        self.cipher = self._load_or_create_key()
+        self._cipher = None
+        self._cipher_loaded = False
+    
+    @property
+    def cipher(self):
+        """Encryption key, loaded (and cryptography imported) on first use"""
+        if not self._cipher_loaded:
+            self._cipher = self._load_or_create_key()
+            self._cipher_loaded = True
+        return self._cipher
     
     def _load_or_create_key(self):
         """Load existing encryption key or create new one"""
         try:
+            from cryptography.fernet import Fernet
+            
             if os.path.exists(self.key_file):
                 with open(self.key_file, 'rb') as f:
                     key = f.read()
@@ -340,27 +367,23 @@ class SecureWhitelist:
             return {}
 
 
-def verify_integrity():
+def verify_integrity(manifest=None):
     """
-    Basic self-integrity check
-    In production, this would hash critical files and verify signatures
+    Self-integrity check against the signed hash manifest (integrity.py)
+    Without a manifest, only checks that the critical files exist
     """
-    critical_files = [
-        'main.py',
-        'monitor.py',
-        'ui.py',
-        'config.py',
-        'security.py'
-    ]
+    from integrity import IntegrityManifest
     
-    missing_files = []
-    for file in critical_files:
-        if not os.path.exists(file):
-            missing_files.append(file)
+    manifest = manifest or IntegrityManifest()
+    problems = manifest.verify()
     
-    if missing_files:
-        print(f"[SECURITY] WARNING: Critical files missing: {missing_files}")
+    if problems:
+        print(f"[SECURITY] WARNING: Integrity check failed: {problems}")
         return False
     
-    print("[SECURITY] Integrity check passed")
+    if manifest.stats['state'] == 'verified':
+        print(f"[SECURITY] Integrity check passed ({manifest.stats['files']} files match the signed manifest, "
+              f"{manifest.stats['last_check_ms']} ms)")
+    else:
+        print("[SECURITY] Integrity check passed (no signed manifest, critical files present)")
     return True
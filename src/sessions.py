@@ -0,0 +1,331 @@
+"""
+SpamFisher Sessions
+Watched processes grouped into shards by network namespace and login
+session, so one agent on a terminal server or container host reads each
+namespace's socket table once, scans each shard on its own schedule and
+sends warnings to the session the remote access tool runs in
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from config import SETTINGS
+from sockets import USE_PROC
+
+
+# Audit session id of processes not started from a login (/proc/<pid>/sessionid)
+UNSET_SESSION = 4294967295
+
+ShardKey = Tuple[int, str]  # (network namespace inode, 0 if unknown; session: 's<audit id>', 'w<id>' or 'u<uid>')
+
+
+def namespace_of(pid: int, proc_root: str = '/proc') -> int:
+    """Inode of a process's network namespace (0 where there are none, or it cannot be read)"""
+    if not USE_PROC:
+        return 0
+    try:
+        link = os.readlink(f'{proc_root}/{pid}/ns/net')  # 'net:[4026531840]'
+    except OSError:
+        return 0
+    return int(link[5:-1])
+
+
+def session_of(pid: int, proc_root: str = '/proc') -> str:
+    """Login session of a process: audit session on Linux, Terminal Services session on Windows, else its user"""
+    if USE_PROC:
+        try:
+            with open(f'{proc_root}/{pid}/sessionid', 'rb') as f:
+                session = int(f.read())
+            if session != UNSET_SESSION:
+                return f's{session}'
+        except (OSError, ValueError):
+            pass
+        try:
+            return f'u{os.stat(f"{proc_root}/{pid}").st_uid}'
+        except OSError:
+            return ''
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+        session = wintypes.DWORD()
+        if ctypes.windll.kernel32.ProcessIdToSessionId(pid, ctypes.byref(session)):
+            return f'w{session.value}'
+        return ''
+    import psutil
+    try:
+        return f'u{psutil.Process(pid).uids().real}'
+    except psutil.Error:
+        return ''
+
+
+def shard_key(pid: int, proc_root: str = '/proc') -> ShardKey:
+    return (namespace_of(pid, proc_root), session_of(pid, proc_root))
+
+
+def shard_label(key: ShardKey) -> str:
+    """Session name used to route warnings, e.g. 's3@net:4026531840' (the same seen from any namespace)"""
+    namespace, session = key
+    return f'{session}@net:{namespace}' if namespace else session
+
+
+def local_session() -> str:
+    """Label of the session this process runs in (what a session UI client asks for)"""
+    return shard_label(shard_key(os.getpid()))
+
+
+class Shard:
+    """Watched processes sharing a network namespace and login session"""
+    
+    __slots__ = ('key', 'label', 'pids', 'interval', 'next_due', 'due', 'active', 'fresh', 'scans')
+    
+    def __init__(self, key: ShardKey, label: str):
+        self.key = key
+        self.label = label
+        self.pids: List[int] = []
+        self.interval = SETTINGS['check_interval']
+        self.next_due = 0.0
+        self.due = True  # Scanned this cycle
+        self.active = True  # Something in the shard was scored on its last scan
+        self.fresh = True  # A process joined since the last scan
+        self.scans = 0
+        
+    def to_dict(self) -> Dict:
+        return {'session': self.label, 'namespace': self.key[0], 'pids': list(self.pids),
+                'interval': self.interval, 'scans': self.scans}
+
+
+class ShardTable:
+    """
+    Assigns watched PIDs to shards once (the namespace and session of a
+    process are read when it first appears) and decides each cycle which
+    shards are scanned. A shard where anything was scored last time, or
+    that a process has just joined, is scanned every check_interval; one
+    whose processes were all quiet backs off, doubling its interval up to
+    shard_idle_interval. With session_sharding 'auto' the back-off only
+    applies once more than one shard exists, so a desktop install keeps
+    scanning every cycle.
+    """
+    
+    def __init__(self, proc_root: str = '/proc'):
+        self.proc_root = proc_root
+        self.host_namespace = namespace_of(os.getpid(), proc_root)  # The one /proc/net shows
+        self.keys: Dict[int, ShardKey] = {}  # pid -> shard key
+        self.shards: Dict[ShardKey, Shard] = {}
+        self.refresh = 0  # Plans until the keys are read again (a process may unshare or setns)
+        self.stats = {'shards': 0, 'namespaces': 0, 'scanned': 0, 'deferred': 0}
+        
+    def shard_of(self, pid: int) -> Optional[Shard]:
+        key = self.keys.get(pid)
+        return self.shards.get(key) if key is not None else None
+        
+    def label_of(self, pid: int) -> Optional[str]:
+        shard = self.shard_of(pid)
+        return shard.label if shard is not None else None
+        
+    def touch(self, pid: int):
+        """Mark the shard of a PID that was scored (not skipped as quiet) this cycle"""
+        shard = self.shard_of(pid)
+        if shard is not None:
+            shard.active = True
+            
+    def assign(self, running_software):
+        """Group this scan's watched processes into shards"""
+        self.refresh -= 1
+        reread = self.refresh <= 0
+        if reread:
+            self.refresh = SETTINGS['process_refresh_cycles']
+        if len(self.keys) > len(running_software):
+            running = {software.pid for software in running_software}
+            for pid in [pid for pid in self.keys if pid not in running]:
+                del self.keys[pid]
+                
+        for shard in self.shards.values():
+            shard.pids.clear()
+        occupied = 0
+        for software in running_software:
+            key = self.keys.get(software.pid)
+            moved = key is None
+            if moved or reread:
+                current = shard_key(software.pid, self.proc_root)
+                moved = current != key
+                key = self.keys[software.pid] = current
+            shard = self.shards.get(key)
+            if shard is None:
+                shard = self.shards[key] = Shard(key, shard_label(key))
+            if not shard.pids:
+                occupied += 1
+            shard.pids.append(software.pid)
+            if moved:
+                shard.fresh = True
+        if len(self.shards) > occupied:
+            for key in [key for key, shard in self.shards.items() if not shard.pids]:
+                del self.shards[key]
+                
+    def plan(self, running_software, now: float) -> Tuple[List, Optional[Dict[int, int]]]:
+        """
+        Watched processes to scan this cycle, and for those in another
+        network namespace the PID whose /proc/<pid>/net holds their sockets
+        (None when all are in the host namespace).
+        """
+        self.assign(running_software)
+        sharding = SETTINGS['session_sharding']
+        backoff = sharding is True or (sharding == 'auto' and len(self.shards) > 1)
+        check_interval = SETTINGS['check_interval']
+        
+        deferred = 0
+        namespaces = None  # pid -> PID whose /proc/<pid>/net is read, outside the host namespace
+        readers = None  # namespace -> that PID
+        for shard in self.shards.values():
+            shard.due = not backoff or shard.fresh or shard.active or now >= shard.next_due
+            if not shard.due:
+                deferred += len(shard.pids)
+                continue
+            if backoff:
+                shard.interval = check_interval if shard.active or shard.fresh else \
+                    min(shard.interval * 2, SETTINGS['shard_idle_interval'])
+            else:
+                shard.interval = check_interval
+            # Half a cycle early, so a shard is not pushed back a whole cycle by scan jitter
+            shard.next_due = now + shard.interval - check_interval / 2
+            shard.active = shard.fresh = False
+            shard.scans += 1
+            namespace = shard.key[0]
+            if namespace and namespace != self.host_namespace:
+                if namespaces is None:
+                    namespaces, readers = {}, {}
+                reader = readers.get(namespace)
+                if reader is None:
+                    reader = readers[namespace] = shard.pids[0]
+                for pid in shard.pids:
+                    namespaces[pid] = reader
+                    
+        self.stats['shards'] = len(self.shards)
+        self.stats['namespaces'] = len({key[0] for key in self.shards})
+        self.stats['scanned'] += len(running_software) - deferred
+        self.stats['deferred'] += deferred
+        if not deferred:
+            return running_software, namespaces
+        return [software for software in running_software if self.shard_of(software.pid).due], namespaces
+        
+    def to_list(self) -> List[Dict]:
+        return [shard.to_dict() for shard in self.shards.values()]
+
+
+class WarningRouter:
+    """
+    Warnings for sessions with a UI client connected (control.py session)
+    are queued for that client instead of being shown on the agent's own
+    display. A client is attached for as long as its control connection
+    is open. When it disconnects, the warnings it received but did not
+    decide are handed back (and its session's queue, if it was the last
+    client there), and so is any warning still undecided
+    session_warning_timeout seconds after it was routed, so the agent
+    can warn about it itself.
+    """
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.clients: Dict[int, str] = {}  # client id -> session label, while its connection is open
+        self.next_client = 1
+        self.queues: Dict[str, deque] = {}  # session label -> threats not yet collected
+        self.routed: Dict[int, list] = {}  # threat id -> [threat, client id once delivered, monotonic time routed]
+        self.stats = {'routed': 0, 'delivered': 0, 'returned': 0}
+        
+    def attach(self, session: str) -> int:
+        """Register a client connection; returns its id (call detach() when it closes)"""
+        with self.condition:
+            client = self.next_client
+            self.next_client += 1
+            self.clients[client] = session
+        return client
+        
+    def session_of(self, client: int) -> Optional[str]:
+        with self.condition:
+            return self.clients.get(client)
+            
+    def has_client(self, session: Optional[str]) -> bool:
+        if session is None:
+            return False
+        with self.condition:
+            return session in self.clients.values()
+            
+    def dispatch(self, threat):
+        """Queue a recorded threat for its session's client (check has_client() first)"""
+        with self.condition:
+            self.queues.setdefault(threat.session, deque()).append(threat)
+            self.routed[threat.id] = [threat, None, time.monotonic()]
+            self.stats['routed'] += 1
+            self.condition.notify_all()
+            
+    def wait(self, client: int, timeout: float):
+        """Next threat for a client's session, or None after timeout seconds (called by the control server)"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            session = self.clients[client]
+            while True:
+                queue = self.queues.get(session)
+                if queue:
+                    threat = queue.popleft()
+                    entry = self.routed.get(threat.id)
+                    if entry is None:
+                        continue  # Decided through the control API before its client collected it
+                    entry[1] = client
+                    self.stats['delivered'] += 1
+                    return threat
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+                
+    def owns(self, client: int, threat_id: int) -> bool:
+        """True if a threat was routed to the session of a client (and is still undecided)"""
+        with self.condition:
+            entry = self.routed.get(threat_id)
+            return entry is not None and entry[0].session == self.clients.get(client)
+            
+    def settle(self, threat) -> bool:
+        """Forget a decided threat; True if it had been routed to a session client"""
+        with self.condition:
+            return self.routed.pop(threat.id, None) is not None
+            
+    def take_back(self, threat_ids) -> List:
+        """Unroute threats (lock held): out of their queue and no longer owned by a client"""
+        threats = []
+        for threat_id in threat_ids:
+            threat = self.routed.pop(threat_id)[0]
+            queue = self.queues.get(threat.session)
+            if queue and threat in queue:
+                queue.remove(threat)
+            threats.append(threat)
+        self.stats['returned'] += len(threats)
+        return threats
+        
+    def detach(self, client: int) -> List:
+        """A client's connection closed: the threats that now have nobody to decide them"""
+        with self.condition:
+            session = self.clients.pop(client, None)
+            last = session not in self.clients.values()
+            returned = [threat_id for threat_id, (threat, owner, _) in self.routed.items()
+                        if owner == client or (last and owner is None and threat.session == session)]
+            threats = self.take_back(returned)
+            if last:
+                self.queues.pop(session, None)
+        return threats
+        
+    def expire(self, now: float = None) -> List:
+        """Threats routed more than session_warning_timeout seconds ago and still undecided"""
+        now = time.monotonic() if now is None else now
+        timeout = SETTINGS['session_warning_timeout']
+        with self.condition:
+            if not self.routed:
+                return []
+            return self.take_back([threat_id for threat_id, (_, _, routed_at) in self.routed.items()
+                                   if now - routed_at >= timeout])
+                                   
+    def sessions(self) -> List[str]:
+        """Sessions with a client attached"""
+        with self.condition:
+            return sorted(set(self.clients.values()))
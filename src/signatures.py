@@ -0,0 +1,163 @@
+"""
+SpamFisher Detection Signatures
+Versioned, hot-reloadable database of remote access software
+"""
+
+import json
+import logging
+import os
+import sys
+from typing import Dict, Optional, Tuple
+from config import REMOTE_ACCESS_SOFTWARE, SCORING, SETTINGS
+
+
+def resolve_data_path(path: str) -> str:
+    """Resolve a data file name relative to the SpamFisher source directory"""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+
+
+class SignatureSet:
+    """
+    Immutable, validated signature database with a precompiled
+    process-name matcher. Replaced as a whole on reload, never mutated.
+    """
+    
+    def __init__(self, version: int, software: Dict[str, Dict]):
+        self.version = version
+        self.software = software
+        
+        # Precompiled matcher: case-folded process name -> (interned key, entry)
+        self.matcher = {}
+        for key, entry in software.items():
+            key = sys.intern(key)
+            for process_name in entry['process_names']:
+                self.matcher[process_name.casefold()] = (key, entry)
+                
+    def match(self, process_name: Optional[str]) -> Optional[Tuple[str, Dict]]:
+        """Return (software key, entry) for a process name, or None"""
+        if not process_name:
+            return None
+        return self.matcher.get(process_name.casefold())
+        
+    def match_folded(self, folded_name: str) -> Optional[Tuple[str, Dict]]:
+        """match() for a name that is already case-folded (no per-call string)"""
+        return self.matcher.get(folded_name)
+        
+    def get(self, key: Optional[str]) -> Dict:
+        """Entry for a software key ({} if unknown)"""
+        return self.software.get(key, {})
+
+
+def is_number(value) -> bool:
+    """True for int or float values, not bool"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_scoring(key: str, scoring) -> None:
+    """Check a per-software scoring override against the SCORING defaults (raises ValueError)"""
+    if not isinstance(scoring, dict):
+        raise ValueError(f"Entry {key}: 'scoring' must be an object")
+        
+    for name, value in scoring.items():
+        if name not in SCORING:
+            raise ValueError(f"Entry {key}: unknown scoring setting '{name}'")
+        if name == 'weights':
+            # Unknown weight names are allowed: they weigh features added with register_feature()
+            if not isinstance(value, dict) or not all(
+                    isinstance(w, str) and is_number(v) for w, v in value.items()):
+                raise ValueError(f"Entry {key}: scoring 'weights' must map feature names to numbers")
+        elif name == 'window':
+            if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+                raise ValueError(f"Entry {key}: scoring 'window' must be a positive integer")
+        elif not is_number(value) or value < 0:
+            raise ValueError(f"Entry {key}: scoring '{name}' must be a non-negative number")
+
+
+def validate(data) -> SignatureSet:
+    """Validate raw signature data and build a SignatureSet (raises ValueError)"""
+    if not isinstance(data, dict):
+        raise ValueError("Signature file must be a JSON object")
+        
+    version = data.get('version')
+    if not isinstance(version, int) or isinstance(version, bool) or version < 1:
+        raise ValueError("Signature file needs a positive integer 'version'")
+        
+    software = data.get('software')
+    if not isinstance(software, dict) or not software:
+        raise ValueError("Signature file needs a non-empty 'software' object")
+        
+    validated = {}
+    for key, entry in software.items():
+        if not isinstance(entry, dict):
+            raise ValueError(f"Invalid entry format: {key}")
+            
+        names = entry.get('process_names')
+        if not isinstance(names, list) or not names or not all(isinstance(n, str) and n for n in names):
+            raise ValueError(f"Entry {key}: 'process_names' must be a non-empty list of strings")
+            
+        ports = entry.get('ports')
+        if not isinstance(ports, list) or not all(
+                isinstance(p, int) and not isinstance(p, bool) and 0 < p < 65536 for p in ports):
+            raise ValueError(f"Entry {key}: 'ports' must be a list of port numbers")
+            
+        if not isinstance(entry.get('display_name'), str) or not entry['display_name']:
+            raise ValueError(f"Entry {key}: missing 'display_name'")
+            
+        if 'scoring' in entry:
+            validate_scoring(key, entry['scoring'])
+            
+        validated[key] = entry
+        
+    return SignatureSet(version, validated)
+
+
+class SignatureStore:
+    """
+    Loads signatures from the data file and keeps `current` up to date.
+    Readers take one reference to `current` per scan; a reload builds a
+    complete new SignatureSet and swaps the reference, so a scan never
+    sees a half-updated database and never waits on a reload.
+    """
+    
+    def __init__(self, path: str = None):
+        self.path = resolve_data_path(path or SETTINGS['signatures_file'])
+        self.current = SignatureSet(0, dict(REMOTE_ACCESS_SOFTWARE))  # Built-in fallback
+        self.file_state = None
+        self.reload()
+        
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            return None
+            
+    def reload(self) -> bool:
+        """Load the data file if it changed; returns True if signatures were swapped"""
+        state = self._stat()
+        if state is None or state == self.file_state:
+            return False
+        self.file_state = state
+        
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                candidate = validate(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"[SIGNATURES] Rejected {self.path}: {e}")
+            if SETTINGS['log_events']:
+                logging.error(f"Rejected signature file {self.path}: {e}")
+            return False
+            
+        if candidate.version < self.current.version:
+            print(f"[SIGNATURES] Ignoring downgrade from version {self.current.version} to {candidate.version}")
+            if SETTINGS['log_events']:
+                logging.warning(f"Ignored signature downgrade to version {candidate.version}")
+            return False
+            
+        self.current = candidate
+        print(f"[SIGNATURES] Loaded version {candidate.version}: {len(candidate.software)} programs")
+        if SETTINGS['log_events']:
+            logging.info(f"Loaded signatures version {candidate.version} ({len(candidate.software)} programs)")
+        return True
@@ -0,0 +1,293 @@
+"""
+SpamFisher Status Segment
+Live state published in a small fixed-layout shared memory block so the
+tray, the warning UI and external dashboards can read it without a
+syscall or a round trip to the control socket
+"""
+
+import os
+import struct
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Optional
+from config import SETTINGS
+from records import unpack_ip
+
+
+MAGIC = b'SFSTATUS'
+VERSION = 1
+
+# magic, layout version, body size, sequence. The sequence is a seqlock:
+# odd while the writer is updating the body, bumped to the next even
+# value when it is done. Readers retry until they see the same even
+# value before and after copying the body.
+HEADER = struct.Struct('<8sIIQ')
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 16
+
+# Body fields in layout order. Never reorder; append and bump VERSION.
+FIELDS = (
+    ('publisher_pid', 'I'),
+    ('flags', 'I'),
+    ('started_at', 'd'),
+    ('updated_at', 'd'),
+    ('last_scan_at', 'd'),  # Wall clock end of the last classified scan
+    ('scan_duration', 'd'),  # Seconds of enumerate + classify work
+    ('cycles', 'Q'),
+    ('watched', 'I'),  # Watched processes found by the last scan
+    ('pending', 'I'),
+    ('detected', 'I'),
+    ('blocked', 'I'),
+    ('block_failed', 'I'),
+    ('allowed', 'I'),
+    ('auto_blocked', 'I'),
+    # Active threat: the newest one awaiting a decision
+    ('threat_id', 'I'),
+    ('threat_pid', 'I'),
+    ('threat_port', 'I'),
+    ('threat_score', 'd'),
+    ('threat_detected_at', 'd'),
+    ('threat_ip', '16s'),  # records.pack_ip() as 16 big-endian bytes
+    ('threat_software', '32s'),
+    ('threat_country', '32s'),
+)
+BODY = struct.Struct('<' + ''.join(fmt for _, fmt in FIELDS))
+SIZE = HEADER.size + BODY.size
+
+FLAG_RUNNING = 1
+FLAG_LISTS_LOADED = 2
+FLAG_WARNING_ACTIVE = 4
+FLAG_THREAT_ACTIVE = 8
+
+READ_ATTEMPTS = 100
+
+# Names this process publishes. The resource tracker keeps one entry per
+# name, so a reader in the publishing process must not untrack it.
+published = set()
+
+
+class StatusBusy(Exception):
+    """Another live SpamFisher instance already publishes under this name"""
+
+
+def segment_name() -> str:
+    return SETTINGS['status_segment']
+
+
+def text_field(value: str, size: int = 32) -> bytes:
+    """UTF-8 truncated to a fixed-width field without splitting a character"""
+    return value.encode('utf-8')[:size].decode('utf-8', 'ignore').encode('utf-8')
+
+
+def threat_fields(threat) -> Dict:
+    """Active threat fields for publish(); all zero when there is none"""
+    if threat is None:
+        return {'threat_id': 0, 'threat_pid': 0, 'threat_port': 0, 'threat_score': 0.0,
+                'threat_detected_at': 0.0, 'threat_ip': b'', 'threat_software': b'', 'threat_country': b''}
+    return {
+        'threat_id': threat.id or 0,
+        'threat_pid': threat.pid,
+        'threat_port': threat.remote_port,
+        'threat_score': threat.score,
+        'threat_detected_at': threat.detected_at,
+        'threat_ip': threat.remote_ip.to_bytes(16, 'big'),
+        'threat_software': text_field(threat.software_name),
+        'threat_country': text_field(threat.country or '')
+    }
+
+
+def untrack(shm: shared_memory.SharedMemory):
+    """Stop this process's resource tracker from unlinking a segment it does not own at exit"""
+    if os.name == 'posix':
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+
+def attach(name: str) -> shared_memory.SharedMemory:
+    """Open an existing segment as a reader"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if name not in published:
+            untrack(shm)
+        return shm
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        import psutil
+        return psutil.pid_exists(pid)
+    except ImportError:
+        return True
+
+
+class StatusWriter:
+    """Single publisher; publish() may be called from any thread"""
+    
+    def __init__(self, name: str = None):
+        self.name = name or segment_name()
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.values = {field: (b'' if fmt.endswith('s') else 0) for field, fmt in FIELDS}
+        self.values['publisher_pid'] = os.getpid()
+        self.shm = self.open()
+        published.add(self.name)
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, BODY.size, self.sequence)
+        
+    def open(self) -> shared_memory.SharedMemory:
+        """Create the segment, taking over one left behind by a crashed instance"""
+        try:
+            return shared_memory.SharedMemory(name=self.name, create=True, size=SIZE)
+        except FileExistsError:
+            pass
+            
+        existing = shared_memory.SharedMemory(name=self.name)  # Tracked: ours to unlink if stale
+        current = read_segment(existing)
+        if current and current['running'] and current['publisher_pid'] != os.getpid() \
+                and pid_alive(current['publisher_pid']):
+            untrack(existing)
+            existing.close()
+            raise StatusBusy(f"PID {current['publisher_pid']} already publishes status as {self.name}")
+        if existing.size >= SIZE:
+            self.sequence = SEQUENCE.unpack_from(existing.buf, SEQUENCE_OFFSET)[0] & ~1
+            return existing
+        existing.close()
+        existing.unlink()
+        return shared_memory.SharedMemory(name=self.name, create=True, size=SIZE)
+        
+    def publish(self, **values):
+        """Update the given fields and make the new state visible atomically"""
+        with self.lock:
+            if self.shm is None:
+                return
+            self.values.update(values)
+            self.values['updated_at'] = time.time()
+            body = BODY.pack(*(self.values[field] for field, _ in FIELDS))
+            
+            buf = self.shm.buf
+            SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, self.sequence + 1)
+            buf[HEADER.size:SIZE] = body
+            self.sequence += 2
+            SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, self.sequence)
+            
+    def close(self):
+        """Mark the publisher stopped and remove the segment"""
+        self.publish(flags=self.values['flags'] & ~FLAG_RUNNING)
+        with self.lock:
+            shm, self.shm = self.shm, None
+        if shm is not None:
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+            published.discard(self.name)
+
+
+def read_segment(shm: shared_memory.SharedMemory) -> Optional[Dict]:
+    """Consistent snapshot of an attached segment, or None if it is not a status block"""
+    buf = shm.buf
+    magic, version, body_size, _ = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION or body_size != BODY.size:
+        return None
+        
+    for _ in range(READ_ATTEMPTS):
+        before = SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)[0]
+        if before & 1:
+            time.sleep(0)  # Writer mid-update
+            continue
+        body = bytes(buf[HEADER.size:SIZE])
+        if SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)[0] == before:
+            break
+    else:
+        return None
+        
+    status = dict(zip((field for field, _ in FIELDS), BODY.unpack(body)))
+    status['sequence'] = before
+    flags = status['flags']
+    status['running'] = bool(flags & FLAG_RUNNING)
+    status['lists_loaded'] = bool(flags & FLAG_LISTS_LOADED)
+    status['warning_active'] = bool(flags & FLAG_WARNING_ACTIVE)
+    
+    ip = status.pop('threat_ip')
+    software = status.pop('threat_software').rstrip(b'\0').decode('utf-8', 'replace')
+    country = status.pop('threat_country').rstrip(b'\0').decode('utf-8', 'replace')
+    pid, port, score, detected_at = (status.pop(key) for key in
+                                     ('threat_pid', 'threat_port', 'threat_score', 'threat_detected_at'))
+    threat_id = status.pop('threat_id')
+    status['threat'] = {
+        'id': threat_id,
+        'software_name': software,
+        'pid': pid,
+        'remote_ip': unpack_ip(int.from_bytes(ip, 'big')),
+        'remote_port': port,
+        'country': country,
+        'score': score,
+        'detected_at': detected_at
+    } if flags & FLAG_THREAT_ACTIVE else None
+    return status
+
+
+class StatusReader:
+    """Attaches lazily, so it can be created before the publisher starts"""
+    
+    def __init__(self, name: str = None):
+        self.name = name or segment_name()
+        self.shm = None
+        
+    def read(self) -> Optional[Dict]:
+        """Latest published status, or None if nothing is published"""
+        if self.shm is None:
+            try:
+                self.shm = attach(self.name)
+            except FileNotFoundError:
+                return None
+        status = read_segment(self.shm)
+        if status is not None and not status['running']:
+            self.close()  # Publisher stopped; attach to its successor next time
+        return status
+        
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+
+
+def describe(status: Optional[Dict]) -> str:
+    """One-line summary for the tray and the command line"""
+    if status is None or not status['running']:
+        return "SpamFisher - Not running"
+    if not status['last_scan_at']:
+        return "SpamFisher - Starting..."
+    age = max(0.0, time.time() - status['last_scan_at'])
+    return (f"Last scan {age:.0f}s ago ({status['scan_duration'] * 1000:.0f} ms), "
+            f"watching {status['watched']}")
+
+
+def main():
+    """Print the published status: status.py [--watch]"""
+    import json
+    
+    reader = StatusReader()
+    try:
+        while True:
+            status = reader.read()
+            if status is None:
+                print(f"No SpamFisher status published as {reader.name}")
+            else:
+                print(json.dumps(status, indent=2))
+                print(describe(status))
+            if '--watch' not in sys.argv[1:]:
+                break
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+    sys.exit(0 if status is not None else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,24 +3,35 @@ SpamFisher Warning UI
 Full-screen warning interface shown when threat is detected
 """
 
+import time
 import tkinter as tk
-from tkinter import font
-from typing import Callable, Dict
+from typing import Callable, Optional
+from assets import warning_layout
 from config import WARNING_MESSAGES, SETTINGS
+from records import Threat, pack_ip
+from status import StatusReader
+
+
+WIDGETS = {'label': tk.Label, 'frame': tk.Frame, 'button': tk.Button}
 
 
 class WarningScreen:
     """Full-screen warning overlay"""
     
-    def __init__(self, threat_info: Dict, on_block: Callable, on_allow: Callable):
+    def __init__(self, threat_info: Threat, on_block: Callable, on_allow: Callable,
+                 on_visible: Optional[Callable[[float], None]] = None):
         self.threat_info = threat_info
         self.on_block = on_block
         self.on_allow = on_allow
+        self.on_visible = on_visible  # Called with seconds from show() until the window is mapped
         self.language = SETTINGS['default_language']
         self.root = None
+        self.status = StatusReader()  # Live state published by the monitor
+        self.session_label = None
         
     def show(self):
         """Display the full-screen warning"""
+        started = time.perf_counter()
         self.root = tk.Tk()
         
         # Make it full-screen and topmost
@@ -31,151 +42,52 @@ class WarningScreen:
         # Prevent closing with Alt+F4
         self.root.protocol("WM_DELETE_WINDOW", lambda: None)
         
-        # Get messages for current language
-        messages = WARNING_MESSAGES[self.language]
+        if self.on_visible:
+            def mapped(event):
+                if event.widget is self.root:
+                    self.root.unbind('<Map>')
+                    self.on_visible(time.perf_counter() - started)
+            self.root.bind('<Map>', mapped)
         
         # Main container
         container = tk.Frame(self.root, bg='#1a1a1a')
         container.place(relx=0.5, rely=0.5, anchor='center')
         
-        # Title
-        title_font = font.Font(family='Arial', size=32, weight='bold')
-        title = tk.Label(
-            container,
-            text=messages['title'],
-            font=title_font,
-            bg='#1a1a1a',
-            fg='#ff4444',
-            pady=20
-        )
-        title.pack()
-        
-        # Connection info
-        info_font = font.Font(family='Arial', size=18, weight='bold')
-        connection_info = tk.Label(
-            container,
-            text=messages['connection_from'].format(country=self.threat_info['country']),
-            font=info_font,
-            bg='#1a1a1a',
-            fg='#ffaa00',
-            pady=10
-        )
-        connection_info.pack()
-        
-        # Separator
-        separator = tk.Frame(container, bg='#444444', height=2)
-        separator.pack(fill='x', padx=50, pady=20)
-        
-        # How scam works section
-        scam_font = font.Font(family='Arial', size=16, weight='bold')
-        scam_title = tk.Label(
-            container,
-            text=messages['how_scam_works'],
-            font=scam_font,
-            bg='#1a1a1a',
-            fg='#ffffff',
-            pady=10
-        )
-        scam_title.pack()
-        
-        # Steps
-        steps_font = font.Font(family='Arial', size=14)
-        steps_text = f"{messages['step1']}\n\n{messages['step2']}\n\n{messages['step3']}\n\n{messages['step4']}"
-        steps = tk.Label(
-            container,
-            text=steps_text,
-            font=steps_font,
-            bg='#1a1a1a',
-            fg='#cccccc',
-            justify='left',
-            pady=10
-        )
-        steps.pack()
-        
-        # Warnings
-        warning_font = font.Font(family='Arial', size=15, weight='bold')
-        warning1 = tk.Label(
-            container,
-            text=messages['warning1'],
-            font=warning_font,
-            bg='#1a1a1a',
-            fg='#ff6666',
-            pady=10,
-            wraplength=800
-        )
-        warning1.pack()
-        
-        warning2 = tk.Label(
-            container,
-            text=messages['warning2'],
-            font=warning_font,
-            bg='#1a1a1a',
-            fg='#ff6666',
-            pady=5,
-            wraplength=800
-        )
-        warning2.pack()
-        
-        # Separator
-        separator2 = tk.Frame(container, bg='#444444', height=2)
-        separator2.pack(fill='x', padx=50, pady=20)
-        
-        # Buttons frame
-        buttons_frame = tk.Frame(container, bg='#1a1a1a')
-        buttons_frame.pack(pady=20)
-        
-        # Block button (large and prominent)
-        button_font = font.Font(family='Arial', size=20, weight='bold')
-        block_btn = tk.Button(
-            buttons_frame,
-            text=messages['block_button'],
-            font=button_font,
-            bg='#ff4444',
-            fg='#ffffff',
-            activebackground='#cc0000',
-            activeforeground='#ffffff',
-            command=self.handle_block,
-            padx=40,
-            pady=20,
-            cursor='hand2',
-            relief='raised',
-            bd=5
-        )
-        block_btn.pack(pady=10)
-        
-        # Allow button (smaller, less prominent)
-        allow_font = font.Font(family='Arial', size=14)
-        allow_btn = tk.Button(
-            buttons_frame,
-            text=messages['allow_button'],
-            font=allow_font,
-            bg='#333333',
-            fg='#999999',
-            activebackground='#444444',
-            activeforeground='#ffffff',
-            command=self.handle_allow,
-            padx=20,
-            pady=10,
-            cursor='hand2',
-            relief='flat'
-        )
-        allow_btn.pack(pady=10)
-        
-        # Advice
-        advice_font = font.Font(family='Arial', size=13)
-        advice = tk.Label(
-            container,
-            text=messages['advice'],
-            font=advice_font,
-            bg='#1a1a1a',
-            fg='#888888',
-            pady=20,
-            wraplength=800
-        )
-        advice.pack()
+        # Texts, fonts and sizes come pre-resolved for this language and DPI
+        layout = warning_layout(self.language, round(self.root.winfo_fpixels('1i')))
+        commands = {'block': self.handle_block, 'allow': self.handle_allow}
+        widgets = {'container': container}
+        for item in layout['widgets']:
+            options = dict(item['options'])
+            if item['role'] == 'connection':
+                options['text'] = options['text'].format(country=self.threat_info.country)
+            if item['role'] in commands:
+                options['command'] = commands[item['role']]
+            widget = WIDGETS[item['widget']](widgets[item['parent']], **options)
+            widget.pack(**item['pack'])
+            widgets[item['role']] = widget
+        
+        # Live session time, read from the shared status block
+        self.session_label = widgets['session']
+        self.refresh_session()
         
         # Start the GUI
-        self.root.mainloop()
+        try:
+            self.root.mainloop()
+        finally:
+            self.status.close()
+    
+    def refresh_session(self):
+        """Update the session timer once a second while the monitor still reports this threat"""
+        status = self.status.read()
+        active = status and status['running'] and status['threat']
+        if not active or active['id'] != self.threat_info.id:
+            self.session_label.config(text='')
+        else:
+            elapsed = int(max(0.0, time.time() - self.threat_info.detected_at))
+            text = WARNING_MESSAGES[self.language]['session_open']
+            self.session_label.config(text=text.format(elapsed=f"{elapsed // 60}m {elapsed % 60:02d}s"))
+        self.root.after(1000, self.refresh_session)
     
     def handle_block(self):
         """User clicked BLOCK"""
@@ -190,12 +102,7 @@ class WarningScreen:
 
 def test_ui():
     """Test the warning UI"""
-    threat_info = {
-        'software_name': 'AnyDesk',
-        'remote_ip': '192.168.1.100',
-        'country': 'India',
-        'pid': 1234
-    }
+    threat_info = Threat('AnyDesk', 'AnyDesk.exe', 1234, pack_ip('192.168.1.100'), 7070, 'India')
     
     def on_block(info):
         print(f"User chose to BLOCK: {info}")